@@ -0,0 +1,336 @@
+"""
+Compiled Startup Artifacts
+==========================
+Caches the compiled fuzzy engine, its base score surface and the columnar
+gift catalog on disk, so a cold start does not have to compile the rule
+base, tabulate the surface or parse gifts.json again.
+
+Each artifact is a directory of .npy arrays plus a manifest, named after a
+content hash of the files it was built from. Any change to the rule base
+file, the compiler or the catalog produces a new name, so a stale artifact is never
+loaded. Arrays are memory-mapped read-only, which also lets every process
+on a machine share the same pages. The catalog artifact also stores the gift
+records (see records.py), so gifts.json is only parsed to build it.
+
+Artifacts of previous rules and catalogs are kept, so switching back to
+them is free and processes still using them are not disturbed; run
+``python artifact.py --prune`` to delete all but the most recently used.
+
+Run ``python artifact.py [path/to/gifts.json]`` to convert a JSON catalog
+ahead of time.
+
+Configuration (environment variables):
+- FUZZY_ARTIFACT_DIR: Directory for the artifacts (default: data/compiled);
+  set it to an empty string to disable them
+- FUZZY_ARTIFACT_KEEP: Artifacts of each kind kept by --prune (default: 3)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from catalog import GiftCatalog
+from inference import CompiledFuzzyEngine
+from records import GiftRecords
+from surface import ScoreSurface
+
+# Bump when the layout of the artifacts changes
+ARTIFACT_FORMAT = 2
+
+# Artifacts of each kind kept by prune_artifacts
+ARTIFACT_KEEP = max(1, int(os.environ.get('FUZZY_ARTIFACT_KEEP', 3)))
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Files whose content determines each artifact
+ENGINE_SOURCES = ['rulebase.py', 'inference.py']
+SURFACE_SOURCES = ENGINE_SOURCES + ['surface.py']
+CATALOG_SOURCES = ['catalog.py', 'records.py']
+
+GIFTS_PATH = os.path.join(BACKEND_DIR, 'data', 'gifts.json')
+
+
+def artifact_dir() -> Optional[str]:
+    """Return the configured artifact directory, or None if disabled."""
+    directory = os.environ.get('FUZZY_ARTIFACT_DIR', os.path.join(BACKEND_DIR, 'data', 'compiled'))
+    return directory or None
+
+
+def content_hash(paths: List[str]) -> str:
+    """Hash the format version and the contents of the given files."""
+    digest = hashlib.sha256(f"format {ARTIFACT_FORMAT}\n".encode())
+    for path in paths:
+        if not os.path.isabs(path):
+            path = os.path.join(BACKEND_DIR, path)
+        with open(path, 'rb') as f:
+            digest.update(os.path.basename(path).encode() + b'\n')
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _write(directory: str, name: str, manifest: Dict, arrays: Dict[str, np.ndarray]):
+    """Write an artifact atomically: build it aside, then rename it into place."""
+    os.makedirs(directory, exist_ok=True)
+    final = os.path.join(directory, name)
+    if os.path.isdir(final):
+        return
+
+    staging = tempfile.mkdtemp(prefix=f".{name}.", dir=directory)
+    try:
+        for key, array in arrays.items():
+            np.save(os.path.join(staging, f"{key}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        os.replace(staging, final)
+    except OSError:
+        # Another process published the same artifact first
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(final):
+            raise
+
+
+def _read(directory: str, name: str) -> Optional[Tuple[Dict, Dict[str, np.ndarray]]]:
+    """Read an artifact's manifest and memory-map its arrays, or None if absent."""
+    path = os.path.join(directory, name)
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        arrays = {
+            key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode='r').view(np.ndarray)
+            for key in manifest['arrays']
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        # Marks the artifact as recently used, see prune_artifacts
+        os.utime(path)
+    except OSError:
+        pass
+    return manifest, arrays
+
+
+def prune_artifacts(directory: str, keep: int = ARTIFACT_KEEP, in_use: Iterable[str] = ()) -> List[str]:
+    """
+    Delete all but the most recently used artifacts of each kind.
+
+    Artifacts are never deleted when they are published or replaced, as
+    other processes may still be about to open them; run this from the
+    command line (``python artifact.py --prune``) while no older server is
+    using the directory.
+
+    Args:
+        directory: Artifact directory
+        keep: Artifacts kept per kind (engine, surface, catalog)
+        in_use: Names of artifacts to keep in any case
+
+    Returns:
+        Names of the deleted artifacts
+    """
+    in_use = set(in_use)
+    kinds: Dict[str, List[Tuple[float, str]]] = {}
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        # Hidden entries are artifacts being written
+        if entry.startswith('.') or '-' not in entry or not os.path.isdir(path):
+            continue
+        kinds.setdefault(entry.split('-', 1)[0], []).append((os.path.getmtime(path), entry))
+
+    deleted = []
+    for entries in kinds.values():
+        entries.sort(reverse=True)
+        for _, entry in entries[keep:]:
+            if entry not in in_use:
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+                deleted.append(entry)
+    return sorted(deleted)
+
+
+def save_engine(directory: str, key: str, engine: CompiledFuzzyEngine):
+    """
+    Save the definition of a compiled engine.
+
+    Membership tables of all variables are packed into one array; the
+    manifest records each table's offset and the rules of every controller.
+    """
+    inputs, output, rules, controllers = engine.definition
+    tables = []
+    offset = 0
+
+    def pack(universe, terms) -> Dict:
+        nonlocal offset
+        universe = np.asarray(universe, dtype=np.float64)
+        entry = {'universe': offset, 'length': len(universe), 'terms': []}
+        tables.append(universe)
+        offset += len(universe)
+        for label, table in terms.items():
+            entry['terms'].append([label, offset])
+            tables.append(np.asarray(table, dtype=np.float64))
+            offset += len(universe)
+        return entry
+
+    def encode(rules) -> List:
+        return [[[list(term) for term in antecedents], consequent, weight]
+                for antecedents, consequent, weight in rules]
+
+    manifest = {
+        'arrays': ['tables'],
+        'inputs': [[name, pack(universe, terms)] for name, (universe, terms) in inputs.items()],
+        'output': [output[0], pack(output[1], output[2])],
+        'rules': encode(rules),
+        'controllers': [[name, encode(rules)] for name, rules in controllers.items()],
+    }
+    _write(directory, f"engine-{key}", manifest, {'tables': np.concatenate(tables)})
+
+
+def load_engine(directory: str, key: str) -> Optional[CompiledFuzzyEngine]:
+    """Rebuild a compiled engine from its saved definition, or None if absent."""
+    artifact = _read(directory, f"engine-{key}")
+    if artifact is None:
+        return None
+    manifest, arrays = artifact
+    tables = arrays['tables']
+
+    def unpack(entry) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        length = entry['length']
+        universe = tables[entry['universe']:entry['universe'] + length]
+        return universe, {label: tables[start:start + length] for label, start in entry['terms']}
+
+    inputs = {name: unpack(entry) for name, entry in manifest['inputs']}
+    output_name, entry = manifest['output']
+    output = (output_name,) + unpack(entry)
+    def decode(rules) -> List:
+        return [([tuple(term) for term in antecedents], consequent, weight)
+                for antecedents, consequent, weight in rules]
+
+    controllers = {name: decode(rules) for name, rules in manifest['controllers']}
+    return CompiledFuzzyEngine(inputs, output, decode(manifest['rules']), controllers)
+
+
+def save_surface(directory: str, key: str, surface: ScoreSurface):
+    """Save the tables of a base score surface."""
+    manifest = {'arrays': ['tables'], 'resolution': surface.resolution}
+    _write(directory, f"surface-{key}", manifest, {'tables': surface.tables})
+
+
+def load_surface(directory: str, key: str, engine: CompiledFuzzyEngine) -> Optional[ScoreSurface]:
+    """Rebuild the base score surface of an engine from its saved tables, or None if absent."""
+    artifact = _read(directory, f"surface-{key}")
+    if artifact is None:
+        return None
+    _, arrays = artifact
+    try:
+        return ScoreSurface(engine, arrays['tables'])
+    except ValueError:
+        return None
+
+
+def save_catalog(directory: str, key: str, catalog: GiftCatalog):
+    """Save the column arrays, vocabularies and gift records of a catalog."""
+    arrays = catalog.columns()
+    if isinstance(catalog.gifts, GiftRecords):
+        arrays.update((name, catalog.gifts.arrays[name]) for name in GiftRecords.ARRAYS)
+    elif catalog.gifts is not None:
+        arrays.update(GiftRecords.encode(catalog, catalog.gifts))
+    manifest = {
+        'arrays': list(arrays),
+        'vocabularies': catalog.vocabularies(),
+    }
+    _write(directory, f"catalog-{key}", manifest, arrays)
+
+
+def load_catalog(
+    directory: str,
+    key: str,
+    gifts: Optional[List[Dict]] = None,
+    records: bool = True
+) -> Optional[GiftCatalog]:
+    """
+    Open a saved catalog with memory-mapped columns, or None if absent.
+
+    Args:
+        directory: Artifact directory
+        key: Content hash of the catalog sources
+        gifts: Gift dictionaries matching the saved columns (default: the
+            saved gift records, if any)
+        records: Whether to open the saved gift records when gifts is None
+    """
+    name = f"catalog-{key}"
+    artifact = _read(directory, name)
+    if artifact is None:
+        return None
+    manifest, arrays = artifact
+    vocabularies = manifest['vocabularies']
+    if gifts is None and records and all(name in arrays for name in GiftRecords.ARRAYS):
+        gifts = GiftRecords(arrays, vocabularies)
+    catalog = GiftCatalog.from_columns(arrays, vocabularies, gifts)
+    catalog.source = os.path.join(directory, name)
+    return catalog
+
+
+def catalog_key(gifts_path: str) -> str:
+    """Content hash of a JSON catalog and the code compiling it."""
+    return content_hash([gifts_path] + CATALOG_SOURCES)
+
+
+def open_catalog(gifts_path: str = GIFTS_PATH) -> GiftCatalog:
+    """
+    Open the catalog artifact of a JSON catalog, converting it first if needed.
+
+    The JSON file is only parsed when no up-to-date artifact exists, or
+    when artifacts are disabled.
+    """
+    directory = artifact_dir()
+    key = catalog_key(gifts_path) if directory else None
+
+    catalog = load_catalog(directory, key) if directory else None
+    if catalog is None:
+        with open(gifts_path, 'r') as f:
+            catalog = GiftCatalog(json.load(f)['gifts'])
+        # Keep the gifts packed next to the columns rather than as parsed
+        # dictionaries, whether or not an artifact can be saved
+        catalog.gifts = GiftRecords.from_catalog(catalog, catalog.gifts)
+        if directory:
+            try:
+                save_catalog(directory, key, catalog)
+            except OSError as e:
+                print(f"Could not save compiled catalog: {e}")
+            else:
+                # Serve from the memory-mapped copy instead of the parsed JSON
+                catalog = load_catalog(directory, key) or catalog
+    return catalog
+
+
+def open_catalog_path(path: str, records: bool = True) -> GiftCatalog:
+    """Open the catalog artifact at a path returned as GiftCatalog.source."""
+    directory, name = os.path.split(path)
+    catalog = load_catalog(directory, name[len('catalog-'):], records=records)
+    if catalog is None:
+        raise FileNotFoundError(f"No catalog artifact at {path}")
+    return catalog
+
+
+if __name__ == '__main__':
+    if artifact_dir() is None:
+        sys.exit("Artifacts are disabled (FUZZY_ARTIFACT_DIR is empty)")
+    if sys.argv[1:] == ['--prune']:
+        from rulebase import RULES_PATH
+        from surface import SURFACE_RESOLUTION
+
+        current = [
+            f"engine-{content_hash(ENGINE_SOURCES + [RULES_PATH])}",
+            f"surface-{content_hash(SURFACE_SOURCES + [RULES_PATH])}r{SURFACE_RESOLUTION}",
+            f"catalog-{catalog_key(GIFTS_PATH)}",
+        ]
+        if os.path.isdir(artifact_dir()):
+            for name in prune_artifacts(artifact_dir(), in_use=current):
+                print(f"Deleted {name}")
+        sys.exit(0)
+    source = sys.argv[1] if len(sys.argv) > 1 else GIFTS_PATH
+    converted = open_catalog(source)
+    print(f"{len(converted)} gifts -> {converted.source}")
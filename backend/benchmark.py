@@ -0,0 +1,492 @@
+"""
+Benchmark Suite
+===============
+Reproducible performance measurements of the recommendation engine and API.
+
+Synthetic catalogs of any size are generated from the attribute values of
+gifts.json, and scored against randomized user/recipient profiles, both
+seeded so every run measures the same workload. For every catalog size:
+- Micro-benchmarks time each engine stage on its own (fuzzy inference,
+  bonus scoring, top-K sorting, pair selection, re-ranking, single-gift
+  scoring) and the public entry points (recommend_gifts, get_diverse_pairs,
+  refine_recommendations), with the result cache disabled
+- End-to-end benchmarks send concurrent requests to the FastAPI app through
+  an in-process ASGI client, as configured by the environment (executor,
+  cache, prefilter)
+
+Each benchmark reports throughput, p50/p99 latency and the peak memory
+allocated during a call (measured by tracemalloc in a separate pass, so it
+does not slow down the timing). Results can be saved as a baseline and
+later runs compared against it; regressions beyond a tolerance make the run
+exit with status 1.
+
+Usage:
+    python benchmark.py [--sizes 1000,10000,100000] [--suite micro,e2e]
+                        [--save-baseline] [--compare]
+
+Catalogs of 1M gifts (--sizes 1000000) need a few GB of memory while the
+synthetic gifts are generated.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from artifact import BACKEND_DIR, GIFTS_PATH
+from cache import ResultCache
+from catalog import GiftCatalog, TRAIT_NAMES
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Baseline written by --save-baseline and read by --compare
+BASELINE_PATH = os.path.join(BACKEND_DIR, 'data', 'benchmark-baseline.json')
+
+# Relative slowdown of p50 latency or throughput reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Calls measured for the peak memory of a benchmark
+MEMORY_CALLS = 3
+
+USER_OCCASIONS = ['Birthday', 'Anniversary', 'Graduation', 'Holiday']
+RECIPIENT_GENDERS = ['male', 'female']
+RECIPIENT_STYLES = ['Classic', 'Modern', 'Trendy', 'Minimalist']
+
+
+def synthetic_gifts(count: int, seed: int = 0, gifts_path: str = GIFTS_PATH) -> List[Dict]:
+    """
+    Generate a catalog of gifts shaped like gifts.json.
+
+    Categories, styles, genders and occasions are drawn from the values used
+    in gifts_path; traits and prices are uniformly random.
+
+    Args:
+        count: Number of gifts
+        seed: Random seed, the same seed gives the same catalog
+        gifts_path: Catalog to take the attribute values from
+
+    Returns:
+        List of gift dictionaries
+    """
+    with open(gifts_path, 'r') as f:
+        template = json.load(f)['gifts']
+    categories = sorted({gift['category'] for gift in template})
+    styles = sorted({gift['attributes']['style'] for gift in template})
+    genders = sorted({gift['attributes']['gender'] for gift in template})
+    occasions = sorted({o for gift in template for o in gift['attributes']['occasions']})
+
+    rng = np.random.default_rng(seed)
+    traits = rng.integers(0, 101, size=(count, len(TRAIT_NAMES))).tolist()
+    prices = rng.integers(5, 101, size=count).tolist()
+    relationship = rng.integers(0, 101, size=count).tolist()
+    category_codes = rng.integers(0, len(categories), size=count).tolist()
+    style_codes = rng.integers(0, len(styles), size=count).tolist()
+    gender_codes = rng.integers(0, len(genders), size=count).tolist()
+    occasion_masks = rng.integers(1, 1 << len(occasions), size=count).tolist()
+
+    gifts = []
+    for i in range(count):
+        attributes = {'gender': genders[gender_codes[i]]}
+        attributes.update(zip(TRAIT_NAMES, traits[i]))
+        attributes['style'] = styles[style_codes[i]]
+        attributes['occasions'] = [o for bit, o in enumerate(occasions) if occasion_masks[i] >> bit & 1]
+        attributes['relationship_score'] = relationship[i]
+        gifts.append({
+            'id': f'gift_{i:07d}',
+            'name': f'Synthetic Gift {i}',
+            'category': categories[category_codes[i]],
+            'description': f'Synthetic benchmark gift {i}',
+            'price_range': prices[i],
+            'image_url': f'https://example.com/gifts/{i}.jpg',
+            'amazon_link': f'https://www.amazon.de/s?k=gift+{i}',
+            'attributes': attributes,
+        })
+    return gifts
+
+
+def random_profiles(count: int, seed: int = 0) -> List[Tuple[Dict, Dict]]:
+    """
+    Generate (user_data, recipient_data) pairs with random slider values.
+
+    Profiles for which no fuzzy rule fires are skipped: they score every
+    gift 0 and would only measure the error path.
+
+    Args:
+        count: Number of profiles
+        seed: Random seed, the same seed gives the same profiles
+    """
+    from fuzzy_logic import fuzzy_system
+
+    rng = random.Random(seed)
+    profiles = []
+    while len(profiles) < count:
+        user_data = {
+            'age': rng.uniform(0, 100),
+            'budget': rng.uniform(0, 100),
+            'relationship': rng.uniform(0, 100),
+            'occasion': rng.choice(USER_OCCASIONS),
+        }
+        recipient_data = {
+            'gender': rng.choice(RECIPIENT_GENDERS),
+            'personality': rng.uniform(0, 100),
+            'technical': rng.uniform(0, 100),
+            'creative': rng.uniform(0, 100),
+            'managerial': rng.uniform(0, 100),
+            'academic': rng.uniform(0, 100),
+            'style': rng.choice(RECIPIENT_STYLES),
+        }
+        with contextlib.redirect_stdout(io.StringIO()):
+            context = fuzzy_system.build_scoring_context(user_data, recipient_data)
+        if context is not None and context.base_score is not None:
+            profiles.append((user_data, recipient_data))
+    return profiles
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Throughput and latency percentiles of timed calls, latencies in seconds."""
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'iterations': len(latencies),
+        'ops_per_sec': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 4),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 4),
+    }
+
+
+def peak_memory(call: Callable[[int], Any], calls: int = MEMORY_CALLS) -> float:
+    """Peak KiB allocated by any one of a few calls, as traced by tracemalloc."""
+    peak = 0
+    for i in range(calls):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            call(i)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def measure(
+    call: Callable[[int], Any],
+    min_time: float,
+    max_iterations: int = 10000,
+    warmup: int = 3
+) -> Dict[str, float]:
+    """
+    Time a benchmark call until min_time has passed.
+
+    Args:
+        call: Called with the iteration number, so it can cycle through a
+            workload
+        min_time: Seconds to keep calling, at least 5 calls are timed
+        max_iterations: Upper bound of timed calls
+        warmup: Untimed calls before measuring
+    """
+    for i in range(warmup):
+        call(i)
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_iterations:
+        before = time.perf_counter()
+        call(len(latencies))
+        latencies.append(time.perf_counter() - before)
+        if len(latencies) >= 5 and before - start >= min_time:
+            break
+    result = summarize(latencies, time.perf_counter() - start)
+    result['peak_kb'] = peak_memory(call)
+    return result
+
+
+def micro_benchmarks(system, profiles: List[Tuple[Dict, Dict]]) -> Dict[str, Callable[[int], Any]]:
+    """
+    Benchmark calls for every engine stage and public entry point.
+
+    Args:
+        system: GiftRecommendationFuzzySystem with the catalog to measure
+        profiles: Workload the calls cycle through
+    """
+    from fuzzy_logic import top_k
+
+    snapshot = system.snapshot
+    catalog = snapshot.catalog
+    contexts = [system.build_scoring_context(user, recipient) for user, recipient in profiles]
+    scores = [system.score_catalog(context, snapshot) for context in contexts[:16]]
+    rankings = [system.rank_gifts(user, recipient, 10 * 30, snapshot)[0] for user, recipient in profiles[:16]]
+    selections = [sorted(ranking[:5].tolist()) for ranking in rankings]
+    selected_ids = [[system.gifts[index]['id'] for index in selection] for selection in selections]
+    gift_sample = [system.gifts[i] for i in range(min(len(catalog), 256))]
+
+    def profile(i):
+        return profiles[i % len(profiles)]
+
+    def inference(i):
+        context = system._prepare_context(*profile(i))
+        system._compute_base_score(context)
+
+    def rerank(i):
+        user, recipient = profile(i)
+        ranked = system.score_request(user, recipient, snapshot)
+        system._rank_refined(user, recipient, selections[i % len(selections)], 3, snapshot, ranked)
+
+    def refine(i):
+        user, recipient = profile(i)
+        system.refine_recommendations(user, recipient, selected_ids[i % len(selected_ids)], top_n=3)
+
+    return {
+        'fuzzy_inference': inference,
+        'bonus_scoring': lambda i: system.score_catalog(contexts[i % len(contexts)], snapshot),
+        'top_k': lambda i: top_k(scores[i % len(scores)], 10),
+        'pair_selection': lambda i: system.pair_selector.select(catalog, rankings[i % len(rankings)], 5),
+        'rerank': rerank,
+        'calculate_gift_score': lambda i: system.calculate_gift_score(
+            gift_sample[i % len(gift_sample)], *profile(i)
+        ),
+        'recommend_gifts': lambda i: system.recommend_gifts(*profile(i), top_n=10),
+        'get_diverse_pairs': lambda i: system.get_diverse_pairs(*profile(i), num_pairs=5),
+        'refine_recommendations': refine,
+    }
+
+
+def run_micro(gifts: List[Dict], profiles: List[Tuple[Dict, Dict]], min_time: float) -> Dict[str, Dict]:
+    """Build a system for the catalog and run every micro-benchmark."""
+    from fuzzy_logic import GiftRecommendationFuzzySystem
+
+    start = time.perf_counter()
+    catalog = GiftCatalog(gifts)
+    results = {'catalog_build': {'iterations': 1, 'seconds': round(time.perf_counter() - start, 3)}}
+
+    system = GiftRecommendationFuzzySystem(catalog)
+    # Every call scores; a warm cache would only measure dictionary lookups
+    system.cache = ResultCache(max_entries=0, max_bytes=0, ttl=0)
+    system.sessions = ResultCache(max_entries=0, max_bytes=0, ttl=0)
+
+    for name, call in micro_benchmarks(system, profiles).items():
+        results[name] = measure(call, min_time)
+        print(f"   {name:24s} {format_result(results[name])}", flush=True)
+    return results
+
+
+async def _load_test(
+    profiles: List[Tuple[Dict, Dict]],
+    requests: int,
+    concurrency: int
+) -> Dict[str, Dict]:
+    """Send pairs + final-images flows to the app with concurrent clients."""
+    import httpx
+    from main import app
+
+    latencies = {'generate_image_pairs': [], 'generate_final_images': []}
+    errors = 0
+    counter = iter(range(requests))
+
+    async def client_loop(client):
+        nonlocal errors
+        for i in counter:
+            user, recipient = profiles[i % len(profiles)]
+            body = {'user': user, 'other': recipient}
+
+            before = time.perf_counter()
+            response = await client.post('/api/generate-image-pairs', json=body)
+            latencies['generate_image_pairs'].append(time.perf_counter() - before)
+            if response.status_code != 200:
+                errors += 1
+                continue
+            data = response.json()
+            selected = {f'image{j}': pair[0]['value'] for j, pair in enumerate(data['imagePairs'])}
+            if len(selected) < 5:
+                continue
+
+            before = time.perf_counter()
+            response = await client.post('/api/generate-final-images', json=dict(
+                body, selectedImages=selected, sessionId=data.get('sessionId')
+            ))
+            latencies['generate_final_images'].append(time.perf_counter() - before)
+            if response.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    results = {name: summarize(values, elapsed) for name, values in latencies.items() if values}
+    flows = len(latencies['generate_image_pairs'])
+    results['flow'] = {'iterations': flows, 'ops_per_sec': round(flows / elapsed, 2), 'errors': errors}
+    return results
+
+
+def run_e2e(
+    gifts: List[Dict],
+    profiles: List[Tuple[Dict, Dict]],
+    requests: int,
+    concurrency: int
+) -> Dict[str, Dict]:
+    """Serve the catalog from the app's fuzzy system and load test the endpoints."""
+    from fuzzy_logic import fuzzy_system
+
+    fuzzy_system.set_catalog(GiftCatalog(gifts))
+    # Warm up the engine and executor outside the measurement
+    asyncio.run(_load_test(profiles[:2], 2, 1))
+    fuzzy_system.cache.clear()
+
+    tracemalloc.start()
+    try:
+        results = asyncio.run(_load_test(profiles, requests, concurrency))
+        peak = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+    # Timed again without tracing, which slows down allocation-heavy code
+    fuzzy_system.cache.clear()
+    results = asyncio.run(_load_test(profiles, requests, concurrency))
+    results['flow']['peak_kb'] = peak
+
+    for name, result in results.items():
+        print(f"   {name:24s} {format_result(result)}", flush=True)
+    return results
+
+
+def format_result(result: Dict) -> str:
+    """One-line summary of a benchmark result."""
+    if 'p50_ms' not in result:
+        return ', '.join(f"{key}={value}" for key, value in result.items())
+    text = f"{result['ops_per_sec']:>10.1f} ops/s  p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms"
+    if 'peak_kb' in result:
+        text += f"  peak {result['peak_kb']:.0f} KiB"
+    return text
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Compare results against a baseline.
+
+    Returns:
+        Descriptions of benchmarks whose p50 latency grew or throughput fell
+        by more than tolerance
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if 'p50_ms' in result and 'p50_ms' in before and result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {before['p50_ms']:.3f} -> {result['p50_ms']:.3f} ms")
+        elif 'ops_per_sec' in result and 'ops_per_sec' in before and \
+                result['ops_per_sec'] * (1 + tolerance) < before['ops_per_sec']:
+            regressions.append(f"{name}: {before['ops_per_sec']:.1f} -> {result['ops_per_sec']:.1f} ops/s")
+    return regressions
+
+
+def run(
+    sizes: List[int],
+    suites: List[str],
+    profiles: int = 200,
+    seed: int = 0,
+    min_time: float = 1.0,
+    requests: int = 200,
+    concurrency: int = 8
+) -> Dict[str, Any]:
+    """
+    Run the benchmark suites for every catalog size.
+
+    Returns:
+        Dict with the run's 'meta' data and 'results' keyed by
+        '<size>/<suite>/<benchmark>'
+    """
+    workload = random_profiles(profiles, seed)
+    results = {}
+    for size in sizes:
+        gifts = synthetic_gifts(size, seed)
+        if 'micro' in suites:
+            print(f"\n📏 Micro-benchmarks, {size} gifts", flush=True)
+            for name, result in run_micro(gifts, workload, min_time).items():
+                results[f'{size}/micro/{name}'] = result
+        if 'e2e' in suites:
+            print(f"\n🌐 End-to-end, {size} gifts, {concurrency} concurrent clients", flush=True)
+            for name, result in run_e2e(gifts, workload, requests, concurrency).items():
+                results[f'{size}/e2e/{name}'] = result
+        del gifts
+        gc.collect()
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'profiles': profiles,
+            'seed': seed,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the gift recommendation engine and API.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated catalog sizes (default: %(default)s)")
+    parser.add_argument('--suite', default='micro,e2e', help="micro, e2e or both (default: %(default)s)")
+    parser.add_argument('--profiles', type=int, default=200, help="randomized profiles in the workload")
+    parser.add_argument('--seed', type=int, default=0, help="seed of catalogs and profiles")
+    parser.add_argument('--min-time', type=float, default=1.0, help="seconds per micro-benchmark")
+    parser.add_argument('--requests', type=int, default=200, help="pairs + final flows per end-to-end run")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent end-to-end clients")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true', help="save the results as the baseline")
+    parser.add_argument('--compare', action='store_true', help="fail on regressions against the baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = run(
+        sizes=[int(size) for size in args.sizes.split(',')],
+        suites=[suite.strip() for suite in args.suite.split(',')],
+        profiles=args.profiles,
+        seed=args.seed,
+        min_time=args.min_time,
+        requests=args.requests,
+        concurrency=args.concurrency
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    status = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\n⚠️  No baseline at {args.baseline}, run with --save-baseline first")
+        else:
+            with open(args.baseline, 'r') as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            if regressions:
+                print(f"\n❌ {len(regressions)} regressions beyond {args.tolerance:.0%}:")
+                for regression in regressions:
+                    print(f"   {regression}")
+                status = 1
+            else:
+                print(f"\n✅ No regressions beyond {args.tolerance:.0%}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Baseline saved to {args.baseline}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
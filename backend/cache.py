@@ -0,0 +1,150 @@
+"""
+Scoring Result Cache
+====================
+LRU cache with a time-to-live for per-profile scoring results. Requests come
+from 0-100 sliders and a few enums, so identical profiles are common and a
+repeated profile skips fuzzy inference and catalog scoring entirely.
+
+Configuration (environment variables):
+- FUZZY_CACHE_SIZE: Maximum number of cached profiles, 0 disables (default: 1024)
+- FUZZY_CACHE_MAX_MB: Maximum memory held by cached results (default: 64)
+- FUZZY_CACHE_TTL: Seconds a result stays valid, 0 for no expiry (default: 300)
+- FUZZY_CACHE_QUANTUM: Round slider values to multiples of this before
+  scoring, so nearby profiles share an entry; 0 keeps exact values (default: 0)
+
+The same cache holds the scoring sessions of the image pair flow, configured
+by FUZZY_SESSION_SIZE (default: 4096), FUZZY_SESSION_MAX_MB (default: 64)
+and FUZZY_SESSION_TTL (default: 900).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a time-to-live and a memory budget.
+
+    Values must expose an ``nbytes`` attribute, which counts against
+    max_bytes. The least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, quantum: float = 0.0):
+        """
+        Args:
+            max_entries: Maximum number of entries, 0 disables the cache
+            max_bytes: Maximum total nbytes of the cached values
+            ttl: Seconds an entry stays valid, 0 for no expiry
+            quantum: Step that profile values are rounded to, 0 for none
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.quantum = quantum
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.nbytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Cache value under key, evicting least recently used entries."""
+        if not self.enabled or value.nbytes > self.max_bytes:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires)
+            self.nbytes += value.nbytes
+
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        value, _ = self._entries.pop(key)
+        self.nbytes -= value.nbytes
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Return the unexpired (key, value) pairs, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value) for key, (value, expires) in self._entries.items()
+                if expires is None or expires > now
+            ]
+
+    def clear(self):
+        """Drop every entry; counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the size and hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    @classmethod
+    def from_env(
+        cls,
+        prefix: str = 'FUZZY_CACHE',
+        size: int = 1024,
+        max_mb: float = 64,
+        ttl: float = 300
+    ) -> 'ResultCache':
+        """
+        Create a cache configured by the <prefix>_* environment variables.
+
+        Args:
+            prefix: Prefix of the SIZE, MAX_MB, TTL and QUANTUM variables
+            size / max_mb / ttl: Defaults for unset variables
+        """
+        return cls(
+            max_entries=int(os.environ.get(f'{prefix}_SIZE', size)),
+            max_bytes=int(float(os.environ.get(f'{prefix}_MAX_MB', max_mb)) * 1024 * 1024),
+            ttl=float(os.environ.get(f'{prefix}_TTL', ttl)),
+            quantum=float(os.environ.get(f'{prefix}_QUANTUM', 0))
+        )
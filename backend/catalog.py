@@ -0,0 +1,580 @@
+"""
+Columnar Gift Catalog
+=====================
+Compiles the list of gift dictionaries loaded from gifts.json into NumPy
+column arrays so every gift can be scored in one batch of array operations.
+"""
+
+import copy
+
+import numpy as np
+from collections.abc import Sequence as SequenceABC
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Order of the columns in GiftCatalog.traits
+TRAIT_NAMES = ['personality', 'technical', 'creative', 'managerial', 'academic']
+
+# Age bands of the gift giver, see GiftRecommendationFuzzySystem.score_gift
+AGE_BANDS = ['young', 'middle', 'mature']
+
+# Age-band bonus terms, applied in this order: (column, values, bonus).
+# Mirrors the age-based bonus in GiftRecommendationFuzzySystem.score_gift.
+AGE_BAND_RULES = {
+    'young': [
+        ('style', ['Modern', 'Trendy'], 8),
+        ('technical', 70, 6),
+    ],
+    'middle': [
+        ('style', ['Modern', 'Classic'], 5),
+        ('category', ['Home', 'Office', 'Experience'], 5),
+    ],
+    'mature': [
+        ('style', ['Classic'], 8),
+        ('academic', 60, 6),
+        ('category', ['Books', 'Stationery', 'Home'], 5),
+    ],
+}
+
+
+class Vocabulary:
+    """Dictionary encoding for a string column."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        """Return the code for a value, adding it to the vocabulary if new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: str) -> int:
+        """Return the code for a value, or -1 if it is unknown."""
+        return self.codes.get(value, -1)
+
+    @classmethod
+    def from_values(cls, values: List[str]) -> 'Vocabulary':
+        """Rebuild a vocabulary from its values, in code order."""
+        vocabulary = cls()
+        for value in values:
+            vocabulary.encode(value)
+        return vocabulary
+
+    def copy(self) -> 'Vocabulary':
+        """Return an independent copy of the vocabulary."""
+        return Vocabulary.from_values(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class GiftOverlay(SequenceABC):
+    """
+    Gift dictionaries of an updated catalog: a base sequence with some rows
+    replaced or appended.
+
+    Updating a catalog only copies the replaced rows, never the base
+    sequence (which may be memory-mapped GiftRecords).
+    """
+
+    def __init__(self, base: Sequence[Dict], rows: Dict[int, Dict], length: int):
+        """
+        Args:
+            base: Gift dictionaries of the original catalog
+            rows: Catalog index -> gift dictionary for the replaced rows
+            length: Number of gifts
+        """
+        self.base = base
+        self.rows = rows
+        self.length = length
+
+    @classmethod
+    def of(cls, gifts: Sequence[Dict]) -> 'GiftOverlay':
+        """Return an overlay over gifts, flattening an existing overlay."""
+        if isinstance(gifts, GiftOverlay):
+            return cls(gifts.base, dict(gifts.rows), gifts.length)
+        return cls(gifts, {}, len(gifts))
+
+    def ids(self) -> List[str]:
+        """Return the id of every gift."""
+        if hasattr(self.base, 'ids'):
+            ids = self.base.ids()[:self.length]
+        else:
+            ids = [gift.get('id') for gift in self.base[:self.length]]
+        ids.extend([None] * (self.length - len(ids)))
+        for i, gift in self.rows.items():
+            ids[i] = gift.get('id')
+        return ids
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i: int) -> Dict:
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("gift index out of range")
+        gift = self.rows.get(i)
+        return gift if gift is not None else self.base[i]
+
+    def keys(self, i: int) -> List[str]:
+        """Return the top-level keys of gift i."""
+        gift = self.rows.get(i)
+        if gift is not None:
+            return list(gift)
+        return self.base.keys(i) if hasattr(self.base, 'keys') else list(self.base[i])
+
+    def field(self, i: int, key: str):
+        """Return (a copy of) one top-level field of gift i."""
+        gift = self.rows.get(i)
+        if gift is None and hasattr(self.base, 'field'):
+            return self.base.field(i, key)
+        return copy.deepcopy(self[i][key])
+
+
+class GiftCatalog:
+    """
+    Column-oriented view of the gift catalog.
+
+    Attributes:
+        gifts: The original gift dictionaries, in catalog order (a
+            GiftRecords sequence for a catalog loaded from an artifact, None
+            for a catalog rebuilt from columns only, e.g. in a scoring worker)
+        source: Path of the artifact the columns are memory-mapped from, if any
+        price_range: Gift price on the 0-100 budget scale
+        traits: (n, 5) matrix of trait attributes, see TRAIT_NAMES
+        relationship_score: Relationship closeness the gift suits
+        style_codes / category_codes / gender_codes: Dictionary-encoded strings
+        occasion_masks: Bitmask of the gift's occasions (one bit per occasion)
+        valid: False for gifts whose data could not be compiled; they score 0
+        age_band_terms: Per age band, the precomputed bonus arrays
+        age_band_matrix: (bands, terms, n) stack of age_band_terms in AGE_BANDS
+            order, zero-padded so every band has the same number of terms
+        id_index: Gift id -> catalog index (empty without gift dictionaries)
+        category_index / occasion_index / style_index / gender_index:
+            Value -> ascending array of the catalog indices having it
+        price_order: Catalog indices sorted by price_range
+    """
+
+    MAX_OCCASIONS = 64
+
+    # Per-gift column arrays; everything else is derived from these
+    COLUMNS = [
+        'price_range', 'traits', 'relationship_score', 'style_codes',
+        'category_codes', 'gender_codes', 'occasion_masks', 'valid'
+    ]
+    VOCABULARIES = ['styles', 'categories', 'genders', 'occasions']
+
+    def __init__(self, gifts: List[Dict]):
+        """Compile a list of gift dictionaries into column arrays."""
+        self.gifts = gifts
+        self.source = None
+        n = len(gifts)
+
+        self.styles = Vocabulary()
+        self.categories = Vocabulary()
+        self.genders = Vocabulary()
+        self.occasions = Vocabulary()
+
+        self.price_range = np.zeros(n, dtype=np.float64)
+        self.traits = np.zeros((n, len(TRAIT_NAMES)), dtype=np.float64)
+        self.relationship_score = np.zeros(n, dtype=np.float64)
+        self.style_codes = np.full(n, -1, dtype=np.int32)
+        self.category_codes = np.full(n, -1, dtype=np.int32)
+        self.gender_codes = np.full(n, -1, dtype=np.int32)
+        self.occasion_masks = np.zeros(n, dtype=np.uint64)
+        self.valid = np.ones(n, dtype=bool)
+
+        for i, gift in enumerate(gifts):
+            try:
+                self._compile_row(i, gift)
+            except Exception as e:
+                print(f"Error compiling gift {gift.get('name', 'unknown')}: {e}")
+                self.valid[i] = False
+
+        self._derive()
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: Dict[str, np.ndarray],
+        vocabularies: Dict[str, List[str]],
+        gifts: Optional[Sequence[Dict]] = None
+    ) -> 'GiftCatalog':
+        """
+        Rebuild a catalog from its column arrays without recompiling gifts.
+        
+        Args:
+            columns: Arrays for every name in COLUMNS (used as-is, not copied)
+            vocabularies: Values of every vocabulary in VOCABULARIES
+            gifts: Optional gift dictionaries matching the columns
+        
+        Returns:
+            GiftCatalog over the given columns
+        """
+        catalog = cls.__new__(cls)
+        catalog.gifts = gifts
+        catalog.source = None
+        for name in cls.COLUMNS:
+            setattr(catalog, name, columns[name])
+        for name in cls.VOCABULARIES:
+            setattr(catalog, name, Vocabulary.from_values(vocabularies[name]))
+        catalog._derive()
+        return catalog
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Return the per-gift column arrays by name."""
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def vocabularies(self) -> Dict[str, List[str]]:
+        """Return the values of every vocabulary by name."""
+        return {name: list(getattr(self, name).values) for name in self.VOCABULARIES}
+
+    def updated(
+        self,
+        upserts: Iterable[Dict] = (),
+        deletes: Iterable[str] = ()
+    ) -> Tuple['GiftCatalog', np.ndarray]:
+        """
+        Return a new catalog with some gifts added, replaced or removed.
+
+        Only the changed gifts are compiled and only the index entries of
+        their rows are touched; this catalog is left unchanged. A deleted
+        gift's row is filled with the last gift of the catalog (so only one
+        other row moves), upserted gifts replace the gift with the same id
+        or are appended.
+
+        Args:
+            upserts: Gift dictionaries to add or replace, matched by id
+            deletes: Ids of the gifts to remove
+
+        Returns:
+            Tuple of (new catalog, ascending indices of the rows whose gift
+            changed in it)
+
+        Raises:
+            KeyError: If a deleted id is not in the catalog
+            ValueError: If an upserted gift has no id or cannot be compiled
+        """
+        if self.gifts is None:
+            raise ValueError("Catalog has no gift dictionaries to update")
+        upserts = list(upserts)
+        deletes = list(dict.fromkeys(deletes))
+        unknown = [gift_id for gift_id in deletes if gift_id not in self.id_index]
+        if unknown:
+            raise KeyError(f"Unknown gift ids: {', '.join(map(str, unknown))}")
+        if any(not isinstance(gift, dict) or not gift.get('id') for gift in upserts):
+            raise ValueError("Every upserted gift needs an id")
+
+        catalog = GiftCatalog.__new__(GiftCatalog)
+        catalog.source = None
+        catalog.gifts = GiftOverlay.of(self.gifts)
+        catalog.id_index = dict(self.id_index)
+        for name in self.VOCABULARIES:
+            setattr(catalog, name, getattr(self, name).copy())
+
+        n = len(self)
+        gone = set(deletes)
+        added = len({gift['id'] for gift in upserts if gift['id'] in gone or gift['id'] not in self.id_index})
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros((n + added,) + column.shape[1:], dtype=column.dtype)
+            grown[:n] = column
+            setattr(catalog, name, grown)
+
+        # Rows whose content changed, and (old) rows whose index entries
+        # must be removed
+        changed = set()
+        stale = set()
+        length = n
+        for gift_id in deletes:
+            i = catalog.id_index.pop(gift_id)
+            last = length - 1
+            stale.update((i, last))
+            if i != last:
+                catalog._move_row(last, i)
+                changed.add(i)
+            changed.discard(last)
+            length -= 1
+
+        for gift in upserts:
+            i = catalog.id_index.get(gift['id'])
+            if i is None:
+                i = length
+                length += 1
+                catalog.id_index[gift['id']] = i
+            stale.add(i)
+            changed.add(i)
+            try:
+                catalog._compile_row(i, gift)
+            except Exception as e:
+                raise ValueError(f"Invalid gift {gift['id']}: {e}") from e
+            catalog.valid[i] = True
+            catalog.gifts.rows[i] = gift
+
+        for name in self.COLUMNS:
+            setattr(catalog, name, getattr(catalog, name)[:length])
+        catalog.gifts.length = length
+        for i in range(length, n + added):
+            catalog.gifts.rows.pop(i, None)
+
+        changed = np.array(sorted(changed), dtype=np.intp)
+        stale = np.array(sorted(i for i in stale if i < n), dtype=np.intp)
+        catalog._patch_derived(self, changed, stale)
+        return catalog, changed
+
+    def _move_row(self, source: int, target: int):
+        """Copy row source of every column and gift to row target."""
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column[target] = column[source]
+        self.gifts.rows[target] = self.gifts[source]
+        self.id_index[self.gifts[target].get('id')] = target
+
+    def _patch_derived(self, previous: 'GiftCatalog', changed: np.ndarray, stale: np.ndarray):
+        """
+        Derive the indexes from those of previous, given the rows that changed.
+
+        Args:
+            previous: Catalog this one was updated from
+            changed: Rows of this catalog with a new gift
+            stale: Rows of previous whose index entries are outdated
+        """
+        n = len(self)
+        dropped = np.union1d(stale, np.arange(n, len(previous)))
+
+        def patch(index: Dict[str, np.ndarray], old_codes, new_codes, vocabulary: Vocabulary):
+            index = dict(index)
+            affected = set(old_codes[dropped].tolist()) | set(new_codes[changed].tolist())
+            for code in affected:
+                if code < 0:
+                    continue
+                value = vocabulary.values[code]
+                rows = index.get(value, np.empty(0, dtype=np.intp))
+                rows = rows[~np.isin(rows, dropped)]
+                index[value] = np.union1d(rows, changed[new_codes[changed] == code]).astype(np.intp)
+            return index
+
+        self.category_index = patch(previous.category_index, previous.category_codes,
+                                    self.category_codes, self.categories)
+        self.style_index = patch(previous.style_index, previous.style_codes,
+                                 self.style_codes, self.styles)
+        self.gender_index = patch(previous.gender_index, previous.gender_codes,
+                                  self.gender_codes, self.genders)
+
+        def occasion_codes(masks: np.ndarray) -> List[int]:
+            combined = int(np.bitwise_or.reduce(masks)) if len(masks) else 0
+            return [code for code in range(self.MAX_OCCASIONS) if combined >> code & 1]
+
+        self.occasion_index = dict(previous.occasion_index)
+        for code in set(occasion_codes(previous.occasion_masks[dropped])) | \
+                set(occasion_codes(self.occasion_masks[changed])):
+            value = self.occasions.values[code]
+            rows = self.occasion_index.get(value, np.empty(0, dtype=np.intp))
+            rows = rows[~np.isin(rows, dropped)]
+            has_code = (self.occasion_masks[changed] & np.uint64(1 << code)) != 0
+            self.occasion_index[value] = np.union1d(rows, changed[has_code]).astype(np.intp)
+
+        keep = ~np.isin(previous.price_order, dropped)
+        price_order = previous.price_order[keep]
+        sorted_prices = previous._sorted_prices[keep]
+        # np.insert keeps values inserted at the same position in argument
+        # order, so they are inserted sorted by price
+        inserted = changed[np.argsort(self.price_range[changed], kind='stable')]
+        prices = self.price_range[inserted]
+        positions = np.searchsorted(sorted_prices, prices, side='right')
+        self.price_order = np.insert(price_order, positions, inserted)
+        self._sorted_prices = np.insert(sorted_prices, positions, prices)
+
+        self.age_band_matrix = np.zeros(previous.age_band_matrix.shape[:2] + (n,), dtype=np.float64)
+        kept = min(n, len(previous))
+        self.age_band_matrix[:, :, :kept] = previous.age_band_matrix[:, :, :kept]
+        self._fill_age_bands(changed)
+
+    def _derive(self):
+        """Precompute the arrays and indexes derived from the columns."""
+        n = len(self)
+
+        # GiftRecords reads the ids without building every gift dictionary
+        if hasattr(self.gifts, 'ids'):
+            gift_ids = self.gifts.ids()
+        else:
+            gift_ids = [gift.get('id') for gift in self.gifts or []]
+        self.id_index: Dict[str, int] = {}
+        for i, gift_id in enumerate(gift_ids):
+            self.id_index.setdefault(gift_id, i)
+
+        self.category_index = self._inverted_index(self.category_codes, self.categories)
+        self.style_index = self._inverted_index(self.style_codes, self.styles)
+        self.gender_index = self._inverted_index(self.gender_codes, self.genders)
+        self.occasion_index = {
+            occasion: np.flatnonzero(self.occasion_mask(occasion))
+            for occasion in self.occasions.values
+        }
+        self.price_order = np.argsort(self.price_range, kind='stable')
+        self._sorted_prices = self.price_range[self.price_order]
+        slots = max(len(rules) for rules in AGE_BAND_RULES.values())
+        self.age_band_matrix = np.zeros((len(AGE_BANDS), slots, n), dtype=np.float64)
+        self._fill_age_bands(slice(None))
+
+    def _fill_age_bands(self, rows):
+        """Compute the age-band bonus terms of some rows into age_band_matrix."""
+        for b, band in enumerate(AGE_BANDS):
+            for j, rule in enumerate(AGE_BAND_RULES[band]):
+                self.age_band_matrix[b, j, rows] = self._age_band_term(rule, rows)
+        self.age_band_terms = {
+            band: [self.age_band_matrix[b, j] for j in range(len(AGE_BAND_RULES[band]))]
+            for b, band in enumerate(AGE_BANDS)
+        }
+
+    def __len__(self):
+        return len(self.price_range)
+
+    @staticmethod
+    def _inverted_index(codes: np.ndarray, vocabulary: Vocabulary) -> Dict[str, np.ndarray]:
+        """Map every vocabulary value to the ascending indices of its rows."""
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(vocabulary) + 1))
+        return {
+            value: order[bounds[code]:bounds[code + 1]]
+            for code, value in enumerate(vocabulary.values)
+        }
+
+    def _compile_row(self, i: int, gift: Dict):
+        """Fill row i of every column from a gift dictionary."""
+        attributes = gift['attributes']
+
+        mask = 0
+        for occasion in attributes['occasions']:
+            code = self.occasions.encode(occasion)
+            if code >= self.MAX_OCCASIONS:
+                raise ValueError(f"More than {self.MAX_OCCASIONS} distinct occasions")
+            mask |= 1 << code
+
+        self.price_range[i] = gift['price_range']
+        for j, trait in enumerate(TRAIT_NAMES):
+            self.traits[i, j] = attributes[trait]
+        self.relationship_score[i] = attributes['relationship_score']
+        self.style_codes[i] = self.styles.encode(attributes['style'])
+        self.category_codes[i] = self.categories.encode(gift['category'])
+        self.gender_codes[i] = self.genders.encode(attributes['gender'].lower())
+        self.occasion_masks[i] = mask
+
+    def _age_band_term(self, rule, rows=slice(None)) -> np.ndarray:
+        """Precompute one age-band bonus term as an array over some rows."""
+        column, values, bonus = rule
+        if column == 'style':
+            matches = self.has_code(self.style_codes[rows], self.styles, values)
+        elif column == 'category':
+            matches = self.has_code(self.category_codes[rows], self.categories, values)
+        else:
+            matches = self.trait(column)[rows] >= values
+        return np.where(matches, float(bonus), 0.0)
+
+    def trait(self, name: str) -> np.ndarray:
+        """Return the column for one trait attribute."""
+        return self.traits[:, TRAIT_NAMES.index(name)]
+
+    @staticmethod
+    def has_code(codes: np.ndarray, vocabulary: Vocabulary, values: List[str]) -> np.ndarray:
+        """Boolean mask of rows whose encoded value is one of values."""
+        wanted = [vocabulary.lookup(value) for value in values]
+        return np.isin(codes, [code for code in wanted if code >= 0])
+
+    def index_of(self, gift_id: str) -> Optional[int]:
+        """Return the catalog index of a gift id, or None if it is unknown."""
+        return self.id_index.get(gift_id)
+
+    def get(self, gift_id: str) -> Optional[Dict]:
+        """Return the gift dictionary for an id, or None if it is unknown."""
+        index = self.id_index.get(gift_id)
+        return None if index is None else self.gifts[index]
+
+    def view(self, index: int, score: Optional[float] = None):
+        """Return a read-only GiftView of the gift at a catalog index, optionally scored."""
+        from records import GiftView
+        return GiftView(self.gifts, index, score)
+
+    def indices_of(self, gift_ids: List[str]) -> List[int]:
+        """Return the catalog indices of the known ids, ascending and without duplicates."""
+        return sorted({self.id_index[gift_id] for gift_id in gift_ids if gift_id in self.id_index})
+
+    def weighted_indices(
+        self,
+        gift_ids: List[str],
+        weights: Sequence[float]
+    ) -> Tuple[List[int], List[float]]:
+        """
+        Return the catalog indices of the known ids with their summed weights.
+
+        A gift listed several times (e.g. selected in several rounds) gets the
+        sum of its weights; gifts whose weights sum to 0 are left out.
+
+        Raises:
+            ValueError: If the weights don't match the ids or are negative
+        """
+        if len(weights) != len(gift_ids):
+            raise ValueError(f"Expected {len(gift_ids)} selection weights, got {len(weights)}")
+        totals: Dict[int, float] = {}
+        for gift_id, weight in zip(gift_ids, weights):
+            if not weight >= 0:
+                raise ValueError(f"Selection weights must be non-negative, got {weight}")
+            if gift_id in self.id_index:
+                index = self.id_index[gift_id]
+                totals[index] = totals.get(index, 0.0) + float(weight)
+        indices = sorted(index for index, total in totals.items() if total > 0)
+        return indices, [totals[index] for index in indices]
+
+    def price_between(self, low: float, high: float) -> np.ndarray:
+        """Ascending catalog indices of gifts with low <= price_range <= high."""
+        start = np.searchsorted(self._sorted_prices, low, side='left')
+        stop = np.searchsorted(self._sorted_prices, high, side='right')
+        return np.sort(self.price_order[start:stop])
+
+    def select(
+        self,
+        category: Optional[str] = None,
+        occasion: Optional[str] = None,
+        style: Optional[str] = None,
+        gender: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Catalog indices of the gifts matching every given filter.
+        
+        Args:
+            category / occasion / style / gender: Exact values to match
+                (gender is case-insensitive)
+            min_price / max_price: Inclusive price_range bounds
+        
+        Returns:
+            Ascending array of catalog indices
+        """
+        empty = np.empty(0, dtype=np.intp)
+        selected = np.arange(len(self))
+        for index, value in (
+            (self.category_index, category),
+            (self.occasion_index, occasion),
+            (self.style_index, style),
+            (self.gender_index, gender.lower() if gender is not None else None),
+        ):
+            if value is not None:
+                selected = np.intersect1d(selected, index.get(value, empty), assume_unique=True)
+        if min_price is not None or max_price is not None:
+            low = -np.inf if min_price is None else min_price
+            high = np.inf if max_price is None else max_price
+            selected = np.intersect1d(selected, self.price_between(low, high), assume_unique=True)
+        return selected
+
+    def occasion_mask(self, occasion: str) -> np.ndarray:
+        """Boolean mask of gifts suitable for an occasion."""
+        code = self.occasions.lookup(occasion)
+        if code < 0:
+            return np.zeros(len(self), dtype=bool)
+        return (self.occasion_masks & np.uint64(1 << code)) != 0
@@ -0,0 +1,129 @@
+"""
+Bounded Scoring Executor
+========================
+Runs CPU-bound fuzzy scoring off the asyncio event loop, so one slow
+request no longer stalls every other connection. Concurrency is bounded by
+the worker count, and requests beyond the queue depth are rejected instead
+of piling up (backpressure).
+
+Configuration (environment variables):
+- FUZZY_EXECUTION_MODE: 'thread' to score in-process, or 'process' to hand
+  scoring to worker processes (see workers.py) (default: thread)
+- FUZZY_MAX_WORKERS: Scoring threads, and worker processes in process mode
+  (default: number of CPUs, at most 8 in thread mode)
+- FUZZY_MAX_QUEUE: Requests allowed to wait for a worker (default: 64)
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Iterator
+
+
+class ExecutorBusyError(Exception):
+    """Raised when all workers are busy and the queue is full."""
+
+
+class ScoringExecutor:
+    """
+    Thread pool with a bounded number of in-flight tasks.
+
+    The in-flight counter is only touched from coroutines running on the
+    event loop thread, so it needs no lock.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        """
+        Args:
+            max_workers: Number of scoring threads
+            max_queue: Tasks allowed to wait when all workers are busy
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scoring')
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of tasks waiting for a free worker."""
+        return max(0, self.in_flight - self.max_workers)
+
+    def check_capacity(self):
+        """
+        Fail fast if a new task would exceed the queue depth.
+
+        Raises:
+            ExecutorBusyError: If a new task would exceed the queue depth
+        """
+        if self.in_flight >= self.max_workers + self.max_queue:
+            raise ExecutorBusyError(
+                f"Scoring queue is full ({self.in_flight} requests in flight)"
+            )
+
+    def _acquire(self):
+        self.check_capacity()
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run func(*args, **kwargs) on a scoring thread.
+
+        Raises:
+            ExecutorBusyError: If the queue is full
+        """
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        finally:
+            self._release()
+
+    async def stream(self, iterator: Iterator) -> AsyncIterator:
+        """
+        Consume a blocking iterator on a scoring thread, one item at a time.
+
+        The stream holds a single in-flight slot until it is exhausted.
+
+        Raises:
+            ExecutorBusyError: If the queue is full when the stream starts
+        """
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            done = object()
+            while True:
+                item = await loop.run_in_executor(self._executor, next, iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            self._release()
+
+    def shutdown(self):
+        """Stop accepting work and wait for running tasks."""
+        self._executor.shutdown(wait=True)
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read a positive integer from the environment."""
+    value = os.environ.get(name)
+    return max(1, int(value)) if value else default
+
+
+EXECUTION_MODE = os.environ.get('FUZZY_EXECUTION_MODE', 'thread').lower()
+if EXECUTION_MODE not in ('thread', 'process'):
+    raise ValueError(f"FUZZY_EXECUTION_MODE must be 'thread' or 'process', got {EXECUTION_MODE!r}")
+
+# In process mode each scoring thread just waits on its worker process
+_default_workers = os.cpu_count() or 1
+if EXECUTION_MODE == 'thread':
+    _default_workers = min(8, _default_workers)
+
+scoring_executor = ScoringExecutor(
+    max_workers=_env_int('FUZZY_MAX_WORKERS', _default_workers),
+    max_queue=_env_int('FUZZY_MAX_QUEUE', 64)
+)
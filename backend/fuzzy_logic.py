@@ -7,12 +7,486 @@ This module implements a fuzzy logic controller that recommends gifts based on:
 - Occasion and style preferences
 """
 
+import functools
+import logging
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-from typing import Dict, List, Any
-import json
+import operator
+import secrets
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 import os
+import threading
+from collections.abc import Sequence as SequenceABC
+from concurrent.futures.process import BrokenProcessPool
+
+from catalog import AGE_BANDS, GiftCatalog
+from records import GiftView
+from inference import CompiledFuzzyEngine
+from cache import ResultCache
+from artifact import (
+    ENGINE_SOURCES, GIFTS_PATH, SURFACE_SOURCES, artifact_dir, content_hash, load_engine,
+    load_surface, open_catalog, save_engine, save_surface
+)
+from metrics import metrics
+from pairs import PairSelector
+from prefilter import CatalogPrefilter
+from responses import GiftFragments
+from rulebase import RULES_PATH, RuleBase, RuleReport
+from surface import SURFACE_RESOLUTION, ScoreSurface
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScoringContext:
+    """
+    Request-derived values shared by every gift scored for one request.
+
+    The fuzzy base scores only depend on the user and recipient data, so
+    they are computed once per request and reused for every gift in the
+    catalog. ``base_score`` is the default controller's output and
+    ``controller_scores`` the output of every controller of the rule base
+    (the default one first), a gift getting the score of its category's
+    controller. ``base_score`` is None when the default controller could
+    not produce an output (e.g. no rule fired), in which case every gift
+    scores 0.
+    """
+    base_score: Optional[float]
+    age: float
+    budget: float
+    relationship: float
+    personality: float
+    technical: float
+    creative: float
+    managerial: float
+    academic: float
+    occasion: str
+    style: str
+    gender: str
+    age_band: str
+    controller_scores: Optional[np.ndarray] = None
+
+    def profile_key(self) -> tuple:
+        """Hashable key of every field the scores depend on, except the base scores."""
+        return (
+            self.age, self.budget, self.relationship, self.personality, self.technical,
+            self.creative, self.managerial, self.academic, self.occasion, self.style,
+            self.gender, self.age_band
+        )
+
+
+# Fuzzy controller input -> ScoringContext field
+ENGINE_INPUTS = {
+    'user_age': 'age',
+    'user_budget': 'budget',
+    'relationship': 'relationship',
+    'personality': 'personality',
+    'technical': 'technical',
+    'creative': 'creative',
+    'managerial': 'managerial',
+    'academic': 'academic',
+}
+
+# Number of profile x gift scores materialized at once by recommend_batch
+BATCH_CHUNK_CELLS = 2_000_000
+
+# Gifts per block of the candidate prefilter (FUZZY_PREFILTER_BLOCK, 0
+# disables it); catalogs smaller than PREFILTER_MIN_BLOCKS blocks are
+# always scored in full
+PREFILTER_BLOCK = int(os.environ.get('FUZZY_PREFILTER_BLOCK', 4096))
+PREFILTER_MIN_BLOCKS = 4
+
+# Attributes created by _build_controller, which imports scikit-fuzzy. The
+# engine is compiled from the rule base directly, so they are only needed
+# as a reference implementation.
+CONTROLLER_ATTRIBUTES = frozenset(['fuzzy_variables', 'rules', 'control_system', 'simulator'])
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    """A validated rule base with its compiled engine and base scorer."""
+    rule_base: RuleBase
+    report: RuleReport
+    engine: CompiledFuzzyEngine
+    base_scorer: Union[ScoreSurface, CompiledFuzzyEngine]
+
+    def category_controllers(self, catalog: GiftCatalog) -> Optional[np.ndarray]:
+        """
+        Controller scoring each category of a catalog, by category code.
+
+        Returns:
+            Index into the engine's controllers per category, or None when
+            the rule base only has the default controller
+        """
+        if not self.rule_base.controllers:
+            return None
+        return self.rule_base.category_controllers(catalog.categories.values)
+
+
+def compile_rules(rules_path: str = RULES_PATH) -> CompiledRules:
+    """
+    Load, validate and compile a rule base file.
+    
+    Results are cached by file content, in memory and as startup artifacts,
+    so loading a rule base again (e.g. swapping back to it) is cheap.
+    
+    Raises:
+        ValueError: If the rule base is invalid
+    """
+    return _compile_rules(content_hash(ENGINE_SOURCES + [rules_path]), rules_path)
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_rules(key: str, rules_path: str) -> CompiledRules:
+    rule_base = RuleBase.load(rules_path)
+    # Merged and dead rules are reported by RuleReport.notices, not here:
+    # this also runs in every worker process
+    report = rule_base.analyze()
+    
+    directory = artifact_dir()
+    engine = load_engine(directory, key) if directory else None
+    if engine is None:
+        engine = rule_base.compile(report)
+        if directory:
+            try:
+                save_engine(directory, key, engine)
+            except OSError as e:
+                print(f"Could not save compiled engine: {e}")
+    
+    surface = None
+    if SURFACE_RESOLUTION > 0:
+        surface_key = f"{content_hash(SURFACE_SOURCES + [rules_path])}r{SURFACE_RESOLUTION}"
+        surface = load_surface(directory, surface_key, engine) if directory else None
+        if surface is None:
+            surface = ScoreSurface.build(engine, SURFACE_RESOLUTION)
+            if directory:
+                try:
+                    save_surface(directory, surface_key, surface)
+                except OSError as e:
+                    print(f"Could not save base score surface: {e}")
+    return CompiledRules(rule_base, report, engine, surface or engine)
+
+
+@metrics.timed('sorting')
+def top_k(scores: np.ndarray, k: int, *tiebreaks: np.ndarray) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first, without sorting every score.
+    
+    A partition finds the k-th highest score; only the gifts scoring at
+    least that much are sorted. Ties are broken by the tiebreak arrays
+    (higher first, in the given order) and then by lower index, so the
+    result equals the first k entries of a stable descending sort.
+    
+    Args:
+        scores: Scores in catalog order
+        k: Number of indices to return
+        tiebreaks: Secondary keys for gifts with equal scores
+    
+    Returns:
+        Array of at most k catalog indices
+    """
+    n = len(scores)
+    k = max(0, min(k, n))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    
+    if k < n:
+        threshold = np.partition(scores, n - k)[n - k]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(n)
+    
+    if not tiebreaks:
+        order = np.argsort(-scores[candidates], kind='stable')
+    else:
+        keys = [candidates] + [-key[candidates] for key in reversed(tiebreaks)]
+        order = np.lexsort(keys + [-scores[candidates]])
+    return candidates[order[:k]]
+
+
+@metrics.timed('sorting')
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Row-wise top_k for a (profiles, gifts) score matrix.
+    
+    Returns:
+        (profiles, min(k, gifts)) matrix of catalog indices, best first
+    """
+    n = scores.shape[1]
+    k = max(0, min(k, n))
+    if k == 0:
+        return np.empty((len(scores), 0), dtype=np.intp)
+    if k == n:
+        return np.argsort(-scores, axis=1, kind='stable')
+    
+    threshold = np.partition(scores, n - k, axis=1)[:, n - k, np.newaxis]
+    is_candidate = scores >= threshold
+    width = int(is_candidate.sum(axis=1).max()) if len(scores) else k
+    
+    # Candidates of every row, in catalog order (a stable sort of booleans
+    # is a linear-time radix sort); rows with fewer candidates are padded
+    candidates = np.argsort(~is_candidate, axis=1, kind='stable')[:, :width]
+    values = np.take_along_axis(scores, candidates, axis=1)
+    values[~np.take_along_axis(is_candidate, candidates, axis=1)] = -np.inf
+    
+    order = np.argsort(-values, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+@dataclass
+class ProfileBatch:
+    """
+    Request-derived values for many profiles, one row per profile.
+
+    The columnar counterpart of ScoringContext, used to score a matrix of
+    profiles x gifts. ``base_score`` is NaN for rows whose fuzzy controller
+    produced no output or whose data could not be converted;
+    ``controller_scores`` holds every controller's output, one column per
+    controller.
+    """
+    base_score: np.ndarray
+    controller_scores: np.ndarray
+    budget: np.ndarray
+    relationship: np.ndarray
+    traits: np.ndarray
+    occasion: List[str]
+    style: List[str]
+    gender: List[str]
+    age_band: np.ndarray
+
+    @classmethod
+    def from_contexts(cls, contexts: List[Optional[ScoringContext]]) -> 'ProfileBatch':
+        """Stack scoring contexts into arrays; None contexts become NaN rows."""
+        placeholder = ScoringContext(None, 50, 50, 50, 50, 50, 50, 50, 50, '', '', '', 'middle')
+        contexts = [context if context is not None else placeholder for context in contexts]
+        base_score = np.array([
+            np.nan if context.base_score is None else context.base_score
+            for context in contexts
+        ], dtype=np.float64)
+        # Rows without controller scores repeat their base score
+        controllers = max([
+            len(context.controller_scores) for context in contexts
+            if context.controller_scores is not None
+        ], default=1)
+        controller_scores = np.repeat(base_score[:, np.newaxis], controllers, axis=1)
+        for row, context in enumerate(contexts):
+            if context.base_score is not None and context.controller_scores is not None:
+                controller_scores[row] = context.controller_scores
+        return cls(
+            base_score=base_score,
+            controller_scores=controller_scores,
+            budget=np.array([context.budget for context in contexts], dtype=np.float64),
+            relationship=np.array([context.relationship for context in contexts], dtype=np.float64),
+            traits=np.array([
+                [context.personality, context.technical, context.creative,
+                 context.managerial, context.academic]
+                for context in contexts
+            ], dtype=np.float64).reshape(len(contexts), 5),
+            occasion=[context.occasion for context in contexts],
+            style=[context.style for context in contexts],
+            gender=[context.gender for context in contexts],
+            age_band=np.array([AGE_BANDS.index(context.age_band) for context in contexts],
+                              dtype=np.intp)
+        )
+
+    def __len__(self):
+        return len(self.base_score)
+
+
+class RankedScores:
+    """
+    Catalog scores for one profile, with the best-ranked prefix kept once
+    it has been selected.
+
+    Instances are shared through the result cache, so the arrays are
+    read-only. ``context`` is the profile the scores were computed for, so
+    they can be carried over to an updated catalog.
+    """
+
+    def __init__(self, scores: np.ndarray, context: Optional[ScoringContext] = None):
+        self.scores = scores
+        self.context = context
+        self.scores.flags.writeable = False
+        self._order = np.empty(0, dtype=np.intp)
+
+    @property
+    def nbytes(self) -> int:
+        # The ranked prefix is only as long as the largest top_n requested
+        return self.scores.nbytes
+
+    def top(self, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (catalog indices, scores) of the top N gifts; ties keep catalog order."""
+        order = self._order
+        if len(order) < min(top_n, len(self.scores)):
+            order = top_k(self.scores, top_n)
+            order.flags.writeable = False
+            self._order = order
+        order = order[:top_n]
+        return order, self.scores[order]
+
+
+class PrunedRanking:
+    """
+    Top-K ranking for one profile, found by the candidate prefilter
+    without scoring the whole catalog.
+    
+    Used in place of RankedScores for large catalogs.
+    """
+
+    def __init__(self, prefilter: CatalogPrefilter, bounds: np.ndarray,
+                 score_block: Callable[[Union[slice, np.ndarray]], np.ndarray]):
+        """
+        Args:
+            prefilter: Block summaries of the catalog
+            bounds: Upper bound of the scores in each block
+            score_block: Scores the gifts of a catalog slice or index array
+        """
+        self.prefilter = prefilter
+        self.bounds = bounds
+        self.score_block = score_block
+        self._order = np.empty(0, dtype=np.intp)
+        self._scores = np.empty(0, dtype=np.float64)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bounds.nbytes
+
+    @metrics.timed('candidate_prefilter')
+    def top(self, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (catalog indices, scores) of the top N gifts; ties keep catalog order."""
+        if len(self._order) < min(top_n, len(self.prefilter.catalog)):
+            self._order, self._scores = self.prefilter.scan(self.bounds, top_n, self.score_block)
+        return self._order[:top_n], self._scores[:top_n]
+
+
+class ScoringSession:
+    """
+    Scores of one image pair flow, kept for its final refinement.
+
+    Attributes:
+        version: Catalog version the scores belong to
+        profile_key: ScoringContext.profile_key of the scored profile
+        ranked: RankedScores or PrunedRanking of the profile
+        rounds: Number of pairs shown, each answered by one selection
+    """
+
+    def __init__(self, version: int, profile_key: tuple, ranked, rounds: Optional[int] = None):
+        self.version = version
+        self.profile_key = profile_key
+        self.ranked = ranked
+        self.rounds = rounds
+
+    @property
+    def nbytes(self) -> int:
+        return self.ranked.nbytes
+
+
+class RankedGifts(SequenceABC):
+    """
+    Ranked gifts of a catalog: their catalog indices and scores.
+
+    Items are read-only GiftViews carrying their score as 'fuzzy_score',
+    built on access, so ranking a request never copies gift dictionaries.
+    Equal to the list of the same gift dictionaries with their scores.
+    """
+
+    __slots__ = ('gifts', 'indices', 'scores', 'fragments')
+
+    def __init__(
+        self,
+        gifts: Sequence,
+        indices: np.ndarray,
+        scores: np.ndarray,
+        fragments: Optional[GiftFragments] = None
+    ):
+        """
+        Args:
+            gifts: Gift sequence of the catalog the indices refer to
+            indices: Catalog indices of the gifts, best first
+            scores: Score of each gift
+            fragments: Pre-rendered responses of the same catalog, or None
+        """
+        self.gifts = gifts
+        self.indices = indices
+        self.scores = scores
+        self.fragments = fragments
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return RankedGifts(self.gifts, self.indices[i], self.scores[i], self.fragments)
+        return GiftView(self.gifts, int(self.indices[i]), float(self.scores[i]))
+
+    def __eq__(self, other):
+        if not isinstance(other, SequenceABC) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return f"RankedGifts({list(self)!r})"
+
+
+class CatalogSnapshot:
+    """
+    A catalog together with everything derived from it.
+
+    Snapshots are never modified once published: a reload or a change of
+    execution mode builds a new snapshot and swaps it in, so a request that
+    pinned the previous one keeps ranking and materializing against a
+    consistent catalog until it finishes.
+
+    Attributes:
+        catalog: Columnar catalog; catalog.gifts are the gift dictionaries
+        prefilter: Candidate prefilter, or None to score the whole catalog
+        version: Catalog version, part of every result cache key
+        process_pool: Ranker binding this catalog to the worker processes,
+            or None
+        rules: Compiled rule base scoring this catalog
+        category_controllers: Controller of each category code, or None
+            when every gift uses the default controller
+        gift_controllers: Controller of each gift, or None likewise
+        fragments: Pre-rendered API responses of the gifts, or None when
+            the system doesn't serve requests (see responses.py)
+    """
+
+    def __init__(
+        self,
+        catalog: GiftCatalog,
+        prefilter: Optional[CatalogPrefilter],
+        version: int,
+        process_pool=None,
+        rules: Optional[CompiledRules] = None,
+        fragments: Optional[GiftFragments] = None
+    ):
+        self.catalog = catalog
+        self.prefilter = prefilter
+        self.version = version
+        self.process_pool = process_pool
+        self.rules = rules
+        self.fragments = fragments
+        self.category_controllers = rules.category_controllers(catalog) if rules else None
+        self.gift_controllers = None
+        if self.category_controllers is not None:
+            # Invalid gifts (category code -1) use the default controller
+            self.gift_controllers = np.append(self.category_controllers, 0)[catalog.category_codes]
+        # Requests currently using the snapshot, guarded by the owning
+        # system's snapshot lock
+        self.users = 0
+        self.retired = False
+
+    @property
+    def gifts(self):
+        return self.catalog.gifts
+
+    def replace(self, **changes) -> 'CatalogSnapshot':
+        """Return a new, unpinned snapshot with some attributes changed."""
+        attributes = dict(catalog=self.catalog, prefilter=self.prefilter, version=self.version,
+                          process_pool=self.process_pool, rules=self.rules, fragments=self.fragments)
+        attributes.update(changes)
+        return CatalogSnapshot(**attributes)
 
 
 class GiftRecommendationFuzzySystem:
@@ -23,299 +497,635 @@ class GiftRecommendationFuzzySystem:
     based on compatibility with the gift giver and recipient.
     """
     
-    def __init__(self):
-        """Initialize the fuzzy system with all variables and rules."""
-        self._setup_fuzzy_variables()
-        self._setup_membership_functions()
-        self._setup_rules()
-        self._create_control_system()
-        self._load_gifts_data()
+    def __init__(
+        self,
+        catalog: Optional[GiftCatalog] = None,
+        rules_path: Optional[str] = None,
+        prerender: bool = True
+    ):
+        """
+        Initialize the fuzzy system with all variables and rules.
+        
+        The rule base is compiled into the inference engine, and the
+        compiled engine and catalog are loaded from the startup artifacts
+        when they are up to date; the scikit-fuzzy controller is only built
+        when one of its attributes is used.
+        
+        Args:
+            catalog: Prebuilt catalog to score against; gifts.json is loaded
+                when omitted
+            rules_path: Rule base file (default: FUZZY_RULES_PATH)
+            prerender: Pre-render the API responses of every catalog's
+                gifts, see responses.py; off for systems that only rank
+        """
+        self.rules_path = rules_path or RULES_PATH
+        self.prerender = prerender
+        self.cache = ResultCache.from_env()
+        self.sessions = ResultCache.from_env('FUZZY_SESSION', size=4096, ttl=900)
+        self.pair_selector = PairSelector.from_env()
+        self._controller_lock = threading.Lock()
+        # Guards swapping the snapshot and its users counters
+        self._snapshot_lock = threading.Lock()
+        # Serializes catalog and rule reloads and execution mode changes
+        self._reload_lock = threading.Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        # Replaced snapshots that requests still use
+        self._pinned_retired = set()
+        self._load_engine()
+        if catalog is None:
+            self._load_gifts_data()
+        else:
+            self.set_catalog(catalog)
+    
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        """The current catalog snapshot, see pin_snapshot to use it safely."""
+        return self._snapshot
     
-    def _setup_fuzzy_variables(self):
-        """Define all fuzzy input and output variables."""
+    @property
+    def catalog(self) -> GiftCatalog:
+        return self._snapshot.catalog
+    
+    @property
+    def gifts(self):
+        return self._snapshot.gifts
+    
+    @property
+    def catalog_version(self) -> int:
+        return self._snapshot.version
+    
+    @property
+    def process_pool(self):
+        return self._snapshot.process_pool
+    
+    @property
+    def prefilter(self) -> Optional[CatalogPrefilter]:
+        return self._snapshot.prefilter
+    
+    @prefilter.setter
+    def prefilter(self, prefilter: Optional[CatalogPrefilter]):
+        # Swapped in like any other snapshot change
+        with self._reload_lock:
+            self._publish(self._snapshot.replace(prefilter=prefilter))
+    
+    @contextmanager
+    def pin_snapshot(self, snapshot: Optional[CatalogSnapshot] = None) -> Iterator[CatalogSnapshot]:
+        """
+        Use the current snapshot for the duration of a with block.
         
-        # Input variables for USER (gift giver)
-        self.user_age = ctrl.Antecedent(np.arange(0, 101, 1), 'user_age')
-        self.user_budget = ctrl.Antecedent(np.arange(0, 101, 1), 'user_budget')
-        self.relationship = ctrl.Antecedent(np.arange(0, 101, 1), 'relationship')
+        A snapshot replaced while pinned stays usable (its worker processes
+        keep running) until the last request using it is done.
         
-        # Input variables for RECIPIENT
-        self.personality = ctrl.Antecedent(np.arange(0, 101, 1), 'personality')
-        self.technical = ctrl.Antecedent(np.arange(0, 101, 1), 'technical')
-        self.creative = ctrl.Antecedent(np.arange(0, 101, 1), 'creative')
-        self.managerial = ctrl.Antecedent(np.arange(0, 101, 1), 'managerial')
-        self.academic = ctrl.Antecedent(np.arange(0, 101, 1), 'academic')
+        Args:
+            snapshot: Snapshot already pinned by the caller, used as-is
+        """
+        if snapshot is not None:
+            yield snapshot
+            return
+        
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            snapshot.users += 1
+        try:
+            yield snapshot
+        finally:
+            with self._snapshot_lock:
+                snapshot.users -= 1
+                release = snapshot.retired and snapshot.users == 0
+            if release:
+                self._release_snapshot(snapshot)
+    
+    def _publish(self, snapshot: CatalogSnapshot):
+        """Atomically replace the current snapshot; callers hold the reload lock."""
+        with self._snapshot_lock:
+            previous, self._snapshot = self._snapshot, snapshot
+            release = False
+            if previous is not None:
+                previous.retired = True
+                release = previous.users == 0
+                if not release:
+                    self._pinned_retired.add(previous)
+        if release:
+            self._release_snapshot(previous)
+    
+    def _release_snapshot(self, snapshot: CatalogSnapshot):
+        """Unbind the catalog of a retired snapshot that no longer has users from the worker processes."""
+        pool = snapshot.process_pool
+        with self._snapshot_lock:
+            self._pinned_retired.discard(snapshot)
+            # Snapshots that only changed the prefilter share their pool
+            in_use = any(
+                other.process_pool is pool
+                for other in self._pinned_retired | {self._snapshot}
+            )
+        if pool is not None and not in_use:
+            pool.close()
+    
+    def __getattr__(self, name: str):
+        # Only called for attributes that don't exist yet
+        if name not in CONTROLLER_ATTRIBUTES:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        self._build_controller()
+        return self.__dict__[name]
+    
+    def _build_controller(self):
+        """Build the scikit-fuzzy variables, rules and control system of the rule base once."""
+        with self._controller_lock:
+            if 'simulator' in self.__dict__:
+                return
+            self._setup_fuzzy_variables()
+            self._setup_membership_functions()
+            self._setup_rules()
+            self._create_control_system()
+    
+    def _load_engine(self):
+        """Compile the rule base, or reuse its compiled engine and score surface."""
+        compiled = compile_rules(self.rules_path)
+        self.compiled_rules = compiled
+        self.rule_base = compiled.rule_base
+        self.rule_report = compiled.report
+        # Compiled, stateless version of the controller, safe to call from
+        # any number of threads
+        self.engine = compiled.engine
+        # Computes the base scores at request time: the score surface, or
+        # the engine itself when the surface is disabled
+        self.base_scorer = compiled.base_scorer
+    
+    def load_rules(self, rules_path: Optional[str] = None) -> RuleReport:
+        """
+        Compile a rule base file and score with it from now on.
         
-        # Output variable - gift compatibility score
-        self.gift_score = ctrl.Consequent(np.arange(0, 101, 1), 'gift_score')
+        The new rules are validated and compiled before anything changes,
+        so an invalid file leaves the current rules in place. Cached scores
+        of the previous rules are never served: the snapshot version is
+        bumped like for a catalog reload, and worker processes restart with
+        the new rules.
+        
+        Args:
+            rules_path: Rule base file (default: the current one)
+        
+        Returns:
+            The analysis of the loaded rules
+        
+        Raises:
+            ValueError: If the rule base is invalid
+        """
+        rules_path = rules_path or self.rules_path
+        compiled = compile_rules(rules_path)
+        with self._reload_lock:
+            with self._controller_lock:
+                # The scikit-fuzzy reference is rebuilt on next use
+                for name in CONTROLLER_ATTRIBUTES:
+                    self.__dict__.pop(name, None)
+                self.rules_path = rules_path
+                self.compiled_rules = compiled
+                self.rule_base = compiled.rule_base
+                self.rule_report = compiled.report
+                self.engine = compiled.engine
+                self.base_scorer = compiled.base_scorer
+            
+            current = self._snapshot
+            process_pool = None
+            if current.process_pool is not None:
+                process_pool = self._bind_workers(current.process_pool, current.catalog)
+            self._publish(current.replace(
+                version=current.version + 1, process_pool=process_pool, rules=compiled
+            ))
+        self.cache.clear()
+        return compiled.report
+    
+    def _setup_fuzzy_variables(self):
+        """Define the fuzzy input and output variables of the rule base."""
+        from skfuzzy import control as ctrl
+        
+        self.fuzzy_variables = {
+            name: ctrl.Antecedent(variable.universe, name)
+            for name, variable in self.rule_base.inputs.items()
+        }
+        output = self.rule_base.output
+        self.fuzzy_variables[output.name] = ctrl.Consequent(output.universe, output.name)
     
     def _setup_membership_functions(self):
-        """Define membership functions for all variables."""
-        
-        # User age membership functions
-        self.user_age['young'] = fuzz.trapmf(self.user_age.universe, [0, 0, 25, 40])
-        self.user_age['middle'] = fuzz.trimf(self.user_age.universe, [30, 50, 70])
-        self.user_age['mature'] = fuzz.trapmf(self.user_age.universe, [60, 75, 100, 100])
-        
-        # Budget membership functions
-        self.user_budget['low'] = fuzz.trapmf(self.user_budget.universe, [0, 0, 30, 45])
-        self.user_budget['medium'] = fuzz.trimf(self.user_budget.universe, [35, 50, 65])
-        self.user_budget['high'] = fuzz.trapmf(self.user_budget.universe, [55, 70, 100, 100])
-        
-        # Relationship closeness membership functions
-        self.relationship['distant'] = fuzz.trapmf(self.relationship.universe, [0, 0, 20, 40])
-        self.relationship['friend'] = fuzz.trimf(self.relationship.universe, [30, 50, 70])
-        self.relationship['close'] = fuzz.trapmf(self.relationship.universe, [60, 80, 100, 100])
-        
-        # Personality (introvert to extrovert) membership functions
-        self.personality['introvert'] = fuzz.trapmf(self.personality.universe, [0, 0, 30, 50])
-        self.personality['ambivert'] = fuzz.trimf(self.personality.universe, [35, 50, 65])
-        self.personality['extrovert'] = fuzz.trapmf(self.personality.universe, [50, 70, 100, 100])
-        
-        # Technical skill membership functions
-        self.technical['low'] = fuzz.trapmf(self.technical.universe, [0, 0, 30, 50])
-        self.technical['medium'] = fuzz.trimf(self.technical.universe, [35, 50, 65])
-        self.technical['high'] = fuzz.trapmf(self.technical.universe, [50, 70, 100, 100])
-        
-        # Creative skill membership functions
-        self.creative['low'] = fuzz.trapmf(self.creative.universe, [0, 0, 30, 50])
-        self.creative['medium'] = fuzz.trimf(self.creative.universe, [35, 50, 65])
-        self.creative['high'] = fuzz.trapmf(self.creative.universe, [50, 70, 100, 100])
-        
-        # Managerial skill membership functions
-        self.managerial['low'] = fuzz.trapmf(self.managerial.universe, [0, 0, 30, 50])
-        self.managerial['medium'] = fuzz.trimf(self.managerial.universe, [35, 50, 65])
-        self.managerial['high'] = fuzz.trapmf(self.managerial.universe, [50, 70, 100, 100])
-        
-        # Academic interest membership functions
-        self.academic['low'] = fuzz.trapmf(self.academic.universe, [0, 0, 30, 50])
-        self.academic['medium'] = fuzz.trimf(self.academic.universe, [35, 50, 65])
-        self.academic['high'] = fuzz.trapmf(self.academic.universe, [50, 70, 100, 100])
-        
-        # Gift score output membership functions
-        self.gift_score['poor'] = fuzz.trapmf(self.gift_score.universe, [0, 0, 20, 35])
-        self.gift_score['fair'] = fuzz.trimf(self.gift_score.universe, [25, 40, 55])
-        self.gift_score['good'] = fuzz.trimf(self.gift_score.universe, [45, 60, 75])
-        self.gift_score['excellent'] = fuzz.trapmf(self.gift_score.universe, [65, 80, 100, 100])
+        """Define the membership functions of every variable."""
+        import skfuzzy as fuzz
+        
+        for name, variable in self.rule_base.variables.items():
+            fuzzy_variable = self.fuzzy_variables[name]
+            for term, (kind, params) in variable.terms.items():
+                fuzzy_variable[term] = getattr(fuzz, kind)(fuzzy_variable.universe, list(params))
     
     def _setup_rules(self):
-        """Define fuzzy rules for gift recommendation."""
+        """Define the fuzzy rules as written in the rule base, duplicates and dead rules included."""
+        from skfuzzy import control as ctrl
         
+        output = self.fuzzy_variables[self.rule_base.output.name]
         self.rules = []
-        
-        # Rules for technical gifts (electronics, gadgets)
-        self.rules.append(ctrl.Rule(
-            self.technical['high'] & self.user_budget['high'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.technical['high'] & self.user_budget['medium'],
-            self.gift_score['good']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.technical['low'] & self.user_budget['high'],
-            self.gift_score['fair']
-        ))
-        
-        # Rules for creative gifts (art supplies, DIY kits)
-        self.rules.append(ctrl.Rule(
-            self.creative['high'] & self.personality['introvert'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.creative['high'] & self.user_budget['medium'],
-            self.gift_score['good']
-        ))
-        
-        # Rules for academic gifts (books, courses, stationery)
-        self.rules.append(ctrl.Rule(
-            self.academic['high'] & self.personality['introvert'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.academic['high'] & self.managerial['high'],
-            self.gift_score['good']
-        ))
-        
-        # Rules for managerial/professional gifts (planners, desk items)
-        self.rules.append(ctrl.Rule(
-            self.managerial['high'] & self.user_budget['high'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.managerial['high'] & self.academic['high'],
-            self.gift_score['good']
-        ))
-        
-        # Rules for social/experience gifts
-        self.rules.append(ctrl.Rule(
-            self.personality['extrovert'] & self.relationship['close'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.personality['extrovert'] & self.user_budget['high'],
-            self.gift_score['good']
-        ))
-        
-        # Rules based on relationship closeness
-        self.rules.append(ctrl.Rule(
-            self.relationship['close'] & self.user_budget['high'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.relationship['close'] & self.user_budget['medium'],
-            self.gift_score['good']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.relationship['distant'] & self.user_budget['low'],
-            self.gift_score['fair']
-        ))
-        
-        # Rules for budget constraints
-        self.rules.append(ctrl.Rule(
-            self.user_budget['low'] & self.relationship['distant'],
-            self.gift_score['fair']
-        ))
-        
-        # Balanced gifts for ambiverts
-        self.rules.append(ctrl.Rule(
-            self.personality['ambivert'] & self.creative['medium'],
-            self.gift_score['good']
-        ))
-        
-        # Rules involving user age (needed to activate the variable)
-        self.rules.append(ctrl.Rule(
-            self.user_age['young'] & self.technical['high'],
-            self.gift_score['excellent']
-        ))
-        self.rules.append(ctrl.Rule(
-            self.user_age['mature'] & self.academic['high'],
-            self.gift_score['good']
-        ))
-        
-        # Default rules
-        self.rules.append(ctrl.Rule(
-            self.user_budget['medium'] & self.relationship['friend'],
-            self.gift_score['good']
-        ))
+        for rule in self.rule_base.rules:
+            antecedent = functools.reduce(operator.and_, [
+                self.fuzzy_variables[name][term] for name, term in rule.antecedents
+            ])
+            consequent = output[rule.consequent]
+            if rule.weight != 1.0:
+                consequent = consequent % rule.weight
+            self.rules.append(ctrl.Rule(antecedent, consequent))
     
     def _create_control_system(self):
         """Create the fuzzy control system from rules."""
+        from skfuzzy import control as ctrl
+        
         self.control_system = ctrl.ControlSystem(self.rules)
+        # Reference implementation only: a simulation holds its inputs as
+        # state, so it must not be shared between concurrent requests
         self.simulator = ctrl.ControlSystemSimulation(self.control_system)
     
     def _load_gifts_data(self):
-        """Load gifts from JSON file."""
-        gifts_path = os.path.join(os.path.dirname(__file__), 'data', 'gifts.json')
-        with open(gifts_path, 'r') as f:
-            data = json.load(f)
-            self.gifts = data['gifts']
+        """Load gifts from the catalog artifact, converting gifts.json if needed."""
+        self.set_catalog(open_catalog())
     
-    def calculate_gift_score(self, gift: Dict, user_data: Dict, recipient_data: Dict) -> float:
+    def set_catalog(self, catalog: GiftCatalog):
         """
-        Calculate fuzzy logic score for a specific gift.
+        Score against a new catalog, invalidating cached results.
+        
+        The prefilter, pre-rendered responses (and worker processes, if
+        enabled) for the new catalog are built before it is swapped in, so requests never wait
+        for them; requests already running finish against the old catalog.
+        Cache keys include the catalog version, so results computed
+        concurrently against the previous catalog are never served.
+        """
+        prefilter = None
+        if PREFILTER_BLOCK > 0 and len(catalog) >= PREFILTER_MIN_BLOCKS * PREFILTER_BLOCK:
+            prefilter = CatalogPrefilter(catalog, PREFILTER_BLOCK)
+        fragments = None
+        if self.prerender and catalog.gifts is not None:
+            fragments = GiftFragments.of(catalog.gifts)
+        
+        with self._reload_lock:
+            current = self._snapshot
+            process_pool = None
+            if current is not None and current.process_pool is not None:
+                process_pool = self._bind_workers(current.process_pool, catalog)
+            version = current.version + 1 if current is not None else 1
+            self._publish(CatalogSnapshot(
+                catalog, prefilter, version, process_pool, self.compiled_rules, fragments
+            ))
+        self.cache.clear()
+    
+    def update_gifts(self, upserts: List[Dict] = (), deletes: List[str] = ()) -> CatalogSnapshot:
+        """
+        Add, replace or remove individual gifts without rebuilding the catalog.
+        
+        Only the changed gifts are compiled, and the indexes, prefilter
+        blocks, pre-rendered responses and cached scores are patched for
+        their rows; the result is swapped in like a reload. Changes are kept
+        in memory only: a reload of gifts.json replaces them.
+        
+        Args:
+            upserts: Gift dictionaries to add, or to replace the gift with
+                the same id
+            deletes: Ids of the gifts to remove
+        
+        Returns:
+            The snapshot now in use
+        
+        Raises:
+            KeyError: If a deleted id is unknown
+            ValueError: If an upserted gift is invalid; nothing is changed
+        """
+        with self._reload_lock:
+            current = self._snapshot
+            catalog, changed = current.catalog.updated(upserts, deletes)
+            
+            prefilter = None
+            if PREFILTER_BLOCK > 0 and len(catalog) >= PREFILTER_MIN_BLOCKS * PREFILTER_BLOCK:
+                if current.prefilter is not None and current.prefilter.block_size == PREFILTER_BLOCK:
+                    prefilter = current.prefilter.updated(catalog, changed)
+                else:
+                    prefilter = CatalogPrefilter(catalog, PREFILTER_BLOCK)
+            process_pool = None
+            if current.process_pool is not None:
+                process_pool = self._bind_workers(current.process_pool, catalog)
+            fragments = None
+            if current.fragments is not None:
+                fragments = current.fragments.updated(catalog.gifts, changed)
+            snapshot = CatalogSnapshot(
+                catalog, prefilter, current.version + 1, process_pool, current.rules, fragments
+            )
+            
+            carried = self._carry_scores(current, snapshot, changed)
+            self._publish(snapshot)
+        self.cache.clear()
+        for key, ranked in carried:
+            self.cache.put(key, ranked)
+        return snapshot
+    
+    def _carry_scores(
+        self,
+        previous: CatalogSnapshot,
+        snapshot: CatalogSnapshot,
+        changed: np.ndarray
+    ) -> List[Tuple[tuple, RankedScores]]:
+        """
+        Rescore the changed rows of the cached full-catalog scores.
+        
+        Returns:
+            (cache key, RankedScores) pairs for the updated snapshot
+        """
+        carried = []
+        n = len(snapshot.catalog)
+        for key, ranked in self.cache.items():
+            if key[0] != previous.version or not isinstance(ranked, RankedScores) or ranked.context is None:
+                continue
+            scores = np.zeros(n, dtype=np.float64)
+            kept = min(n, len(ranked.scores))
+            scores[:kept] = ranked.scores[:kept]
+            if len(changed):
+                batch = ProfileBatch.from_contexts([ranked.context])
+                scores[changed] = self.score_profiles(batch, gifts=changed, snapshot=snapshot)[0]
+            carried.append(((snapshot.version,) + key[1:], RankedScores(scores, ranked.context)))
+        return carried
+    
+    def reload_catalog(self, gifts_path: str = GIFTS_PATH) -> CatalogSnapshot:
+        """
+        Load a JSON catalog again and swap it in without interrupting requests.
+        
+        Blocks the calling thread while the new catalog artifact, indexes and
+        prefilter are built; call it from a background thread. If loading
+        fails, the current catalog stays in place.
+        
+        Args:
+            gifts_path: JSON catalog to load
+        
+        Returns:
+            The snapshot now in use
+        """
+        self.set_catalog(open_catalog(gifts_path))
+        return self._snapshot
+    
+    def _prepare_context(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        quantum: float = 0.0
+    ) -> Optional[ScoringContext]:
+        """
+        Convert request data into a ScoringContext, without running the controller.
         
         Args:
-            gift: Gift item dictionary
             user_data: User preferences (age, budget, relationship, occasion)
             recipient_data: Recipient traits (personality, skills, style, gender)
+            quantum: Round the 0-100 values to multiples of this, 0 for none
         
         Returns:
-            Float score between 0 and 100
+            ScoringContext with base_score None, or None if the input data
+            could not be converted
         """
         try:
-            # Set input values for fuzzy system
-            self.simulator.input['user_age'] = float(user_data.get('age', 50))
-            self.simulator.input['user_budget'] = float(user_data.get('budget', 50))
-            self.simulator.input['relationship'] = float(user_data.get('relationship', 50))
+            age = float(user_data.get('age', 50))
+            budget = float(user_data.get('budget', 50))
+            relationship = float(user_data.get('relationship', 50))
+            
+            personality = float(recipient_data.get('personality', 50))
+            technical = float(recipient_data.get('technical', 50))
+            creative = float(recipient_data.get('creative', 50))
+            managerial = float(recipient_data.get('managerial', 50))
+            academic = float(recipient_data.get('academic', 50))
             
-            self.simulator.input['personality'] = float(recipient_data.get('personality', 50))
-            self.simulator.input['technical'] = float(recipient_data.get('technical', 50))
-            self.simulator.input['creative'] = float(recipient_data.get('creative', 50))
-            self.simulator.input['managerial'] = float(recipient_data.get('managerial', 50))
-            self.simulator.input['academic'] = float(recipient_data.get('academic', 50))
+            if quantum > 0:
+                age, budget, relationship, personality, technical, creative, managerial, academic = (
+                    round(value / quantum) * quantum
+                    for value in (age, budget, relationship, personality,
+                                  technical, creative, managerial, academic)
+                )
             
+            # Young users (0-40), middle age users (30-70), mature users (60+)
+            if age <= 40:
+                age_band = 'young'
+            elif 30 < age <= 70:
+                age_band = 'middle'
+            else:
+                age_band = 'mature'
+            
+            context = ScoringContext(
+                base_score=None,
+                age=age,
+                budget=budget,
+                relationship=relationship,
+                personality=personality,
+                technical=technical,
+                creative=creative,
+                managerial=managerial,
+                academic=academic,
+                occasion=user_data.get('occasion', ''),
+                style=recipient_data.get('style', ''),
+                gender=recipient_data.get('gender', '').lower(),
+                age_band=age_band
+            )
+        except Exception as e:
+            print(f"Error preparing scoring context: {e}")
+            return None
+        
+        return context
+    
+    def build_scoring_context(self, user_data: Dict, recipient_data: Dict) -> Optional[ScoringContext]:
+        """
+        Run the fuzzy controller once and precompute all request-derived values.
+        
+        Args:
+            user_data: User preferences (age, budget, relationship, occasion)
+            recipient_data: Recipient traits (personality, skills, style, gender)
+        
+        Returns:
+            ScoringContext to pass to score_gift, or None if the input data
+            could not be converted
+        """
+        context = self._prepare_context(user_data, recipient_data)
+        if context is not None:
+            self._compute_base_score(context)
+        return context
+    
+    @metrics.timed('fuzzy_inference')
+    def _compute_base_score(self, context: ScoringContext, snapshot: Optional[CatalogSnapshot] = None):
+        """
+        Run every fuzzy controller in one pass and store their outputs in
+        context.base_score and context.controller_scores.
+        
+        Args:
+            context: Context to complete
+            snapshot: Snapshot whose rules to run (default: the current one)
+        """
+        rules = (snapshot or self._snapshot).rules
+        try:
             # Compute fuzzy output
-            self.simulator.compute()
-            base_score = self.simulator.output['gift_score']
+            scores = rules.base_scorer.compute_controllers({
+                name: getattr(context, field) for name, field in ENGINE_INPUTS.items()
+            })
+            context.base_score = float(scores[0])
+            context.controller_scores = scores
+        except Exception as e:
+            print(f"Error computing fuzzy base score: {e}")
+    
+    def score_request(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        snapshot: Optional[CatalogSnapshot] = None
+    ):
+        """
+        Score the catalog for one request, through the result cache.
+        
+        Large catalogs go through the candidate prefilter, which only scores
+        the blocks of gifts that can still reach the top results.
+        
+        Args:
+            user_data: User preferences
+            recipient_data: Recipient traits
+            snapshot: Catalog snapshot to score (default: the current one)
+        
+        Returns:
+            RankedScores, or PrunedRanking when the prefilter is enabled;
+            shared with other requests for the same (quantized) profile
+        """
+        snapshot = snapshot or self._snapshot
+        context = self._prepare_context(user_data, recipient_data, quantum=self.cache.quantum)
+        if context is None:
+            return RankedScores(self.score_catalog(None, snapshot))
+        
+        key = (snapshot.version,) + context.profile_key()
+        ranked = self.cache.get(key)
+        if ranked is None:
+            self._compute_base_score(context, snapshot)
+            prefilter = snapshot.prefilter
+            if prefilter is None or context.base_score is None:
+                ranked = RankedScores(self.score_catalog(context, snapshot), context)
+            else:
+                batch = ProfileBatch.from_contexts([context])
+                category_scores = None
+                if snapshot.category_controllers is not None:
+                    category_scores = context.controller_scores[snapshot.category_controllers]
+                ranked = PrunedRanking(
+                    prefilter,
+                    prefilter.score_bounds(context, category_scores),
+                    lambda block: self.score_profiles(batch, gifts=block, snapshot=snapshot)[0]
+                )
+            self.cache.put(key, ranked)
+        return ranked
+    
+    @metrics.timed('fuzzy_inference')
+    def build_profile_batch(
+        self,
+        users: List[Dict],
+        recipients: List[Dict],
+        snapshot: Optional[CatalogSnapshot] = None
+    ) -> ProfileBatch:
+        """
+        Run every fuzzy controller for many profiles in one vectorized pass.
+        
+        Args:
+            users: User data per profile
+            recipients: Recipient data per profile, same length as users
+            snapshot: Snapshot whose rules to run (default: the current one)
+        
+        Returns:
+            ProfileBatch with one row per profile
+        """
+        if len(users) != len(recipients):
+            raise ValueError("users and recipients must have the same length")
+        
+        contexts = [
+            self._prepare_context(user_data, recipient_data)
+            for user_data, recipient_data in zip(users, recipients)
+        ]
+        batch = ProfileBatch.from_contexts(contexts)
+        
+        rules = (snapshot or self._snapshot).rules
+        batch.controller_scores = np.full((len(contexts), len(rules.engine.controller_names)), np.nan)
+        valid = np.array([context is not None for context in contexts], dtype=bool)
+        if valid.any():
+            inputs = {
+                name: np.array([getattr(context, field) for context in contexts if context is not None])
+                for name, field in ENGINE_INPUTS.items()
+            }
+            scores = rules.base_scorer.compute_controllers_batch(inputs)
+            batch.controller_scores[valid] = scores
+            batch.base_score[valid] = scores[:, 0]
+        return batch
+    
+    def score_gift(self, gift: Dict, context: Optional[ScoringContext]) -> float:
+        """
+        Score a single gift against a precomputed scoring context.
+        
+        Args:
+            gift: Gift item dictionary
+            context: Context returned by build_scoring_context
+        
+        Returns:
+            Float score between 0 and 100
+        """
+        if context is None or context.base_score is None:
+            return 0.0
+        
+        try:
+            # Base score of the controller of the gift's category
+            base_score = context.base_score
+            if context.controller_scores is not None and len(context.controller_scores) > 1:
+                base_score = context.controller_scores[self.rule_base.controller_of(gift['category'])]
             
             # Apply additional matching bonuses
             bonus_score = 0.0
             
             # Budget compatibility bonus (MULTIPLIED for greater impact)
             gift_price = gift['price_range']
-            user_budget_value = float(user_data.get('budget', 50))
-            budget_match = 100 - abs(gift_price - user_budget_value)
+            budget_match = 100 - abs(gift_price - context.budget)
             bonus_score += (budget_match / 100) * 20  # Increased from 10 to 20
             
             # Personality match bonus
-            personality_diff = abs(
-                gift['attributes']['personality'] - 
-                float(recipient_data.get('personality', 50))
-            )
+            personality_diff = abs(gift['attributes']['personality'] - context.personality)
             bonus_score += (1 - personality_diff / 100) * 10
             
             # Technical match bonus
-            technical_diff = abs(
-                gift['attributes']['technical'] - 
-                float(recipient_data.get('technical', 50))
-            )
+            technical_diff = abs(gift['attributes']['technical'] - context.technical)
             bonus_score += (1 - technical_diff / 100) * 8
             
             # Creative match bonus
-            creative_diff = abs(
-                gift['attributes']['creative'] - 
-                float(recipient_data.get('creative', 50))
-            )
+            creative_diff = abs(gift['attributes']['creative'] - context.creative)
             bonus_score += (1 - creative_diff / 100) * 8
             
             # Managerial match bonus
-            managerial_diff = abs(
-                gift['attributes']['managerial'] - 
-                float(recipient_data.get('managerial', 50))
-            )
+            managerial_diff = abs(gift['attributes']['managerial'] - context.managerial)
             bonus_score += (1 - managerial_diff / 100) * 7
             
             # Academic match bonus
-            academic_diff = abs(
-                gift['attributes']['academic'] - 
-                float(recipient_data.get('academic', 50))
-            )
+            academic_diff = abs(gift['attributes']['academic'] - context.academic)
             bonus_score += (1 - academic_diff / 100) * 7
             
             # Occasion match bonus
-            occasion = user_data.get('occasion', '')
-            if occasion and occasion in gift['attributes']['occasions']:
+            if context.occasion and context.occasion in gift['attributes']['occasions']:
                 bonus_score += 10
             
             # Style match bonus
-            style = recipient_data.get('style', '')
-            if style and style == gift['attributes']['style']:
+            if context.style and context.style == gift['attributes']['style']:
                 bonus_score += 8
             
             # Gender match bonus
-            gender = recipient_data.get('gender', '').lower()
             gift_gender = gift['attributes']['gender'].lower()
-            if gift_gender == 'neutral' or gift_gender == gender:
+            if gift_gender == 'neutral' or gift_gender == context.gender:
                 bonus_score += 5
             
             # Relationship score bonus
             relationship_match = abs(
-                gift['attributes']['relationship_score'] - 
-                float(user_data.get('relationship', 50))
+                gift['attributes']['relationship_score'] - context.relationship
             )
             bonus_score += (1 - relationship_match / 100) * 7
             
             # Age-based bonus (ADDED for greater age impact)
-            user_age = float(user_data.get('age', 50))
             # Young users (0-40) prefer modern, trendy, technical gifts
-            if user_age <= 40:
+            if context.age_band == 'young':
                 if gift['attributes']['style'] in ['Modern', 'Trendy']:
                     bonus_score += 8
                 if gift['attributes']['technical'] >= 70:
                     bonus_score += 6
             # Middle age users (30-70) prefer balanced gifts
-            elif 30 < user_age <= 70:
+            elif context.age_band == 'middle':
                 if gift['attributes']['style'] in ['Modern', 'Classic']:
                     bonus_score += 5
                 if gift['category'] in ['Home', 'Office', 'Experience']:
@@ -338,7 +1148,169 @@ class GiftRecommendationFuzzySystem:
             print(f"Error calculating score for gift {gift.get('name', 'unknown')}: {e}")
             return 0.0
     
-    def recommend_gifts(self, user_data: Dict, recipient_data: Dict, top_n: int = 10) -> List[Dict]:
+    def score_catalog(
+        self,
+        context: Optional[ScoringContext],
+        snapshot: Optional[CatalogSnapshot] = None
+    ) -> np.ndarray:
+        """
+        Score every gift in the catalog against a scoring context at once.
+        
+        Vectorized equivalent of calling score_gift for each gift; the bonus
+        terms are accumulated in the same order so results are identical.
+        
+        Args:
+            context: Context returned by build_scoring_context
+            snapshot: Catalog snapshot to score (default: the current one)
+        
+        Returns:
+            Array of scores in catalog order
+        """
+        snapshot = snapshot or self._snapshot
+        if context is None or context.base_score is None:
+            return np.zeros(len(snapshot.catalog), dtype=np.float64)
+        return self.score_profiles(ProfileBatch.from_contexts([context]), snapshot=snapshot)[0]
+    
+    @metrics.timed('bonus_scoring')
+    def score_profiles(
+        self,
+        batch: ProfileBatch,
+        rows: slice = slice(None),
+        gifts: Union[slice, np.ndarray] = slice(None),
+        snapshot: Optional[CatalogSnapshot] = None
+    ) -> np.ndarray:
+        """
+        Score every gift for a range of profiles as one matrix operation.
+        
+        Args:
+            batch: Profiles returned by build_profile_batch
+            rows: Slice of batch rows to score
+            gifts: Slice (or index array) of the catalog to score
+            snapshot: Catalog snapshot to score (default: the current one)
+        
+        Returns:
+            (profiles, gifts) array of scores; rows without a base score are 0
+        """
+        snapshot = snapshot or self._snapshot
+        catalog = snapshot.catalog
+        base_score = batch.base_score[rows]
+        count = len(base_score)
+        
+        # Budget compatibility bonus
+        budget_match = 100 - np.abs(catalog.price_range[gifts] - batch.budget[rows, np.newaxis])
+        bonus_score = (budget_match / 100) * 20
+        
+        # Trait match bonuses, columns in TRAIT_NAMES order
+        for column, weight in enumerate([10, 8, 8, 7, 7]):
+            diff = np.abs(catalog.traits[gifts, column] - batch.traits[rows, column, np.newaxis])
+            bonus_score += (1 - diff / 100) * weight
+        
+        # Occasion match bonus
+        occasion_bits = np.zeros((count, 1), dtype=np.uint64)
+        for i, occasion in enumerate(batch.occasion[rows]):
+            code = catalog.occasions.lookup(occasion) if occasion else -1
+            if code >= 0:
+                occasion_bits[i] = np.uint64(1 << code)
+        bonus_score += np.where((catalog.occasion_masks[gifts] & occasion_bits) != 0, 10.0, 0.0)
+        
+        # Style match bonus; -2 never matches (-1 marks invalid gifts)
+        style_codes = np.array([
+            catalog.styles.lookup(style) if style else -2 for style in batch.style[rows]
+        ], dtype=np.int32)
+        style_codes[style_codes < 0] = -2
+        bonus_score += np.where(catalog.style_codes[gifts] == style_codes[:, np.newaxis], 8.0, 0.0)
+        
+        # Gender match bonus
+        gender_codes = np.array([
+            catalog.genders.lookup(gender) for gender in ['neutral'] + batch.gender[rows]
+        ], dtype=np.int32)
+        gender_codes[gender_codes < 0] = -2
+        gender_match = (
+            (catalog.gender_codes[gifts] == gender_codes[0]) |
+            (catalog.gender_codes[gifts] == gender_codes[1:, np.newaxis])
+        )
+        bonus_score += np.where(gender_match, 5.0, 0.0)
+        
+        # Relationship score bonus
+        relationship_match = np.abs(
+            catalog.relationship_score[gifts] - batch.relationship[rows, np.newaxis]
+        )
+        bonus_score += (1 - relationship_match / 100) * 7
+        
+        # Age-based bonus
+        age_terms = catalog.age_band_matrix[:, :, gifts][batch.age_band[rows]]
+        for slot in range(age_terms.shape[1]):
+            bonus_score += age_terms[:, slot]
+        
+        gift_controllers = snapshot.gift_controllers
+        # A single column (e.g. of contexts without a base score) scores
+        # every gift with the default controller
+        if gift_controllers is None or batch.controller_scores.shape[1] == 1:
+            scores = np.minimum(100, base_score[:, np.newaxis] + bonus_score)
+        else:
+            # Base score of the controller of each gift's category
+            gift_base = batch.controller_scores[rows][:, gift_controllers[gifts]]
+            scores = np.minimum(100, gift_base + bonus_score)
+        scores[:, ~catalog.valid[gifts]] = 0.0
+        scores[np.isnan(base_score)] = 0.0
+        return scores
+    
+    def calculate_gift_score(self, gift: Dict, user_data: Dict, recipient_data: Dict) -> float:
+        """
+        Calculate fuzzy logic score for a specific gift.
+        
+        Convenience wrapper around build_scoring_context and score_gift; when
+        scoring many gifts for the same request, build the context once instead.
+        
+        Args:
+            gift: Gift item dictionary
+            user_data: User preferences (age, budget, relationship, occasion)
+            recipient_data: Recipient traits (personality, skills, style, gender)
+        
+        Returns:
+            Float score between 0 and 100
+        """
+        context = self.build_scoring_context(user_data, recipient_data)
+        return self.score_gift(gift, context)
+    
+    def rank_gifts(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        top_n: int = 10,
+        snapshot: Optional[CatalogSnapshot] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank the catalog for one request, without building gift dictionaries.
+        
+        Runs on a scoring worker process when a process pool is enabled;
+        if a worker process died, the workers are restarted and the request
+        is scored in-process.
+        
+        Args:
+            user_data: User preferences
+            recipient_data: Recipient traits
+            top_n: Number of top gifts to return
+            snapshot: Pinned catalog snapshot to rank (default: the current one)
+        
+        Returns:
+            Tuple of (catalog indices, scores) for the top N gifts, best first;
+            ties keep catalog order
+        """
+        with self.pin_snapshot(snapshot) as snapshot:
+            if snapshot.process_pool is not None:
+                try:
+                    return snapshot.process_pool.rank_gifts(user_data, recipient_data, top_n)
+                except BrokenProcessPool:
+                    self._restart_workers(snapshot.process_pool)
+            
+            return self.score_request(user_data, recipient_data, snapshot).top(top_n)
+    
+    def _materialize(self, indices: np.ndarray, scores: np.ndarray, snapshot: CatalogSnapshot) -> 'RankedGifts':
+        """Return the ranked gifts as views into the snapshot's catalog with their fuzzy_score."""
+        return RankedGifts(snapshot.gifts, indices, scores, snapshot.fragments)
+    
+    def recommend_gifts(self, user_data: Dict, recipient_data: Dict, top_n: int = 10) -> RankedGifts:
         """
         Recommend top N gifts based on fuzzy logic scoring.
         
@@ -348,82 +1320,291 @@ class GiftRecommendationFuzzySystem:
             top_n: Number of top gifts to return
         
         Returns:
-            List of gift dictionaries with scores
+            RankedGifts: read-only gifts with their fuzzy_score, best first
+        """
+        with self.pin_snapshot() as snapshot:
+            return self._materialize(
+                *self.rank_gifts(user_data, recipient_data, top_n, snapshot), snapshot
+            )
+    
+    def recommend_batch(
+        self,
+        users: List[Dict],
+        recipients: List[Dict],
+        top_n: int = 10,
+        chunk_size: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
         """
-        scored_gifts = []
+        Recommend top N gifts for many (user, recipient) profiles.
         
-        for gift in self.gifts:
-            score = self.calculate_gift_score(gift, user_data, recipient_data)
-            gift_with_score = gift.copy()
-            gift_with_score['fuzzy_score'] = score
-            scored_gifts.append(gift_with_score)
+        Fuzzy inference runs once for all profiles; bonus scoring runs as a
+        profiles x gifts matrix operation over chunks of profiles, so the full
+        score matrix is never materialized. Results are identical to calling
+        recommend_gifts for each profile.
         
-        # Sort by score descending
-        scored_gifts.sort(key=lambda x: x['fuzzy_score'], reverse=True)
+        Args:
+            users: User data per profile
+            recipients: Recipient data per profile, same length as users
+            top_n: Number of top gifts per profile
+            chunk_size: Profiles scored per chunk (default: BATCH_CHUNK_CELLS
+                scores per chunk)
         
-        return scored_gifts[:top_n]
+        Yields:
+            Dict with the profile 'index', top 'gift_ids' and their 'scores'
+        """
+        # The whole stream is ranked against one catalog, even across reloads
+        with self.pin_snapshot() as snapshot:
+            batch = self.build_profile_batch(users, recipients, snapshot)
+            gifts = snapshot.gifts
+            if chunk_size is None:
+                chunk_size = max(1, BATCH_CHUNK_CELLS // max(1, len(snapshot.catalog)))
+            
+            for start in range(0, len(batch), chunk_size):
+                scores = self.score_profiles(batch, slice(start, start + chunk_size), snapshot=snapshot)
+                # Equal scores keep catalog order, like recommend_gifts
+                order = top_k_rows(scores, top_n)
+                top_scores = np.take_along_axis(scores, order, axis=1)
+                for offset, (indices, row_scores) in enumerate(zip(order.tolist(), top_scores.tolist())):
+                    yield {
+                        'index': start + offset,
+                        'gift_ids': [gifts[i]['id'] for i in indices],
+                        'scores': row_scores,
+                    }
     
-    def get_diverse_pairs(self, user_data: Dict, recipient_data: Dict, num_pairs: int = 5) -> List[List[Dict]]:
+    def get_diverse_pairs(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        num_pairs: int = 5,
+        seed: Optional[int] = None
+    ) -> List[RankedGifts]:
         """
         Generate diverse gift pairs for user comparison.
         
         This method creates pairs of gifts that:
         - Are reasonably matched to the user/recipient
-        - Represent different categories/types
+        - Differ in the configured dimensions (see pairs.py)
         - Provide meaningful choices
         
         Args:
             user_data: User preferences
             recipient_data: Recipient traits
             num_pairs: Number of pairs to generate
+            seed: Seed for shuffling the pairs (default: FUZZY_PAIR_SEED)
         
         Returns:
-            List of pairs, where each pair is [gift1, gift2]
+            List of pairs, where each pair is RankedGifts [gift1, gift2]
+        """
+        with self.pin_snapshot() as snapshot:
+            candidates = self.pair_selector.candidates(num_pairs)
+            indices, scores = self.rank_gifts(user_data, recipient_data, candidates, snapshot)
+            return self._pair_up(indices, scores, num_pairs, seed, snapshot)
+    
+    def start_session(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        num_pairs: int = 5,
+        seed: Optional[int] = None
+    ) -> Tuple[List[RankedGifts], Optional[str]]:
         """
-        # Get top candidates
-        top_gifts = self.recommend_gifts(user_data, recipient_data, top_n=30)
+        Generate diverse gift pairs and keep the scores for the final refinement.
         
-        pairs = []
-        used_indices = set()
+        Pass the returned session ID to refine_recommendations so it only
+        re-ranks the kept scores instead of scoring the catalog again.
         
-        # Try to create diverse pairs
-        for i in range(num_pairs):
-            if len(top_gifts) < 2:
-                break
-            
-            # Find two gifts from different categories
-            gift1_idx = None
-            gift2_idx = None
-            
-            for idx in range(len(top_gifts)):
-                if idx not in used_indices:
-                    if gift1_idx is None:
-                        gift1_idx = idx
-                    elif top_gifts[idx]['category'] != top_gifts[gift1_idx]['category']:
-                        gift2_idx = idx
-                        break
+        Args:
+            user_data: User preferences
+            recipient_data: Recipient traits
+            num_pairs: Number of pairs to generate
+            seed: Seed for shuffling the pairs (default: FUZZY_PAIR_SEED)
+        
+        Returns:
+            Tuple of (pairs as returned by get_diverse_pairs, session ID);
+            the ID is None when sessions are disabled or scoring runs on
+            worker processes, whose scores the server does not hold
+        """
+        with self.pin_snapshot() as snapshot:
+            context = self._prepare_context(user_data, recipient_data, quantum=self.cache.quantum)
+            if snapshot.process_pool is not None or not self.sessions.enabled or context is None:
+                return self.get_diverse_pairs(user_data, recipient_data, num_pairs, seed), None
             
-            # If we couldn't find different categories, just pick next available
-            if gift2_idx is None:
-                for idx in range(len(top_gifts)):
-                    if idx not in used_indices and idx != gift1_idx:
-                        gift2_idx = idx
-                        break
+            ranked = self.score_request(user_data, recipient_data, snapshot)
+            indices, scores = ranked.top(self.pair_selector.candidates(num_pairs))
+            pairs = self._pair_up(indices, scores, num_pairs, seed, snapshot)
+            session_id = secrets.token_urlsafe(16)
+            self.sessions.put(session_id, ScoringSession(
+                snapshot.version, context.profile_key(), ranked, rounds=len(pairs)
+            ))
+            return pairs, session_id
+    
+    def _session_scores(
+        self,
+        session_id: str,
+        user_data: Dict,
+        recipient_data: Dict,
+        snapshot: CatalogSnapshot,
+        selections: Optional[int] = None
+    ):
+        """
+        Return the kept scores of a session, or None if they cannot be used.
+        
+        Sessions that expired, belong to another profile or were scored
+        against a previous catalog are ignored.
+        
+        Raises:
+            ValueError: If the number of selections differs from the number
+                of pairs the session showed
+        """
+        session = self.sessions.get(session_id)
+        if session is None or session.version != snapshot.version:
+            return None
+        if selections is not None and session.rounds is not None and selections != session.rounds:
+            raise ValueError(f"Expected {session.rounds} selections for this session, got {selections}")
+        context = self._prepare_context(user_data, recipient_data, quantum=self.cache.quantum)
+        if context is None or context.profile_key() != session.profile_key:
+            return None
+        return session.ranked
+    
+    @metrics.timed('pair_selection')
+    def _pair_up(
+        self,
+        indices: np.ndarray,
+        scores: np.ndarray,
+        num_pairs: int,
+        seed: Optional[int],
+        snapshot: CatalogSnapshot
+    ) -> List[RankedGifts]:
+        """Pair up ranked gifts with the pair selector, as views into the catalog."""
+        pairs = self.pair_selector.select(snapshot.catalog, indices, num_pairs, seed)
+        return [
+            self._materialize(indices[list(pair)], scores[list(pair)], snapshot)
+            for pair in pairs
+        ]
+    
+    def rank_refined(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        selected_indices: List[int],
+        top_n: int = 3,
+        snapshot: Optional[CatalogSnapshot] = None,
+        weights: Optional[List[float]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank the catalog with a bonus for similarity to the selected gifts.
+        
+        Runs on a scoring worker process when a process pool is enabled;
+        if a worker process died, the workers are restarted and the request
+        is scored in-process.
+        
+        Args:
+            user_data: User preferences
+            recipient_data: Recipient traits
+            selected_indices: Catalog indices of the gifts the user selected
+            top_n: Number of final recommendations
+            snapshot: Pinned catalog snapshot to rank (default: the current one)
+            weights: Weight of each selected gift, e.g. higher for later
+                selection rounds (default: all equal)
+        
+        Returns:
+            Tuple of (catalog indices, refined scores) for the top N gifts
+        """
+        with self.pin_snapshot(snapshot) as snapshot:
+            if snapshot.process_pool is not None:
+                try:
+                    return snapshot.process_pool.rank_refined(
+                        user_data, recipient_data, selected_indices, top_n, weights
+                    )
+                except BrokenProcessPool:
+                    self._restart_workers(snapshot.process_pool)
+            return self._rank_refined(
+                user_data, recipient_data, selected_indices, top_n, snapshot, weights=weights
+            )
+    
+    @metrics.timed('re_ranking')
+    def _rank_refined(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        selected_indices: List[int],
+        top_n: int,
+        snapshot: CatalogSnapshot,
+        ranked=None,
+        weights: Optional[List[float]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        In-process rank_refined against a pinned snapshot.
+        
+        Args:
+            ranked: Scores of the profile, e.g. kept by a session (default:
+                scored through the result cache)
+            weights: Weight of each selected gift (default: all equal)
+        """
+        if ranked is None:
+            ranked = self.score_request(user_data, recipient_data, snapshot)
+        
+        if len(selected_indices) == 0:
+            # If no valid selections, return top gifts
+            return ranked.top(top_n)
+        
+        # Weighted average attributes of the selected gifts
+        catalog = snapshot.catalog
+        selected = np.asarray(selected_indices, dtype=np.intp)
+        if weights is None:
+            weights = np.full(len(selected), 1.0 / len(selected))
+        else:
+            weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        traits = weights @ catalog.traits[selected]
+        price = weights @ catalog.price_range[selected]
+        
+        preference_bonus = self._preference_bonus(catalog, traits, price)
+        
+        if isinstance(ranked, PrunedRanking):
+            def score_gifts(gifts):
+                scores = ranked.score_block(gifts)
+                return scores + preference_bonus[gifts], scores
             
-            if gift1_idx is not None and gift2_idx is not None:
-                pairs.append([top_gifts[gift1_idx], top_gifts[gift2_idx]])
-                used_indices.add(gift1_idx)
-                used_indices.add(gift2_idx)
+            bounds = ranked.prefilter.gift_bounds(ranked.bounds) + preference_bonus
+            order, (refined, _) = ranked.prefilter.select(bounds, top_n, score_gifts)
+            return order, refined
         
-        return pairs
+        scores = ranked.scores
+        refined = scores + preference_bonus
+        
+        # Ties fall back to the base ranking, then to catalog order
+        order = top_k(refined, top_n, scores)
+        return order, refined[order]
+    
+    def _preference_bonus(self, catalog: GiftCatalog, traits: np.ndarray, price: float) -> np.ndarray:
+        """
+        Bonus for similarity to the average attributes of the selected gifts.
+        
+        Args:
+            catalog: Catalog to compute the bonus for
+            traits: Weighted average trait attributes, in TRAIT_NAMES order
+            price: Weighted average price_range
+        
+        Returns:
+            Array of bonuses in catalog order
+        """
+        # 3 points per attribute, minus 3 per 100 of distance to the average
+        distance = np.abs(catalog.traits - traits).sum(axis=1)
+        
+        # Price range bonus (at top level, not in attributes)
+        distance += np.abs(catalog.price_range - price)
+        
+        return 3.0 * (catalog.traits.shape[1] + 1) - distance * 0.03
     
     def refine_recommendations(
         self, 
         user_data: Dict, 
         recipient_data: Dict, 
         selected_gifts: List[str],
-        top_n: int = 3
-    ) -> List[Dict]:
+        top_n: int = 3,
+        session_id: Optional[str] = None,
+        selection_weights: Optional[List[float]] = None
+    ) -> RankedGifts:
         """
         Refine recommendations based on user's previous selections.
         
@@ -432,50 +1613,130 @@ class GiftRecommendationFuzzySystem:
             recipient_data: Recipient traits
             selected_gifts: List of gift IDs that user selected in pairs
             top_n: Number of final recommendations
+            session_id: ID returned by start_session; its kept scores are
+                re-ranked instead of scoring the catalog again, if still valid
+            selection_weights: Weight of each entry of selected_gifts; a gift
+                selected in several rounds gets the sum of its weights
+                (default: every selected gift counts once)
         
         Returns:
-            List of top recommended gifts
+            RankedGifts of the top recommended gifts
+        
+        Raises:
+            ValueError: If selection_weights don't match selected_gifts or
+                are negative, or selected_gifts don't answer every pair of
+                the session
+        """
+        with self.pin_snapshot() as snapshot:
+            weights = None
+            if selection_weights is None:
+                selected_indices = snapshot.catalog.indices_of(selected_gifts)
+            else:
+                selected_indices, weights = snapshot.catalog.weighted_indices(
+                    selected_gifts, selection_weights
+                )
+            
+            ranked = None
+            if session_id and snapshot.process_pool is None:
+                ranked = self._session_scores(
+                    session_id, user_data, recipient_data, snapshot, selections=len(selected_gifts)
+                )
+            if ranked is not None:
+                order, scores = self._rank_refined(
+                    user_data, recipient_data, selected_indices, top_n, snapshot, ranked, weights
+                )
+            else:
+                order, scores = self.rank_refined(
+                    user_data, recipient_data, selected_indices, top_n, snapshot, weights
+                )
+            return self._materialize(order, scores, snapshot)
+    
+    def enable_process_pool(self, max_workers: int):
+        """
+        Score requests on a pool of worker processes instead of in-process.
+        
+        Args:
+            max_workers: Number of worker processes
         """
-        # Get all scored gifts
-        all_gifts = self.recommend_gifts(user_data, recipient_data, top_n=len(self.gifts))
+        from workers import WorkerPool
         
-        # Analyze selected gifts to understand preferences
-        selected_gift_objects = [g for g in all_gifts if g['id'] in selected_gifts]
+        with self._reload_lock:
+            snapshot = self._snapshot
+            if snapshot.process_pool is None:
+                # Reloads bind their catalogs to the same workers, which stop
+                # when the last snapshot using them is released
+                ranker = WorkerPool(max_workers).bind(snapshot.catalog, self.rules_path)
+                self._publish(snapshot.replace(process_pool=ranker))
+    
+    def _bind_workers(self, ranker, catalog: GiftCatalog):
+        """
+        Bind a catalog to the worker processes of a ranker; callers hold the
+        reload lock.
         
-        if not selected_gift_objects:
-            # If no valid selections, return top gifts
-            return all_gifts[:top_n]
-        
-        # Calculate average attributes of selected gifts
-        avg_attributes = {
-            'personality': np.mean([g['attributes']['personality'] for g in selected_gift_objects]),
-            'technical': np.mean([g['attributes']['technical'] for g in selected_gift_objects]),
-            'creative': np.mean([g['attributes']['creative'] for g in selected_gift_objects]),
-            'managerial': np.mean([g['attributes']['managerial'] for g in selected_gift_objects]),
-            'academic': np.mean([g['attributes']['academic'] for g in selected_gift_objects]),
-            'price_range': np.mean([g['price_range'] for g in selected_gift_objects])
-        }
+        Workers are restarted when one of them died.
+        """
+        from workers import WorkerPool
         
-        # Re-score gifts with preference bonus
-        for gift in all_gifts:
-            preference_bonus = 0
-            
-            # Bonus for similarity to selected gifts
-            for attr in ['personality', 'technical', 'creative', 'managerial', 'academic']:
-                diff = abs(gift['attributes'][attr] - avg_attributes[attr])
-                preference_bonus += (1 - diff / 100) * 3
-            
-            # Price range bonus (at top level, not in attributes)
-            price_diff = abs(gift['price_range'] - avg_attributes['price_range'])
-            preference_bonus += (1 - price_diff / 100) * 3
-            
-            gift['fuzzy_score'] += preference_bonus
+        try:
+            return ranker.pool.bind(catalog, self.rules_path)
+        except BrokenProcessPool:
+            logger.warning("A scoring worker process died, restarting the worker processes")
+            return WorkerPool(ranker.max_workers).bind(catalog, self.rules_path)
+    
+    def _restart_workers(self, broken):
+        """
+        Replace the worker processes of a ranker after one of them died.
+        
+        The current snapshot is bound to new workers, or scored in-process
+        when they cannot be started. Snapshots still ranking on the broken
+        workers stop them once released.
         
-        # Re-sort and return top N
-        all_gifts.sort(key=lambda x: x['fuzzy_score'], reverse=True)
+        Args:
+            broken: Ranker whose executor raised BrokenProcessPool
+        """
+        from workers import WorkerPool
         
-        return all_gifts[:top_n]
+        with self._reload_lock:
+            current = self._snapshot
+            if current.process_pool is None or current.process_pool.pool is not broken.pool:
+                # Restarted (or disabled) by another request already
+                return
+            logger.warning("A scoring worker process died, restarting the worker processes")
+            try:
+                ranker = WorkerPool(broken.max_workers).bind(current.catalog, self.rules_path)
+            except Exception:
+                logger.exception("Could not restart the scoring worker processes, scoring in-process")
+                ranker = None
+            self._publish(current.replace(process_pool=ranker))
+    
+    def disable_process_pool(self):
+        """
+        Score in-process again; the worker processes stop once requests
+        still using them are done.
+        """
+        with self._reload_lock:
+            snapshot = self._snapshot
+            if snapshot.process_pool is not None:
+                self._publish(snapshot.replace(process_pool=None))
+
+
+# Singleton instance, created on first use
+_fuzzy_system: Optional[GiftRecommendationFuzzySystem] = None
+_fuzzy_system_lock = threading.Lock()
+
+
+def get_fuzzy_system() -> GiftRecommendationFuzzySystem:
+    """Return the shared GiftRecommendationFuzzySystem, creating it on first call."""
+    global _fuzzy_system
+    with _fuzzy_system_lock:
+        if _fuzzy_system is None:
+            _fuzzy_system = GiftRecommendationFuzzySystem()
+    return _fuzzy_system
 
 
-# Create singleton instance
-fuzzy_system = GiftRecommendationFuzzySystem()
+def __getattr__(name: str):
+    # `from fuzzy_logic import fuzzy_system` creates the singleton lazily,
+    # so importing this module (e.g. in a worker process) stays cheap
+    if name == 'fuzzy_system':
+        return get_fuzzy_system()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
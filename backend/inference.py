@@ -0,0 +1,450 @@
+"""
+Compiled Fuzzy Inference Engine
+===============================
+A NumPy implementation of Mamdani inference for the gift recommendation
+controller. Membership functions are precomputed as tables over each
+variable's universe, rules are compiled into antecedent index arrays, and
+centroid defuzzification is evaluated directly on the output universe, so
+a request no longer walks scikit-fuzzy's ControlSystem graph.
+
+The results match skfuzzy's ControlSystemSimulation (min for AND, max for
+accumulation, centroid over the universe upsampled at the cut levels).
+
+An engine can hold several controllers over the same variables, e.g. one
+per gift category: the default controller plus named ones. They are
+evaluated in one fused pass: input memberships are computed once, every
+rule of every controller fires in the same array operation, and all
+outputs are defuzzified together.
+"""
+
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+# A rule: list of (variable, term) antecedents AND-ed together, the output
+# term it activates and the weight applied to its firing strength.
+CompiledRule = Tuple[List[Tuple[str, str]], str, float]
+
+# Name of the controller made of an engine's main rules
+DEFAULT_CONTROLLER = 'default'
+
+
+class CompiledFuzzyEngine:
+    """
+    Stateless, vectorized Mamdani inference engine.
+
+    The engine holds no per-evaluation state, so a single instance can be
+    shared by any number of threads.
+    """
+
+    def __init__(
+        self,
+        inputs: Dict[str, Tuple[np.ndarray, Dict[str, np.ndarray]]],
+        output: Tuple[str, np.ndarray, Dict[str, np.ndarray]],
+        rules: List[CompiledRule],
+        controllers: Optional[Dict[str, List[CompiledRule]]] = None
+    ):
+        """
+        Compile membership tables and rules.
+
+        Args:
+            inputs: Input variable name -> (universe, {term: membership table})
+            output: (name, universe, {term: membership table}) of the output
+            rules: Rules as (antecedents, output term, weight), forming the
+                default controller
+            controllers: Further controllers over the same variables, by
+                name, evaluated together with the default one
+        """
+        controllers = controllers or {}
+        if not rules or not all(controllers.values()):
+            raise ValueError("At least one rule per controller is required")
+        if DEFAULT_CONTROLLER in controllers:
+            raise ValueError(f"Controller name {DEFAULT_CONTROLLER!r} is reserved")
+
+        # Kept so the engine can be saved and rebuilt without skfuzzy
+        self.definition = (inputs, output, rules, controllers)
+        self.input_names = list(inputs)
+        self.output_name = output[0]
+        self.controller_names = [DEFAULT_CONTROLLER] + list(controllers)
+        self.term_index = {}
+        self._compile_inputs(inputs)
+        self._compile_rules([rules] + list(controllers.values()))
+        self._compile_output(output)
+
+    def _compile_inputs(self, inputs: Dict[str, Tuple[np.ndarray, Dict[str, np.ndarray]]]):
+        """Flatten the input membership tables to one row per (variable, term)."""
+        # Variables sharing a universe are fuzzified together in one pass
+        groups = {}
+        term_count = 0
+        for column, (name, (universe, terms)) in enumerate(inputs.items()):
+            universe = np.asarray(universe, dtype=np.float64)
+            group = groups.setdefault(universe.tobytes(), (universe, [], [], [], []))
+            _, variables, term_columns, term_variables, tables = group
+            variables.append(column)
+            for term, table in terms.items():
+                self.term_index[(name, term)] = term_count
+                term_columns.append(term_count)
+                term_variables.append(len(variables) - 1)
+                tables.append(np.asarray(table, dtype=np.float64))
+                term_count += 1
+        self.term_count = term_count
+
+        # Per-term value and slope at each universe point, so memberships are
+        # interpolated by one gather instead of one np.interp call per term
+        self.input_groups = []
+        for universe, variables, term_columns, term_variables, tables in groups.values():
+            values = np.array(tables)
+            slopes = np.zeros_like(values)
+            slopes[:, :-1] = np.diff(values, axis=1)
+            self.input_groups.append((
+                universe,
+                np.arange(len(universe), dtype=np.float64),
+                np.array(variables, dtype=np.intp),
+                np.array(term_columns, dtype=np.intp),
+                np.array(term_variables, dtype=np.intp),
+                values,
+                slopes
+            ))
+
+    def _compile_rules(self, controllers: List[List[CompiledRule]]):
+        """Compile rule antecedents into index arrays grouped by controller and consequent."""
+        # Output terms any controller activates, shared by all controllers
+        self.output_terms = []
+        for rules in controllers:
+            for _, consequent, _ in rules:
+                if consequent not in self.output_terms:
+                    self.output_terms.append(consequent)
+
+        # Rules are ordered by controller, then output term, so each term's
+        # activation is one segment of the rule strengths, reduced with
+        # np.maximum.reduceat. A term a controller never activates gets a
+        # zero-weight rule, so no segment is empty.
+        ordered, segments = [], []
+        for rules in controllers:
+            for term in self.output_terms:
+                segments.append(len(ordered))
+                term_rules = [rule for rule in rules if rule[1] == term]
+                ordered.extend(term_rules or [(rules[0][0], term, 0.0)])
+        rules = ordered
+        self.rule_segments = np.array(segments, dtype=np.intp)
+        # Rules of the default controller, which come first
+        self.default_rules = segments[len(self.output_terms)] if len(controllers) > 1 else len(rules)
+
+        # Rule antecedents padded to the same arity by repeating the first
+        # term (min is idempotent), so all rules fire in one array operation
+        arity = max(len(antecedents) for antecedents, _, _ in rules)
+        self.rule_antecedents = np.array([
+            [self.term_index[term] for term in antecedents] +
+            [self.term_index[antecedents[0]]] * (arity - len(antecedents))
+            for antecedents, _, _ in rules
+        ], dtype=np.intp)
+        self.rule_weights = np.array([weight for _, _, weight in rules], dtype=np.float64)
+
+        # Controllers share most of their antecedents (e.g. the same rule
+        # group), so each distinct combination of terms is only fired once
+        antecedent_sets, rule_sets = np.unique(
+            np.sort(self.rule_antecedents, axis=1), axis=0, return_inverse=True
+        )
+        self.antecedent_sets = antecedent_sets
+        self.rule_antecedent_sets = rule_sets.reshape(-1)
+
+    def _compile_output(self, output: Tuple[str, np.ndarray, Dict[str, np.ndarray]]):
+        """Precompute output term tables and their cut-level crossing tables."""
+        _, universe, terms = output
+        self.output_universe = np.asarray(universe, dtype=np.float64)
+        self.output_tables = np.array(
+            [terms[term] for term in self.output_terms], dtype=np.float64
+        )
+        self.output_slopes = np.zeros_like(self.output_tables)
+        self.output_slopes[:, :-1] = np.diff(self.output_tables, axis=1)
+        self._output_positions = np.arange(len(self.output_universe), dtype=np.float64)
+
+        # The rising and falling side of every term, as increasing membership
+        # -> universe tables. Side s is shifted by 2 * s on the membership
+        # axis so all crossings are found with a single np.interp call.
+        # Cut levels are clamped to each side's own range, so a level the
+        # side never reaches maps onto one of its existing universe points.
+        levels, positions, lows, peaks, offsets, side_terms = [], [], [], [], [], []
+        for k, table in enumerate(self.output_tables):
+            for side_mf, side_x in self._monotone_sides(table):
+                offset = 2.0 * len(offsets)
+                levels.append(side_mf + offset)
+                positions.append(side_x)
+                lows.append(side_mf[0])
+                peaks.append(side_mf[-1])
+                offsets.append(offset)
+                side_terms.append(k)
+        self._side_levels = np.concatenate(levels)
+        self._side_positions = np.concatenate(positions)
+        self._side_lows = np.array(lows)
+        self._side_peaks = np.array(peaks)
+        self._side_offsets = np.array(offsets)
+        self._side_terms = np.array(side_terms, dtype=np.intp)
+
+    @classmethod
+    def from_control_system(cls, control_system) -> 'CompiledFuzzyEngine':
+        """
+        Compile an skfuzzy ControlSystem with a single consequent.
+
+        Only rules whose antecedents are AND-combinations of terms are supported.
+        """
+        from skfuzzy.control.term import Term, TermAggregate
+
+        def flatten(antecedent):
+            if isinstance(antecedent, Term):
+                return [(antecedent.parent.label, antecedent.label)]
+            if isinstance(antecedent, TermAggregate) and antecedent.kind == 'and':
+                return flatten(antecedent.term1) + flatten(antecedent.term2)
+            raise ValueError(f"Unsupported rule antecedent: {antecedent}")
+
+        consequents = list(control_system.consequents)
+        if len(consequents) != 1:
+            raise ValueError("Exactly one consequent is supported")
+        consequent = consequents[0]
+
+        rules = []
+        for rule in control_system.rules:
+            for weighted in rule.consequent:
+                rules.append((flatten(rule.antecedent), weighted.term.label, float(weighted.weight)))
+
+        inputs = {
+            antecedent.label: (
+                antecedent.universe,
+                {label: term.mf for label, term in antecedent.terms.items()}
+            )
+            for antecedent in control_system.antecedents
+        }
+        output = (
+            consequent.label,
+            consequent.universe,
+            {label: term.mf for label, term in consequent.terms.items()}
+        )
+        return cls(inputs, output, rules)
+
+    def _monotone_sides(self, table: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Split a unimodal membership table into its rising and falling sides.
+
+        Returns (membership, universe) pairs with increasing membership, used
+        to find where the function crosses a cut level.
+        """
+        peak = np.flatnonzero(table == table.max())
+        first_peak, last_peak = peak[0], peak[-1]
+        rise_start = np.flatnonzero(table[:first_peak + 1] == 0)
+        rise_start = rise_start[-1] if len(rise_start) else 0
+        fall_end = np.flatnonzero(table[last_peak:] == 0)
+        fall_end = last_peak + fall_end[0] if len(fall_end) else len(table) - 1
+
+        rise = slice(rise_start, first_peak + 1)
+        fall = slice(fall_end, last_peak - 1 if last_peak > 0 else None, -1)
+        if np.any(np.diff(table[rise]) < 0) or np.any(np.diff(table[fall]) < 0):
+            raise ValueError("Output membership functions must be unimodal")
+        return [
+            (table[rise], self.output_universe[rise]),
+            (table[fall], self.output_universe[fall]),
+        ]
+
+    def input_matrix(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Stack named input arrays into a (rows, variables) matrix."""
+        return np.column_stack([
+            np.asarray(inputs[name], dtype=np.float64) for name in self.input_names
+        ])
+
+    def _memberships(self, values: np.ndarray) -> np.ndarray:
+        """(rows, input terms) membership of the inputs in every input term."""
+        memberships = np.empty((values.shape[0], self.term_count), dtype=np.float64)
+
+        for universe, positions, variables, columns, term_variables, term_values, term_slopes in self.input_groups:
+            # Fractional position on the universe; out-of-range inputs are
+            # clipped to the universe bounds, like skfuzzy
+            position = np.interp(values[:, variables], universe, positions)
+            index = np.minimum(position.astype(np.intp), len(universe) - 2)
+            fraction = position - index
+            term_rows = np.arange(len(columns))
+            index = index[:, term_variables]
+            memberships[:, columns] = (
+                term_values[term_rows, index] +
+                term_slopes[term_rows, index] * fraction[:, term_variables]
+            )
+        return memberships
+
+    def activations(self, values: np.ndarray) -> np.ndarray:
+        """
+        Compute the activation of every output term by the default controller.
+
+        Args:
+            values: (rows, variables) crisp inputs, columns in input_names order
+
+        Returns:
+            (rows, output terms) array of activation levels
+        """
+        rules = slice(0, self.default_rules)
+        strengths = self._memberships(values)[:, self.rule_antecedents[rules]].min(axis=2)
+        strengths *= self.rule_weights[rules]
+        return np.maximum.reduceat(strengths, self.rule_segments[:len(self.output_terms)], axis=1)
+
+    def controller_activations(self, values: np.ndarray) -> np.ndarray:
+        """
+        Compute the activation of every output term by every controller at once.
+
+        Args:
+            values: (rows, variables) crisp inputs, columns in input_names order
+
+        Returns:
+            (rows, controllers, output terms) array of activation levels,
+            controllers in controller_names order
+        """
+        fired = self._memberships(values)[:, self.antecedent_sets].min(axis=2)
+        strengths = fired[:, self.rule_antecedent_sets] * self.rule_weights
+        activations = np.maximum.reduceat(strengths, self.rule_segments, axis=1)
+        return activations.reshape(len(values), len(self.controller_names), len(self.output_terms))
+
+    def defuzzify(self, activations: np.ndarray) -> np.ndarray:
+        """
+        Centroid defuzzification of the clipped, max-accumulated output terms.
+
+        Args:
+            activations: (..., output terms) activation levels, e.g. one
+                row per input row or per input row and controller
+
+        Returns:
+            Crisp output per row; NaN where no output term is active
+        """
+        shape = activations.shape[:-1]
+        activations = activations.reshape(-1, activations.shape[-1])
+        area, moment = self.area_moment(activations)
+        crisp = moment / np.fmax(area, np.finfo(float).eps)
+        crisp[(activations <= 0).all(axis=1)] = np.nan
+        return crisp.reshape(shape)
+
+    def area_moment(self, activations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Area and first moment of the clipped, max-accumulated output terms.
+
+        The centroid is moment / area. Both are continuous in the
+        activations and vanish when no term is active, unlike the centroid.
+
+        Args:
+            activations: (rows, output terms) activation levels
+
+        Returns:
+            Tuple of (area, moment) per row
+        """
+        universe = self.output_universe
+        rows = activations.shape[0]
+        cuts = activations.T[:, :, np.newaxis]
+
+        # Upsample the universe with the points where each term crosses its
+        # cut level, as skfuzzy does, so the centroid is computed exactly
+        crossings = np.interp(
+            np.clip(activations[:, self._side_terms], self._side_lows, self._side_peaks) +
+            self._side_offsets,
+            self._side_levels,
+            self._side_positions
+        )
+        position = np.interp(crossings, universe, self._output_positions)
+        index = np.minimum(position.astype(np.intp), len(universe) - 2)
+        crossing_mf = np.minimum(
+            cuts,
+            self.output_tables[:, index] + self.output_slopes[:, index] * (position - index)
+        ).max(axis=0)
+        universe_mf = np.minimum(cuts, self.output_tables[:, np.newaxis, :]).max(axis=0)
+
+        points = np.empty((rows, len(universe) + crossings.shape[1]), dtype=np.float64)
+        points[:, :len(universe)] = universe
+        points[:, len(universe):] = crossings
+        output_mf = np.concatenate([universe_mf, crossing_mf], axis=1)
+        order = np.argsort(points, axis=1, kind='stable')
+        row_index = np.arange(rows)[:, np.newaxis]
+        points = points[row_index, order]
+        output_mf = output_mf[row_index, order]
+
+        # Exact area and first moment of each trapezoid between points
+        width = np.diff(points, axis=1)
+        y1, y2 = output_mf[:, :-1], output_mf[:, 1:]
+        heights = y1 + y2
+        sum_area = 0.5 * (width * heights).sum(axis=1)
+        sum_moment = (width * (0.5 * points[:, :-1] * heights +
+                               width * (y1 + 2.0 * y2) / 6.0)).sum(axis=1)
+
+        return sum_area, sum_moment
+
+    def compute_batch(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate the default controller for many input rows at once.
+
+        Args:
+            inputs: Variable name -> 1D array of crisp values
+
+        Returns:
+            Crisp output per row; NaN where no rule fired
+        """
+        return self.defuzzify(self.activations(self.input_matrix(inputs)))
+
+    def compute_controllers_batch(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate every controller for many input rows in one pass.
+
+        A controller none of whose rules fire gives the default
+        controller's output.
+
+        Args:
+            inputs: Variable name -> 1D array of crisp values
+
+        Returns:
+            (rows, controllers) crisp outputs, controllers in
+            controller_names order; NaN rows where the default controller
+            did not fire
+        """
+        return fill_controllers(self.defuzzify(self.controller_activations(self.input_matrix(inputs))))
+
+    def compute_controllers(self, inputs: Dict[str, float]) -> np.ndarray:
+        """
+        Evaluate every controller for a single set of crisp inputs.
+
+        Returns:
+            Crisp output per controller, see compute_controllers_batch
+
+        Raises:
+            ValueError: If no rule of the default controller fires
+        """
+        values = np.array([[inputs[name] for name in self.input_names]], dtype=np.float64)
+        outputs = fill_controllers(self.defuzzify(self.controller_activations(values)))[0]
+        if np.isnan(outputs[0]):
+            raise ValueError("Crisp output cannot be calculated: no rule fired "
+                             "for these input values")
+        return outputs
+
+    def compute(self, inputs: Dict[str, float]) -> float:
+        """
+        Evaluate the default controller for a single set of crisp inputs.
+
+        Raises:
+            ValueError: If no rule fires, so no output can be calculated
+        """
+        values = np.array([[inputs[name] for name in self.input_names]], dtype=np.float64)
+        output = self.defuzzify(self.activations(values))[0]
+        if np.isnan(output):
+            raise ValueError("Crisp output cannot be calculated: no rule fired "
+                             "for these input values")
+        return float(output)
+
+
+def fill_controllers(outputs: np.ndarray) -> np.ndarray:
+    """
+    Replace the outputs of controllers that did not fire with the default one.
+
+    Rows where the default controller did not fire become all NaN, like a
+    single controller's output.
+
+    Args:
+        outputs: (rows, controllers) crisp outputs, the default controller first
+
+    Returns:
+        The same array, filled in place
+    """
+    outputs[np.isnan(outputs[:, 0])] = np.nan
+    missing = np.isnan(outputs)
+    if missing.any():
+        outputs[missing] = np.broadcast_to(outputs[:, :1], outputs.shape)[missing]
+    return outputs
@@ -4,31 +4,145 @@ Gift Recommendation API using Fuzzy Logic
 FastAPI backend for personalized gift recommendations.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from models import (
     GenerateImagePairsRequest,
     GenerateImagePairsResponse,
     GenerateFinalImagesRequest,
     GenerateFinalImagesResponse,
-    ImageInfo,
-    FinalImageInfo
+    BatchRecommendationRequest,
+    GiftUpdateRequest
 )
 from fuzzy_logic import fuzzy_system
-from typing import List
+from executor import EXECUTION_MODE, ExecutorBusyError, scoring_executor
+from artifact import GIFTS_PATH
+from reload import CatalogReloader
+from metrics import metrics
+from profiling import RequestProfiler
+from responses import final_images_json, gift_json, gifts_json, image_pairs_json
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import functools
+import hmac
+import json
 import logging
+import os
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Required in the X-Admin-Token header of admin endpoints; admin endpoints
+# are disabled while it is unset
+ADMIN_TOKEN = os.environ.get('FUZZY_ADMIN_TOKEN', '')
+
+catalog_reloader = CatalogReloader.from_env(fuzzy_system, GIFTS_PATH)
+request_profiler = RequestProfiler.from_env()
+
+
+def log_rule_report():
+    """Log the merged and dead rules of the rule base in use."""
+    for notice in fuzzy_system.rule_report.notices():
+        logger.info(f"Rule base {os.path.basename(fuzzy_system.rules_path)}: {notice}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop the scoring worker processes and the catalog watcher."""
+    log_rule_report()
+    if EXECUTION_MODE == 'process':
+        logger.info(f"Starting {scoring_executor.max_workers} scoring worker processes")
+        fuzzy_system.enable_process_pool(scoring_executor.max_workers)
+    catalog_reloader.start()
+    try:
+        yield
+    finally:
+        catalog_reloader.stop()
+        fuzzy_system.disable_process_pool()
+
+
+# Timestamps of the current request: start, endpoint start, endpoint end
+_request_marks: ContextVar[Optional[List[float]]] = ContextVar('request_marks', default=None)
+
+
+def _mark_endpoint(endpoint: Callable) -> Callable:
+    """Wrap an endpoint to record when it starts and returns."""
+    def mark():
+        marks = _request_marks.get()
+        if marks is not None:
+            marks.append(perf_counter())
+    
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def marked(*args, **kwargs):
+            mark()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                mark()
+    else:
+        @functools.wraps(endpoint)
+        def marked(*args, **kwargs):
+            mark()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                mark()
+    return marked
+
+
+class TimedRoute(APIRoute):
+    """
+    Route recording the validation, handler and serialization time of requests.
+    
+    Validation covers request parsing and dependencies, serialization the
+    response model and JSON encoding; requests rejected before the endpoint
+    ran only record their total time.
+    """
+    
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _mark_endpoint(endpoint), **kwargs)
+    
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        path = self.path
+        
+        async def timed_handler(request):
+            marks = [perf_counter()]
+            token = _request_marks.set(marks)
+            try:
+                return await handler(request)
+            finally:
+                _request_marks.reset(token)
+                marks.append(perf_counter())
+                if len(marks) == 4:
+                    metrics.observe_request(path, 'validation', marks[1] - marks[0])
+                    metrics.observe_request(path, 'handler', marks[2] - marks[1])
+                    metrics.observe_request(path, 'serialization', marks[3] - marks[2])
+                metrics.observe_request(path, 'total', marks[-1] - marks[0])
+        
+        return timed_handler
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Gift Recommendation API",
     description="Fuzzy logic-based gift recommendation system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Time every endpoint when metrics are enabled
+if metrics.enabled:
+    app.router.route_class = TimedRoute
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +158,42 @@ app.add_middleware(
 )
 
 
+def is_admin(x_admin_token: Optional[str]) -> bool:
+    """Return whether a request carries the configured FUZZY_ADMIN_TOKEN; never when it is unset."""
+    if not ADMIN_TOKEN or x_admin_token is None:
+        return False
+    return hmac.compare_digest(x_admin_token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject admin requests without the FUZZY_ADMIN_TOKEN, and every admin request while it is unset."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set FUZZY_ADMIN_TOKEN")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def profile_trigger(
+    x_profile: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None)
+) -> Optional[str]:
+    """
+    Decide whether to profile a request, see profiling.py.
+    
+    The X-Profile header is only honoured with the admin token, so it is
+    ignored while FUZZY_ADMIN_TOKEN is unset.
+    """
+    requested = bool(x_profile) and x_profile != '0' and is_admin(x_admin_token)
+    return request_profiler.should_profile(requested)
+
+
+async def run_scoring(endpoint: str, trigger: Optional[str], func: Callable, *args, **kwargs) -> Any:
+    """Run a scoring call on the scoring executor, profiled if trigger is set."""
+    if trigger is not None:
+        func = request_profiler.wrap(func, endpoint, trigger)
+    return await scoring_executor.run(func, *args, **kwargs)
+
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
@@ -54,8 +204,42 @@ async def root():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Latency histograms and server gauges in the Prometheus text format.
+    
+    Latency histograms are only recorded when FUZZY_METRICS is enabled.
+    """
+    snapshot = fuzzy_system.snapshot
+    samples = [
+        ('fuzzy_catalog_gifts', 'gauge', 'Gifts in the catalog in use', {}, len(snapshot.catalog)),
+        ('fuzzy_catalog_version', 'gauge', 'Version of the catalog in use', {}, snapshot.version),
+        ('fuzzy_catalog_reloads_total', 'counter', 'Catalog reloads since start', {}, catalog_reloader.reloads),
+        ('fuzzy_executor_in_flight', 'gauge', 'Scoring tasks running or queued', {}, scoring_executor.in_flight),
+        ('fuzzy_executor_queue_depth', 'gauge', 'Scoring tasks waiting for a worker', {},
+         scoring_executor.queue_depth),
+        ('fuzzy_executor_workers', 'gauge', 'Scoring workers', {}, scoring_executor.max_workers),
+    ]
+    for name, cache in (('scores', fuzzy_system.cache), ('sessions', fuzzy_system.sessions)):
+        stats = cache.stats()
+        labels = {'cache': name}
+        samples += [
+            ('fuzzy_cache_hits_total', 'counter', 'Cache lookups that found an entry', labels, stats['hits']),
+            ('fuzzy_cache_misses_total', 'counter', 'Cache lookups that found no entry', labels, stats['misses']),
+            ('fuzzy_cache_hit_ratio', 'gauge', 'Share of cache lookups that found an entry', labels,
+             stats['hit_rate']),
+            ('fuzzy_cache_entries', 'gauge', 'Entries in the cache', labels, stats['entries']),
+            ('fuzzy_cache_bytes', 'gauge', 'Bytes held by the cache', labels, stats['bytes']),
+        ]
+    return metrics.render(samples)
+
+
 @app.post("/api/generate-image-pairs", response_model=GenerateImagePairsResponse)
-async def generate_image_pairs(request: GenerateImagePairsRequest):
+async def generate_image_pairs(
+    request: GenerateImagePairsRequest,
+    profiling: Optional[str] = Depends(profile_trigger)
+):
     """
     Generate diverse gift pairs for user comparison.
     
@@ -68,7 +252,7 @@ async def generate_image_pairs(request: GenerateImagePairsRequest):
         request: Contains user data and recipient data
     
     Returns:
-        5 pairs of gift images with metadata
+        numPairs (default 5) pairs of gift images with metadata
     """
     try:
         logger.info("Generating image pairs...")
@@ -81,39 +265,41 @@ async def generate_image_pairs(request: GenerateImagePairsRequest):
         user_data = request.user.model_dump()
         recipient_data = request.other.model_dump()
         
-        # Get diverse pairs from fuzzy system
-        pairs = fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=5)
+        # Get diverse pairs from fuzzy system, keeping the scores for the
+        # final recommendations
+        pairs, session_id = await run_scoring(
+            "/api/generate-image-pairs",
+            profiling,
+            fuzzy_system.start_session,
+            user_data,
+            recipient_data,
+            num_pairs=request.numPairs,
+            seed=request.seed
+        )
         
         if not pairs or len(pairs) == 0:
             raise HTTPException(status_code=500, detail="Failed to generate gift pairs")
         
-        # Convert to response format
-        image_pairs = []
-        for pair in pairs:
-            pair_images = []
-            for idx, gift in enumerate(pair):
-                # Use the image_url from the gift data
-                image_info = ImageInfo(
-                    path=gift.get('image_url', 'placeholder.jpg'),
-                    value=gift['id'],
-                    name=gift['name'],
-                    description=gift['description'],
-                    amazon_link=gift.get('amazon_link', '')
-                )
-                pair_images.append(image_info)
-            image_pairs.append(pair_images)
-        
-        logger.info(f"Successfully generated {len(image_pairs)} image pairs")
-        
-        return GenerateImagePairsResponse(imagePairs=image_pairs)
+        # Assembled from the gifts' pre-rendered ImageInfo objects
+        content = image_pairs_json(pairs, session_id)
+        
+        logger.info(f"Successfully generated {len(pairs)} image pairs")
         
+        return Response(content, media_type="application/json")
+        
+    except ExecutorBusyError as e:
+        logger.warning(f"Rejecting image pairs request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating image pairs: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating image pairs: {str(e)}")
 
 
 @app.post("/api/generate-final-images", response_model=GenerateFinalImagesResponse)
-async def generate_final_images(request: GenerateFinalImagesRequest):
+async def generate_final_images(
+    request: GenerateFinalImagesRequest,
+    profiling: Optional[str] = Depends(profile_trigger)
+):
     """
     Generate final gift recommendations based on user selections.
     
@@ -136,61 +322,133 @@ async def generate_final_images(request: GenerateFinalImagesRequest):
         recipient_data = request.other.model_dump()
         
         # Extract selected gift IDs
-        selected_ids = [
-            request.selectedImages.image0,
-            request.selectedImages.image1,
-            request.selectedImages.image2,
-            request.selectedImages.image3,
-            request.selectedImages.image4
-        ]
+        selected_ids = request.selectedImages.gift_ids()
         
         logger.info(f"Selected gift IDs: {selected_ids}")
         
         # Get refined recommendations from fuzzy system
-        final_gifts = fuzzy_system.refine_recommendations(
+        final_gifts = await run_scoring(
+            "/api/generate-final-images",
+            profiling,
+            fuzzy_system.refine_recommendations,
             user_data,
             recipient_data,
             selected_ids,
-            top_n=3
+            top_n=3,
+            session_id=request.sessionId,
+            selection_weights=request.selectionWeights
         )
         
         if not final_gifts or len(final_gifts) == 0:
             raise HTTPException(status_code=500, detail="Failed to generate final recommendations")
         
-        # Convert to response format
-        final_images = []
-        for idx, gift in enumerate(final_gifts):
-            # Use the image_url from the gift data
-            final_image = FinalImageInfo(
-                path=gift.get('image_url', 'placeholder.jpg'),
-                value=gift['id'],
-                name=gift['name'],
-                description=gift['description'],
-                category=gift['category'],
-                fuzzy_score=round(gift['fuzzy_score'], 2),
-                amazon_link=gift.get('amazon_link', '')
-            )
-            final_images.append(final_image)
+        # Assembled from the gifts' pre-rendered FinalImageInfo objects
+        content = final_images_json(final_gifts)
         
-        logger.info(f"Successfully generated {len(final_images)} final recommendations")
-        logger.info(f"Top recommendation: {final_images[0].name} (score: {final_images[0].fuzzy_score})")
+        top = final_gifts[0]
+        logger.info(f"Successfully generated {len(final_gifts)} final recommendations")
+        logger.info(f"Top recommendation: {top['name']} (score: {round(top['fuzzy_score'], 2)})")
         
-        return GenerateFinalImagesResponse(finalImages=final_images)
+        return Response(content, media_type="application/json")
         
+    except ExecutorBusyError as e:
+        logger.warning(f"Rejecting final recommendations request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating final recommendations: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating final recommendations: {str(e)}")
 
 
+@app.post("/api/batch/recommendations")
+async def batch_recommendations(request: BatchRecommendationRequest):
+    """
+    Recommend gifts for many user/recipient profiles in one call.
+    
+    Fuzzy inference and bonus scoring run as matrix operations over
+    profiles x gifts. Results are streamed back as newline-delimited JSON,
+    one BatchRecommendation object per profile, in request order.
+    
+    Args:
+        request: Profiles to score and the number of gifts per profile
+    
+    Returns:
+        Streaming application/x-ndjson response
+    """
+    logger.info(f"Scoring batch of {len(request.profiles)} profiles...")
+    
+    try:
+        scoring_executor.check_capacity()
+    except ExecutorBusyError as e:
+        logger.warning(f"Rejecting batch request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    users = [profile.user.model_dump() for profile in request.profiles]
+    recipients = [profile.other.model_dump() for profile in request.profiles]
+    
+    def generate_blocks():
+        # Profiles are serialized in blocks so each hop to a scoring thread
+        # carries many lines
+        results = fuzzy_system.recommend_batch(users, recipients, top_n=request.topN)
+        while True:
+            block = list(islice(results, 256))
+            if not block:
+                break
+            yield "".join(
+                json.dumps({
+                    "index": result['index'],
+                    "gifts": [
+                        {"value": gift_id, "fuzzy_score": round(score, 2)}
+                        for gift_id, score in zip(result['gift_ids'], result['scores'])
+                    ]
+                }) + "\n"
+                for result in block
+            )
+    
+    async def stream_blocks():
+        try:
+            async for block in scoring_executor.stream(generate_blocks()):
+                yield block
+        except Exception as e:
+            logger.error(f"Error streaming batch recommendations: {str(e)}")
+            raise
+    
+    return StreamingResponse(stream_blocks(), media_type="application/x-ndjson")
+
+
 @app.get("/api/gifts")
-async def get_all_gifts():
+async def get_all_gifts(
+    category: Optional[str] = None,
+    occasion: Optional[str] = None,
+    style: Optional[str] = None,
+    gender: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None
+):
     """
-    Get all available gifts in the database.
+    Get all available gifts in the database, optionally filtered.
     
-    This is a utility endpoint for debugging/exploration.
+    This is a utility endpoint for debugging/exploration. Filters are
+    answered from the catalog indexes and combine with AND, and the
+    response is assembled from the gifts' pre-rendered JSON.
     """
     try:
-        return {"gifts": fuzzy_system.gifts, "count": len(fuzzy_system.gifts)}
+        snapshot = fuzzy_system.snapshot
+        catalog = snapshot.catalog
+        indices = catalog.select(
+            category=category,
+            occasion=occasion,
+            style=style,
+            gender=gender,
+            min_price=min_price,
+            max_price=max_price
+        )
+        if snapshot.fragments is not None:
+            content = gifts_json(snapshot.fragments, snapshot.gifts, indices.tolist())
+            return Response(content, media_type="application/json")
+        gifts = [catalog.gifts[i] for i in indices.tolist()]
+        return {"gifts": gifts, "count": len(gifts)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching gifts: {str(e)}")
 
@@ -207,16 +465,135 @@ async def get_gift_by_id(gift_id: str):
         Gift details
     """
     try:
-        gift = next((g for g in fuzzy_system.gifts if g['id'] == gift_id), None)
-        if not gift:
+        snapshot = fuzzy_system.snapshot
+        index = snapshot.catalog.index_of(gift_id)
+        if index is None:
             raise HTTPException(status_code=404, detail="Gift not found")
-        return gift
+        if snapshot.fragments is not None:
+            return Response(gift_json(snapshot.fragments, snapshot.gifts, index), media_type="application/json")
+        return snapshot.gifts[index]
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching gift: {str(e)}")
 
 
+@app.post("/api/admin/reload-catalog", dependencies=[Depends(require_admin)])
+async def reload_catalog():
+    """
+    Reload gifts.json and swap the new catalog in.
+    
+    The catalog is rebuilt on a background thread; other requests keep
+    being served from the previous catalog until the swap, and requests
+    already running finish against it.
+    
+    Returns:
+        The catalog version and gift count now in use
+    """
+    try:
+        logger.info("Reloading gift catalog...")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, catalog_reloader.reload)
+    except Exception as e:
+        logger.error(f"Error reloading catalog: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reloading catalog: {str(e)}")
+
+
+@app.get("/api/admin/catalog", dependencies=[Depends(require_admin)])
+async def get_catalog_status():
+    """Return the catalog version in use and the reload counters."""
+    return catalog_reloader.status()
+
+
+@app.post("/api/admin/reload-rules", dependencies=[Depends(require_admin)])
+async def reload_rules():
+    """
+    Compile the rule base file again and score with it from now on.
+    
+    An invalid rule base is rejected with 400 and the current rules stay in
+    use. Scores cached for the previous rules are not served again.
+    
+    Returns:
+        The rule analysis (live rules, merged duplicates, dead rules)
+    """
+    try:
+        logger.info("Reloading rule base...")
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(None, fuzzy_system.load_rules)
+        log_rule_report()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reloading rules: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reloading rules: {str(e)}")
+    return dict(report.summary(), path=fuzzy_system.rules_path)
+
+
+@app.get("/api/admin/rules", dependencies=[Depends(require_admin)])
+async def get_rules_status():
+    """Return the rule base file in use and its analysis."""
+    return dict(fuzzy_system.rule_report.summary(), path=fuzzy_system.rules_path)
+
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles(limit: Optional[int] = None):
+    """Return the hot functions of recently profiled requests, newest first."""
+    return {
+        "rate": request_profiler.rate,
+        "profiled": request_profiler.profiles,
+        "profiles": request_profiler.recent(limit),
+    }
+
+
+@app.delete("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def clear_profiles():
+    """Drop the kept request profiles."""
+    request_profiler.clear()
+    return {"profiles": []}
+
+
+async def apply_gift_update(upserts: List[Dict[str, Any]], deletes: List[str]):
+    """Apply a gift update on a background thread and report the new catalog."""
+    try:
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, fuzzy_system.update_gifts, upserts, deletes)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error updating gifts: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error updating gifts: {str(e)}")
+    
+    logger.info(f"Updated gifts: {len(upserts)} upserted, {len(deletes)} deleted "
+                f"(catalog version {snapshot.version})")
+    return {"version": snapshot.version, "count": len(snapshot.catalog)}
+
+
+@app.post("/api/admin/gifts", dependencies=[Depends(require_admin)])
+async def update_gifts(request: GiftUpdateRequest):
+    """
+    Add, replace and remove individual gifts in one atomic update.
+    
+    Only the changed gifts are recompiled; indexes and cached scores are
+    patched instead of rebuilt. Changes are kept in memory until the next
+    catalog reload.
+    """
+    return await apply_gift_update(request.upsert, request.delete)
+
+
+@app.put("/api/admin/gifts/{gift_id}", dependencies=[Depends(require_admin)])
+async def put_gift(gift_id: str, gift: Dict[str, Any]):
+    """Add a gift, or replace the gift with this ID."""
+    return await apply_gift_update([dict(gift, id=gift_id)], [])
+
+
+@app.delete("/api/admin/gifts/{gift_id}", dependencies=[Depends(require_admin)])
+async def delete_gift(gift_id: str):
+    """Remove a gift."""
+    return await apply_gift_update([], [gift_id])
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=4000)
@@ -0,0 +1,214 @@
+"""
+Latency Metrics
+===============
+Low-overhead latency histograms of the scoring stages and API requests,
+rendered in the Prometheus text format for the /metrics endpoint.
+
+Functions are timed by decorating them with ``@metrics.timed('stage')``,
+blocks with ``with metrics.stage('stage'):``. Timed stages may nest (e.g.
+re-ranking scores the catalog on a cache miss), so stage times don't add up
+to the request time. Stages that run on worker processes (see
+workers.py) are recorded in the workers and not exported.
+
+Configuration (environment variables):
+- FUZZY_METRICS: 1 to record latency histograms, 0 to disable them; when
+  disabled, timed functions are left undecorated and stage() returns a
+  shared no-op context manager (default: 1)
+"""
+
+import functools
+import os
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Returned by disabled timers
+_NULL_TIMER = nullcontext()
+
+# Gauge or counter sample: (name, type, help, labels, value)
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values."""
+
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # counts[i] counts values in (buckets[i - 1], buckets[i]], the last
+        # entry values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """Return the cumulative bucket counts (the last is +Inf) and the sum."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+class _Timer:
+    """Context manager observing its duration in a histogram."""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Registry of the stage and request latency histograms.
+
+    Histograms are created on first use, so only stages and endpoints that
+    ran are exported.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages: Dict[str, Histogram] = {}
+        self.requests: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, family: Dict, key) -> Histogram:
+        histogram = family.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = family.setdefault(key, Histogram())
+        return histogram
+
+    def stage(self, name: str):
+        """Context manager timing one run of a scoring stage."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self._histogram(self.stages, name))
+
+    def timed(self, name: str) -> Callable:
+        """
+        Decorator timing every call of a function as a scoring stage.
+
+        Returns the function unchanged when metrics are disabled.
+        """
+        def decorate(func: Callable) -> Callable:
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def timed_func(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._histogram(self.stages, name).observe(perf_counter() - start)
+            return timed_func
+        return decorate
+
+    def observe_request(self, endpoint: str, phase: str, seconds: float):
+        """Record the time of one phase of an API request."""
+        if self.enabled:
+            self._histogram(self.requests, (endpoint, phase)).observe(seconds)
+
+    def reset(self):
+        """Drop every recorded histogram."""
+        with self._lock:
+            self.stages = {}
+            self.requests = {}
+
+    def render(self, samples: Iterable[Sample] = ()) -> str:
+        """
+        Render the histograms and additional samples in the Prometheus text format.
+
+        Args:
+            samples: Gauges and counters to export along with the histograms
+        """
+        lines = []
+        self._render_family(
+            lines, 'fuzzy_stage_duration_seconds', 'Time spent in a scoring stage',
+            {(('stage', name),): histogram for name, histogram in list(self.stages.items())}
+        )
+        self._render_family(
+            lines, 'fuzzy_request_duration_seconds',
+            'Time spent in a phase of an API request (validation, handler, serialization, total)',
+            {(('endpoint', endpoint), ('phase', phase)): histogram
+             for (endpoint, phase), histogram in list(self.requests.items())}
+        )
+
+        # Samples of one metric must be listed together
+        families: Dict[str, List[Sample]] = {}
+        for sample in samples:
+            families.setdefault(sample[0], []).append(sample)
+        for name, family in families.items():
+            lines.append(f"# HELP {name} {family[0][2]}")
+            lines.append(f"# TYPE {name} {family[0][1]}")
+            for _, _, _, labels, value in family:
+                lines.append(f"{name}{_labels(tuple(labels.items()))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_family(lines: List[str], name: str, description: str, histograms: Dict):
+        if not histograms:
+            return
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in sorted(histograms.items()):
+            cumulative, total = histogram.snapshot()
+            for bound, count in zip(histogram.buckets, cumulative):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {cumulative[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative[-1]}")
+
+    @classmethod
+    def from_env(cls) -> 'Metrics':
+        """Create a registry configured by the FUZZY_METRICS environment variable."""
+        return cls(enabled=os.environ.get('FUZZY_METRICS', '1').lower() not in ('0', 'false', 'no'))
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: Optional[float]) -> str:
+    return repr(float(value)) if value is not None else 'NaN'
+
+
+metrics = Metrics.from_env()
@@ -4,8 +4,8 @@ Pydantic Models for Gift Recommendation API
 Defines data models for request/response validation.
 """
 
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Any, Dict, List, Optional
 
 
 class UserData(BaseModel):
@@ -31,6 +31,8 @@ class GenerateImagePairsRequest(BaseModel):
     """Request model for generating image pairs."""
     user: UserData
     other: OtherPersonData
+    numPairs: int = Field(5, ge=1, le=50, description="Number of comparison rounds")
+    seed: Optional[int] = Field(None, description="Seed for shuffling the pairs, same seed gives same pairs")
 
 
 class ImageInfo(BaseModel):
@@ -45,15 +47,46 @@ class ImageInfo(BaseModel):
 class GenerateImagePairsResponse(BaseModel):
     """Response model for image pairs."""
     imagePairs: List[List[ImageInfo]] = Field(..., description="List of image pairs for comparison")
+    sessionId: Optional[str] = Field(None, description="Session to pass to generate-final-images")
 
 
 class SelectedImages(BaseModel):
-    """Selected images from the pair comparisons."""
+    """
+    Selected images from the pair comparisons.
+    
+    One selection per round that was shown (numPairs), numbered from 0
+    without gaps; rounds after the fifth are sent as image5, image6, and so
+    on.
+    """
+    model_config = ConfigDict(extra='allow')
+    
     image0: str = Field(..., description="Selected gift ID from round 0")
-    image1: str = Field(..., description="Selected gift ID from round 1")
-    image2: str = Field(..., description="Selected gift ID from round 2")
-    image3: str = Field(..., description="Selected gift ID from round 3")
-    image4: str = Field(..., description="Selected gift ID from round 4")
+    image1: Optional[str] = Field(None, description="Selected gift ID from round 1")
+    image2: Optional[str] = Field(None, description="Selected gift ID from round 2")
+    image3: Optional[str] = Field(None, description="Selected gift ID from round 3")
+    image4: Optional[str] = Field(None, description="Selected gift ID from round 4")
+    
+    def _selections(self) -> Dict[int, Any]:
+        selections = dict(self.model_extra or {}, **{
+            f'image{i}': getattr(self, f'image{i}') for i in range(5)
+        })
+        return {
+            int(name[len('image'):]): value for name, value in selections.items()
+            if name.startswith('image') and name[len('image'):].isdigit() and value is not None
+        }
+    
+    @model_validator(mode='after')
+    def check_rounds(self) -> 'SelectedImages':
+        rounds = sorted(self._selections())
+        if rounds != list(range(len(rounds))):
+            missing = sorted(set(range(rounds[-1] + 1)) - set(rounds))
+            raise ValueError(f"Missing selections for rounds {missing}")
+        return self
+    
+    def gift_ids(self) -> List[str]:
+        """Return the selected gift IDs in round order."""
+        selections = self._selections()
+        return [str(selections[i]) for i in sorted(selections)]
 
 
 class GenerateFinalImagesRequest(BaseModel):
@@ -61,6 +94,10 @@ class GenerateFinalImagesRequest(BaseModel):
     user: UserData
     other: OtherPersonData
     selectedImages: SelectedImages
+    sessionId: Optional[str] = Field(None, description="Session returned by generate-image-pairs")
+    selectionWeights: Optional[List[float]] = Field(
+        None, description="Weight of each selection, in round order (default: all equal)"
+    )
 
 
 class FinalImageInfo(BaseModel):
@@ -77,3 +114,33 @@ class FinalImageInfo(BaseModel):
 class GenerateFinalImagesResponse(BaseModel):
     """Response model for final gift recommendations."""
     finalImages: List[FinalImageInfo] = Field(..., description="Final recommended gifts")
+
+
+class ProfileData(BaseModel):
+    """A single user/recipient profile."""
+    user: UserData
+    other: OtherPersonData
+
+
+class BatchRecommendationRequest(BaseModel):
+    """Request model for scoring many profiles in one call."""
+    profiles: List[ProfileData] = Field(..., description="Profiles to score")
+    topN: int = Field(10, ge=1, le=100, description="Number of gifts to return per profile")
+
+
+class ScoredGift(BaseModel):
+    """A gift ID with its fuzzy score."""
+    value: str = Field(..., description="Gift ID")
+    fuzzy_score: float = Field(..., description="Fuzzy logic compatibility score")
+
+
+class BatchRecommendation(BaseModel):
+    """One line of the newline-delimited JSON batch recommendation stream."""
+    index: int = Field(..., description="Index of the profile in the request")
+    gifts: List[ScoredGift] = Field(..., description="Top gifts for the profile")
+
+
+class GiftUpdateRequest(BaseModel):
+    """Request model for adding, replacing and removing individual gifts."""
+    upsert: List[Dict[str, Any]] = Field(default_factory=list, description="Gifts to add, or to replace the gift with the same id")
+    delete: List[str] = Field(default_factory=list, description="IDs of the gifts to remove")
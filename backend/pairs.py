@@ -0,0 +1,159 @@
+"""
+Diverse Pair Selection
+======================
+Builds the comparison pairs of the image pair flow from the top-ranked
+gifts. Each pair starts with the best-ranked gift not used yet and adds the
+best-ranked remaining gift that differs from it in the most important
+diversity dimensions.
+
+Candidates are grouped into buckets of equal dimension values, kept in rank
+order, so finding the partner of a gift only looks at the head of each
+non-empty bucket: O(K log K + pairs x buckets) for K candidates instead of a
+scan over all candidates for every pair.
+
+Configuration (environment variables):
+- FUZZY_PAIR_DIMENSIONS: Comma-separated gift attributes the two gifts of a
+  pair should differ in, most important first; any of category, style and
+  price (default: category)
+- FUZZY_PAIR_SEED: Seed for shuffling the order and sides of the pairs, so
+  the same seed always gives the same pairs; empty keeps rank order
+  (default: empty)
+"""
+
+import os
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from catalog import GiftCatalog
+
+# Upper bounds of the price bands used by the 'price' dimension; higher
+# prices fall into the last band
+PRICE_BANDS = [25, 50, 75]
+
+# Diversity dimensions and the per-gift codes they compare
+DIMENSIONS = {
+    'category': lambda catalog, indices: catalog.category_codes[indices],
+    'style': lambda catalog, indices: catalog.style_codes[indices],
+    'price': lambda catalog, indices: np.searchsorted(
+        PRICE_BANDS, catalog.price_range[indices], side='left'
+    ),
+}
+
+# Top-ranked gifts that pairs are drawn from, at least
+MIN_CANDIDATES = 30
+
+# Candidates per pair, so later pairs still have partners to choose from
+CANDIDATES_PER_PAIR = 6
+
+
+class PairSelector:
+    """
+    Picks diverse pairs out of ranked candidates.
+
+    With the default dimensions (category only) and no seed, the pairs are
+    the same as pairing each best remaining gift with the best remaining
+    gift of another category.
+    """
+
+    def __init__(self, dimensions: Sequence[str] = ('category',), seed: Optional[int] = None):
+        """
+        Args:
+            dimensions: Names of DIMENSIONS pairs should differ in, most
+                important first
+            seed: Default seed for shuffling pairs, None for rank order
+
+        Raises:
+            ValueError: If a dimension is unknown
+        """
+        unknown = [name for name in dimensions if name not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown pair dimensions {unknown}, expected any of {list(DIMENSIONS)}")
+        self.dimensions = list(dimensions)
+        self.seed = seed
+
+    def candidates(self, num_pairs: int) -> int:
+        """Number of top-ranked gifts to draw num_pairs pairs from."""
+        return max(MIN_CANDIDATES, CANDIDATES_PER_PAIR * num_pairs)
+
+    def select(
+        self,
+        catalog: GiftCatalog,
+        indices: np.ndarray,
+        num_pairs: int,
+        seed: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        Pair up ranked gifts.
+
+        Args:
+            catalog: Catalog the indices refer to
+            indices: Catalog indices of the candidates, best first
+            num_pairs: Number of pairs to build; fewer are returned when the
+                candidates run out
+            seed: Seed for shuffling the pairs (default: the selector's)
+
+        Returns:
+            Pairs of positions into indices
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        if not self.dimensions:
+            keys = np.zeros((len(indices), 1), dtype=np.int64)
+        else:
+            keys = np.stack([
+                np.asarray(DIMENSIONS[name](catalog, indices), dtype=np.int64)
+                for name in self.dimensions
+            ], axis=1)
+
+        # Buckets of equal keys, each in rank order
+        bucket_keys, bucket_of = np.unique(keys, axis=0, return_inverse=True)
+        buckets: Dict[int, deque] = {}
+        for position, bucket in enumerate(bucket_of.reshape(-1).tolist()):
+            buckets.setdefault(bucket, deque()).append(position)
+
+        # Differing in a dimension outweighs differing in all later ones
+        priorities = 1 << np.arange(len(self.dimensions) - 1, -1, -1) if self.dimensions else []
+
+        pairs = []
+        while len(pairs) < num_pairs and len(buckets) > 0:
+            # Best remaining gift: the best head of all buckets
+            first_bucket = min(buckets, key=lambda bucket: buckets[bucket][0])
+            first = self._pop(buckets, first_bucket)
+
+            partner_bucket = None
+            best = None
+            for bucket, queue in buckets.items():
+                differs = bucket_keys[bucket] != bucket_keys[first_bucket]
+                rank = (-int(np.dot(differs, priorities)), queue[0])
+                if best is None or rank < best:
+                    partner_bucket, best = bucket, rank
+            if partner_bucket is None:
+                break
+            pairs.append((first, self._pop(buckets, partner_bucket)))
+
+        seed = self.seed if seed is None else seed
+        if seed is not None and pairs:
+            rng = np.random.default_rng(seed)
+            flips = rng.random(len(pairs)) < 0.5
+            pairs = [(b, a) if flip else (a, b) for (a, b), flip in zip(pairs, flips.tolist())]
+            pairs = [pairs[i] for i in rng.permutation(len(pairs)).tolist()]
+        return pairs
+
+    @staticmethod
+    def _pop(buckets: Dict[int, deque], bucket: int) -> int:
+        """Take the best gift of a bucket, dropping the bucket once empty."""
+        position = buckets[bucket].popleft()
+        if not buckets[bucket]:
+            del buckets[bucket]
+        return position
+
+    @classmethod
+    def from_env(cls) -> 'PairSelector':
+        """Create a selector configured by the FUZZY_PAIR_* environment variables."""
+        dimensions = os.environ.get('FUZZY_PAIR_DIMENSIONS', 'category')
+        seed = os.environ.get('FUZZY_PAIR_SEED', '')
+        return cls(
+            dimensions=[name.strip() for name in dimensions.split(',') if name.strip()],
+            seed=int(seed) if seed else None
+        )
@@ -0,0 +1,321 @@
+"""
+Candidate Prefiltering
+======================
+Finds the top-K gifts of a large catalog without scoring every gift.
+
+The catalog is split into contiguous blocks. For each block, an upper bound
+on the score of any of its gifts is computed from per-block summaries (value
+ranges of the numeric attributes, which occasions/styles/genders/categories
+occur, the largest age-band bonus). When the base score depends on the
+gift category (see rulebase.py), a block's bound uses the highest base
+score among its categories. Blocks are scored in descending bound order, and
+the scan stops as soon as no remaining block can beat, or tie its way into,
+the current top K. Because the bounds are admissible (never below a real
+score), the result is exactly the top K of the full ranking, including the
+catalog-order tie-breaking.
+
+The scores are capped at 100, so once K gifts at 100 have been found the
+remaining blocks are skipped entirely.
+
+Refinement adds an uncapped preference bonus, which block summaries bound
+poorly; there the bonus is computed for every gift (it is much cheaper than
+the full score) and added to the block bound, giving a bound per gift.
+"""
+
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from catalog import AGE_BANDS, GiftCatalog
+
+# Bonus weights of the trait attributes, in TRAIT_NAMES order, see
+# GiftRecommendationFuzzySystem.score_profiles
+TRAIT_WEIGHTS = np.array([10, 8, 8, 7, 7], dtype=np.float64)
+
+# Added to every bound so rounding in the real score never exceeds it
+BOUND_EPSILON = 1e-9
+
+
+def _closeness(low: np.ndarray, high: np.ndarray, value) -> np.ndarray:
+    """Largest 1 - |x - value| / 100 over x in [low, high]."""
+    distance = np.maximum(0.0, np.maximum(low - value, value - high))
+    return 1 - distance / 100
+
+
+class CatalogPrefilter:
+    """
+    Per-block summaries of a GiftCatalog, used to bound scores.
+
+    Attributes:
+        block_size: Gifts per block (the last block may be shorter)
+        starts: First catalog index of every block
+    """
+
+    # Per-block summary arrays, see _summarize
+    SUMMARIES = [
+        'price_low', 'price_high', 'traits_low', 'traits_high', 'relationship_low',
+        'relationship_high', 'occasions', 'styles', 'genders', 'categories', 'age_bonus',
+        'any_invalid', 'all_invalid'
+    ]
+
+    def __init__(self, catalog: GiftCatalog, block_size: int):
+        """
+        Summarize a catalog in blocks of block_size gifts.
+
+        Args:
+            catalog: Catalog to summarize
+            block_size: Gifts per block
+        """
+        self.catalog = catalog
+        self.block_size = block_size
+        self.starts = np.arange(0, len(catalog), block_size)
+        for name, summary in self._summarize(catalog, self.starts).items():
+            setattr(self, name, summary)
+
+    def _summarize(self, catalog: GiftCatalog, starts: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Compute the summaries of some blocks.
+
+        Args:
+            catalog: Catalog to summarize
+            starts: Ascending first catalog index of each block to summarize
+
+        Returns:
+            Summary name -> array with one row per block
+        """
+        stops = np.minimum(starts + self.block_size, len(catalog))
+        sizes = stops - starts
+        if len(starts) == len(self.starts):
+            rows = slice(None)
+        else:
+            rows = np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+        # Blocks are contiguous in rows, starting at these offsets
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.intp)
+        traits = catalog.traits[rows]
+        valid = catalog.valid[rows]
+
+        block_of = np.repeat(np.arange(len(starts)), sizes)
+        summaries = {
+            'price_low': np.minimum.reduceat(catalog.price_range[rows], offsets),
+            'price_high': np.maximum.reduceat(catalog.price_range[rows], offsets),
+            'traits_low': np.minimum.reduceat(traits, offsets, axis=0),
+            'traits_high': np.maximum.reduceat(traits, offsets, axis=0),
+            'relationship_low': np.minimum.reduceat(catalog.relationship_score[rows], offsets),
+            'relationship_high': np.maximum.reduceat(catalog.relationship_score[rows], offsets),
+            'occasions': np.bitwise_or.reduceat(catalog.occasion_masks[rows], offsets),
+            'styles': self._present(len(starts), block_of, catalog.style_codes[rows],
+                                    len(catalog.styles)),
+            'genders': self._present(len(starts), block_of, catalog.gender_codes[rows],
+                                     len(catalog.genders)),
+            'categories': self._present(len(starts), block_of, catalog.category_codes[rows],
+                                        len(catalog.categories)),
+            # Largest total age-band bonus of a gift in the block, per band
+            'age_bonus': np.maximum.reduceat(
+                catalog.age_band_matrix[:, :, rows].sum(axis=1), offsets, axis=1
+            ),
+            'any_invalid': np.logical_or.reduceat(~valid, offsets),
+            'all_invalid': ~np.logical_or.reduceat(valid, offsets),
+        }
+        return summaries
+
+    def updated(self, catalog: GiftCatalog, changed: np.ndarray) -> 'CatalogPrefilter':
+        """
+        Summarize an updated catalog, recomputing only the blocks that changed.
+
+        Args:
+            catalog: The catalog returned by GiftCatalog.updated
+            changed: Rows of catalog whose gift changed
+
+        Returns:
+            New prefilter; this one is left unchanged
+        """
+        prefilter = CatalogPrefilter.__new__(CatalogPrefilter)
+        prefilter.catalog = catalog
+        prefilter.block_size = self.block_size
+        prefilter.starts = np.arange(0, len(catalog), self.block_size)
+        count = len(prefilter.starts)
+
+        # Blocks with changed rows, plus the last block of either catalog,
+        # which changes size when gifts are added or removed
+        kept = min(len(self.starts), count)
+        blocks = set((changed // self.block_size).tolist())
+        blocks.update(range(max(0, kept - 1), count))
+        blocks = np.array(sorted(b for b in blocks if b < count), dtype=np.intp)
+        summaries = prefilter._summarize(catalog, prefilter.starts[blocks])
+
+        for name in self.SUMMARIES:
+            old, new = getattr(self, name), summaries[name]
+            if name == 'age_bonus':
+                array = np.zeros((old.shape[0], count), dtype=old.dtype)
+                array[:, :kept] = old[:, :kept]
+                array[:, blocks] = new
+            else:
+                array = np.zeros((count,) + new.shape[1:], dtype=old.dtype)
+                if name in ('styles', 'genders', 'categories'):
+                    # Vocabularies may have grown; the last column stays the
+                    # never-set "no such value" column
+                    array[:kept, :old.shape[1] - 1] = old[:kept, :-1]
+                else:
+                    array[:kept] = old[:kept]
+                array[blocks] = new
+            setattr(prefilter, name, array)
+        return prefilter
+
+    @staticmethod
+    def _present(blocks: int, block_of: np.ndarray, codes: np.ndarray, size: int) -> np.ndarray:
+        """(blocks, size) matrix of which codes occur in each block."""
+        present = np.zeros((blocks, size + 1), dtype=bool)
+        known = codes >= 0
+        present[block_of[known], codes[known]] = True
+        # The extra column stands for "no such value" and is never set
+        return present
+
+    def __len__(self):
+        return len(self.starts)
+
+    def block(self, b: int) -> slice:
+        """Catalog slice of block b."""
+        start = self.starts[b]
+        return slice(start, start + self.block_size)
+
+    def score_bounds(self, context, category_scores: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Upper bound of the score of every gift in each block.
+
+        Args:
+            context: ScoringContext with a base score
+            category_scores: Base score of the gifts of each category code,
+                when it depends on the category (default: context.base_score
+                for every gift)
+
+        Returns:
+            Array of bounds, one per block
+        """
+        catalog = self.catalog
+        bonus = _closeness(self.price_low, self.price_high, context.budget) * 20
+
+        traits = [context.personality, context.technical, context.creative,
+                  context.managerial, context.academic]
+        closeness = _closeness(self.traits_low, self.traits_high, np.array(traits))
+        bonus += closeness @ TRAIT_WEIGHTS
+
+        code = catalog.occasions.lookup(context.occasion) if context.occasion else -1
+        if code >= 0:
+            bonus += np.where((self.occasions & np.uint64(1 << code)) != 0, 10.0, 0.0)
+
+        code = catalog.styles.lookup(context.style) if context.style else -1
+        bonus += np.where(self.styles[:, code], 8.0, 0.0)
+
+        gender_match = (
+            self.genders[:, catalog.genders.lookup('neutral')] |
+            self.genders[:, catalog.genders.lookup(context.gender)]
+        )
+        bonus += np.where(gender_match, 5.0, 0.0)
+
+        bonus += _closeness(self.relationship_low, self.relationship_high, context.relationship) * 7
+        bonus += self.age_bonus[AGE_BANDS.index(context.age_band)]
+
+        base_score = context.base_score
+        if category_scores is not None:
+            # Highest base score among the categories present in each block
+            present = self.categories[:, :len(category_scores)]
+            base_score = np.where(present, category_scores, -np.inf).max(axis=1)
+
+        bounds = np.minimum(100, base_score + bonus + BOUND_EPSILON)
+        # Invalid gifts score 0
+        bounds[self.any_invalid] = np.maximum(bounds[self.any_invalid], 0.0)
+        bounds[self.all_invalid] = 0.0
+        return bounds
+
+    def gift_bounds(self, bounds: np.ndarray) -> np.ndarray:
+        """Spread per-block bounds to every gift of the block."""
+        sizes = np.diff(np.append(self.starts, len(self.catalog)))
+        return np.repeat(bounds, sizes)
+
+    def scan(
+        self,
+        bounds: np.ndarray,
+        k: int,
+        score_block: Callable[[slice], np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the top k gifts, scoring only blocks that can still reach them.
+
+        Gifts rank by descending score, then by catalog index.
+
+        Args:
+            bounds: Upper bound of the scores in each block
+            k: Number of gifts to return
+            score_block: Returns the scores of the gifts in a block slice
+
+        Returns:
+            Tuple of (catalog indices, scores) for the top k gifts
+        """
+        indices = np.empty(0, dtype=np.intp)
+        scores = np.empty(0, dtype=np.float64)
+        k = max(0, min(k, len(self.catalog)))
+
+        for b in np.lexsort((self.starts, -bounds)).tolist():
+            if k == 0:
+                break
+            if len(indices) == k:
+                threshold = scores[-1]
+                if bounds[b] < threshold:
+                    break
+                # A gift scoring exactly the threshold only enters the top k
+                # if it comes earlier in the catalog; later blocks with the
+                # same bound come later still
+                if bounds[b] == threshold and self.starts[b] > indices[-1]:
+                    break
+
+            block = self.block(b)
+            block_scores = score_block(block)
+            indices = np.concatenate([indices, np.arange(block.start, block.start + len(block_scores))])
+            scores = np.concatenate([scores, block_scores])
+
+            order = np.lexsort((indices, -scores))[:k]
+            indices, scores = indices[order], scores[order]
+
+        return indices, scores
+
+    def select(
+        self,
+        bounds: np.ndarray,
+        k: int,
+        score_gifts: Callable[[np.ndarray], Tuple[np.ndarray, ...]]
+    ) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        Find the top k gifts using a separate upper bound for every gift.
+
+        The block_size best-bounded gifts are scored first to establish the
+        k-th best score; then only the other gifts whose bound reaches it
+        are scored. Gifts rank by their keys (each descending, the first key
+        primary), then by catalog index.
+
+        Args:
+            bounds: Upper bound of the first key of every gift
+            k: Number of gifts to return
+            score_gifts: Returns the key arrays of the gifts at some indices
+
+        Returns:
+            Tuple of (catalog indices, key arrays) for the top k gifts
+        """
+        n = len(bounds)
+        k = max(0, min(k, n))
+        first = min(n, max(k, self.block_size))
+        if first < n:
+            indices = np.sort(np.argpartition(-bounds, first - 1)[:first])
+        else:
+            indices = np.arange(n)
+        keys = list(score_gifts(indices))
+
+        if k > 0:
+            ranking = np.lexsort([indices] + [-key for key in reversed(keys)])
+            threshold = keys[0][ranking[k - 1]]
+            rest = np.flatnonzero(bounds >= threshold)
+            rest = rest[~np.isin(rest, indices, assume_unique=True)]
+            if len(rest):
+                indices = np.concatenate([indices, rest])
+                keys = [np.concatenate([kept, new]) for kept, new in zip(keys, score_gifts(rest))]
+
+        order = np.lexsort([indices] + [-key for key in reversed(keys)])[:k]
+        return indices[order], [key[order] for key in keys]
@@ -0,0 +1,125 @@
+"""
+Request Profiling
+=================
+Opt-in cProfile traces of the scoring work of single requests. Requests are
+profiled when they are sampled (FUZZY_PROFILE_RATE) or ask for it with the
+X-Profile header and the admin token; the hottest functions of each trace are kept in a bounded
+in-memory ring buffer, retrievable at /api/admin/profiles.
+
+Only the scoring call that runs on the scoring thread is profiled, so traces
+show where the engine spends its time and unprofiled requests pay nothing
+but one random number.
+
+Configuration (environment variables):
+- FUZZY_PROFILE_RATE: Share of requests to profile, 0 to 1; 0 only profiles
+  requests sent with the X-Profile header (default: 0)
+- FUZZY_PROFILE_BUFFER: Profiles kept, oldest dropped first (default: 50)
+- FUZZY_PROFILE_TOP: Hot functions kept per profile (default: 25)
+"""
+
+import cProfile
+import functools
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+class RequestProfiler:
+    """Decides which requests to profile and keeps their summaries."""
+
+    def __init__(self, rate: float, capacity: int, top: int):
+        """
+        Args:
+            rate: Share of requests to sample, 0 to 1
+            capacity: Profiles kept in the ring buffer
+            top: Hot functions kept per profile
+        """
+        self.rate = rate
+        self.top = top
+        self.profiles = 0
+        self._buffer: deque = deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def should_profile(self, requested: bool = False) -> Optional[str]:
+        """
+        Return why a request should be profiled, or None to run it normally.
+
+        Args:
+            requested: The request asked to be profiled
+        """
+        if requested:
+            return 'header'
+        if self.rate > 0 and random.random() < self.rate:
+            return 'sample'
+        return None
+
+    def wrap(self, func: Callable, endpoint: str, trigger: str) -> Callable:
+        """
+        Wrap a scoring call so it runs under cProfile and records its summary.
+
+        The wrapped function must be called on the thread doing the work,
+        e.g. by passing it to the scoring executor.
+
+        Args:
+            func: Scoring call to profile
+            endpoint: Endpoint the call belongs to
+            trigger: Why the request is profiled ('header' or 'sample')
+        """
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                self._record(profile, endpoint, trigger, time.perf_counter() - start)
+        return profiled
+
+    def _record(self, profile: cProfile.Profile, endpoint: str, trigger: str, seconds: float):
+        stats = pstats.Stats(profile)
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        hot_functions = [
+            {
+                'function': pstats.func_std_string(function),
+                'calls': calls,
+                'self_ms': round(self_time * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            }
+            for function, (_, calls, self_time, cumulative, _) in entries[:self.top]
+        ]
+        with self._lock:
+            self.profiles += 1
+            self._buffer.append({
+                'id': next(self._ids),
+                'endpoint': endpoint,
+                'trigger': trigger,
+                'timestamp': time.time(),
+                'duration_ms': round(seconds * 1000, 3),
+                'hot_functions': hot_functions,
+            })
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the kept profiles, newest first."""
+        with self._lock:
+            profiles = list(reversed(self._buffer))
+        return profiles[:limit] if limit is not None else profiles
+
+    def clear(self):
+        """Drop every kept profile."""
+        with self._lock:
+            self._buffer.clear()
+
+    @classmethod
+    def from_env(cls) -> 'RequestProfiler':
+        """Create a profiler configured by the FUZZY_PROFILE_* environment variables."""
+        return cls(
+            rate=min(1.0, max(0.0, float(os.environ.get('FUZZY_PROFILE_RATE', 0)))),
+            capacity=max(1, int(os.environ.get('FUZZY_PROFILE_BUFFER', 50))),
+            top=max(1, int(os.environ.get('FUZZY_PROFILE_TOP', 25)))
+        )
@@ -0,0 +1,290 @@
+"""
+Columnar Gift Records
+=====================
+Stores the gift dictionaries of gifts.json as flat arrays, so a catalog
+artifact can be memory-mapped read-only instead of parsing the JSON into
+nested dictionaries in every process.
+
+Numeric and dictionary-encoded fields are read from the GiftCatalog columns
+(price, traits, category/style/gender codes). The rest is stored next to
+them:
+- An offset-indexed UTF-8 string heap with the free-text fields of every
+  gift (STRING_FIELDS), row after row
+- The occasion codes of every gift in their original order (the catalog's
+  occasion bitmask loses the order), indexed by per-gift offsets
+
+Gifts the columns cannot reproduce exactly (invalid gifts, extra keys, a
+non-lowercase gender) keep their full JSON in the 'overflow' string field.
+
+GiftView is a read-only gift that reads its fields from such a sequence on
+access, optionally carrying a score, so ranked results don't copy gift
+dictionaries.
+"""
+
+import copy
+import json
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+
+from catalog import TRAIT_NAMES
+
+# Free-text fields of a gift, in heap order; 'overflow' holds the JSON of
+# gifts that cannot be rebuilt from the columns
+STRING_FIELDS = ['id', 'name', 'description', 'image_url', 'amazon_link', 'overflow']
+
+# Top-level keys of a gift, in gifts.json order
+GIFT_KEYS = ['id', 'name', 'category', 'description', 'price_range', 'image_url', 'amazon_link', 'attributes']
+
+
+def _number(value: float) -> Union[int, float]:
+    """Return integral values as int, as they are written in gifts.json."""
+    return int(value) if value.is_integer() else value
+
+
+class StringHeap:
+    """
+    Strings packed into one UTF-8 byte array.
+
+    String i is heap[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, offsets: np.ndarray, heap: np.ndarray):
+        self.offsets = offsets
+        self.heap = heap
+
+    @classmethod
+    def from_strings(cls, strings: List[str]) -> 'StringHeap':
+        """Pack a list of strings into a heap."""
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        heap = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(offsets, heap)
+
+    def __getitem__(self, i: int) -> str:
+        return self.heap[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class GiftRecords(Sequence):
+    """
+    Read-only sequence of gift dictionaries backed by arrays.
+
+    Drop-in replacement for the list of gifts loaded from gifts.json:
+    ``records[i]`` builds a new dictionary for gift i, equal to the one in
+    the JSON file, so callers may modify it freely.
+    """
+
+    # Arrays stored in addition to the GiftCatalog columns
+    ARRAYS = ['string_offsets', 'string_heap', 'occasion_offsets', 'occasion_codes']
+
+    def __init__(self, arrays: Dict[str, np.ndarray], vocabularies: Dict[str, List[str]]):
+        """
+        Args:
+            arrays: GiftCatalog columns plus every array in ARRAYS (used
+                as-is, not copied)
+            vocabularies: Values of every GiftCatalog vocabulary
+        """
+        self.arrays = arrays
+        self.vocabularies = vocabularies
+        self.strings = StringHeap(arrays['string_offsets'], arrays['string_heap'])
+
+    @classmethod
+    def encode(cls, catalog, gifts: List[Dict]) -> Dict[str, np.ndarray]:
+        """
+        Convert gift dictionaries into record arrays.
+
+        Args:
+            catalog: GiftCatalog compiled from gifts
+            gifts: Gift dictionaries, in catalog order
+
+        Returns:
+            Every array in ARRAYS by name
+        """
+        occasion_lists = []
+        for i, gift in enumerate(gifts):
+            codes = []
+            if catalog.valid[i]:
+                codes = [catalog.occasions.lookup(o) for o in gift['attributes']['occasions']]
+            occasion_lists.append(codes)
+
+        occasion_offsets = np.zeros(len(gifts) + 1, dtype=np.int64)
+        np.cumsum([len(codes) for codes in occasion_lists], out=occasion_offsets[1:])
+        occasion_codes = np.array(
+            [code for codes in occasion_lists for code in codes], dtype=np.uint8
+        )
+
+        strings = []
+        for gift in gifts:
+            strings.extend(str(gift.get(field, '')) for field in STRING_FIELDS[:-1])
+            strings.append('')
+        heap = StringHeap.from_strings(strings)
+        arrays = dict(catalog.columns(), string_offsets=heap.offsets, string_heap=heap.heap,
+                      occasion_offsets=occasion_offsets, occasion_codes=occasion_codes)
+
+        # Gifts that don't round-trip through the columns are kept as JSON
+        records = cls(arrays, catalog.vocabularies())
+        overflow = [i for i, gift in enumerate(gifts) if not catalog.valid[i] or records[i] != gift]
+        if overflow:
+            column = STRING_FIELDS.index('overflow')
+            for i in overflow:
+                strings[i * len(STRING_FIELDS) + column] = json.dumps(gifts[i])
+            heap = StringHeap.from_strings(strings)
+
+        return {
+            'string_offsets': heap.offsets,
+            'string_heap': heap.heap,
+            'occasion_offsets': occasion_offsets,
+            'occasion_codes': occasion_codes,
+        }
+
+    def _string(self, i: int, field: str) -> str:
+        return self.strings[i * len(STRING_FIELDS) + STRING_FIELDS.index(field)]
+
+    def ids(self) -> List[str]:
+        """Return the id of every gift, without building the dictionaries."""
+        return [self._string(i, 'id') for i in range(len(self))]
+
+    @classmethod
+    def from_catalog(cls, catalog, gifts: List[Dict]) -> 'GiftRecords':
+        """
+        Pack gift dictionaries into in-memory records sharing the catalog's columns.
+
+        Args:
+            catalog: GiftCatalog compiled from gifts
+            gifts: Gift dictionaries, in catalog order
+        """
+        arrays = dict(catalog.columns(), **cls.encode(catalog, gifts))
+        return cls(arrays, catalog.vocabularies())
+
+    def __len__(self):
+        return len(self.arrays['price_range'])
+
+    def _index(self, i: int) -> int:
+        if not isinstance(i, (int, np.integer)):
+            raise TypeError(f"GiftRecords indices must be integers, not {type(i).__name__}")
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("gift index out of range")
+        return int(i)
+
+    def keys(self, i: int) -> List[str]:
+        """Return the top-level keys of gift i, without building the dictionary."""
+        i = self._index(i)
+        overflow = self._string(i, 'overflow')
+        return list(json.loads(overflow)) if overflow else list(GIFT_KEYS)
+
+    def field(self, i: int, key: str) -> Any:
+        """
+        Return one top-level field of gift i, without building the dictionary.
+
+        Raises:
+            KeyError: If the gift has no such field
+        """
+        i = self._index(i)
+        overflow = self._string(i, 'overflow')
+        if overflow:
+            return json.loads(overflow)[key]
+        if key in STRING_FIELDS[:-1]:
+            return self._string(i, key)
+        if key == 'category':
+            return self.vocabularies['categories'][self.arrays['category_codes'][i]]
+        if key == 'price_range':
+            return _number(float(self.arrays['price_range'][i]))
+        if key == 'attributes':
+            return self._attributes(i)
+        raise KeyError(key)
+
+    def __getitem__(self, i: int) -> Dict:
+        i = self._index(i)
+        overflow = self._string(i, 'overflow')
+        if overflow:
+            return json.loads(overflow)
+
+        vocabularies = self.vocabularies
+        return {
+            'id': self._string(i, 'id'),
+            'name': self._string(i, 'name'),
+            'category': vocabularies['categories'][self.arrays['category_codes'][i]],
+            'description': self._string(i, 'description'),
+            'price_range': _number(float(self.arrays['price_range'][i])),
+            'image_url': self._string(i, 'image_url'),
+            'amazon_link': self._string(i, 'amazon_link'),
+            'attributes': self._attributes(i),
+        }
+
+    def _attributes(self, i: int) -> Dict:
+        arrays = self.arrays
+        vocabularies = self.vocabularies
+        start, stop = arrays['occasion_offsets'][i], arrays['occasion_offsets'][i + 1]
+        attributes = {'gender': vocabularies['genders'][arrays['gender_codes'][i]]}
+        for j, trait in enumerate(TRAIT_NAMES):
+            attributes[trait] = _number(float(arrays['traits'][i, j]))
+        attributes['style'] = vocabularies['styles'][arrays['style_codes'][i]]
+        attributes['occasions'] = [
+            vocabularies['occasions'][code] for code in arrays['occasion_codes'][start:stop].tolist()
+        ]
+        attributes['relationship_score'] = _number(float(arrays['relationship_score'][i]))
+        return attributes
+
+
+class GiftView(Mapping):
+    """
+    Read-only gift of a catalog, read field by field on access.
+
+    Equal to the gift dictionary (plus 'fuzzy_score' when scored), so it can
+    be used wherever a gift dictionary is read. Nested values are returned
+    as copies, the catalog cannot be modified through a view.
+    """
+
+    __slots__ = ('gifts', 'index', 'score')
+
+    def __init__(self, gifts: Sequence, index: int, score: Optional[float] = None):
+        """
+        Args:
+            gifts: Gift sequence of a catalog (GiftRecords, GiftOverlay or a
+                list of dictionaries)
+            index: Catalog index of the gift
+            score: Score exposed as 'fuzzy_score', None for none
+        """
+        self.gifts = gifts
+        self.index = index
+        self.score = score
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'fuzzy_score' and self.score is not None:
+            return self.score
+        if hasattr(self.gifts, 'field'):
+            return self.gifts.field(self.index, key)
+        return copy.deepcopy(self.gifts[self.index][key])
+
+    def _keys(self) -> List[str]:
+        if hasattr(self.gifts, 'keys'):
+            keys = self.gifts.keys(self.index)
+        else:
+            keys = list(self.gifts[self.index])
+        if self.score is not None and 'fuzzy_score' not in keys:
+            keys.append('fuzzy_score')
+        return keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def to_dict(self) -> Dict:
+        """Return the gift (with its fuzzy_score) as a new dictionary."""
+        gift = self.gifts[self.index]
+        gift = copy.deepcopy(gift) if isinstance(self.gifts, list) else dict(gift)
+        if self.score is not None:
+            gift['fuzzy_score'] = self.score
+        return gift
+
+    def __repr__(self):
+        return f"GiftView({self.to_dict()!r})"
@@ -0,0 +1,116 @@
+"""
+Catalog Hot Reload
+==================
+Reloads gifts.json while the server keeps answering requests. The new
+catalog, its artifact, indexes and prefilter are built on a background
+thread and then swapped in atomically (see
+GiftRecommendationFuzzySystem.set_catalog); requests already running finish
+against the catalog they started with.
+
+Configuration (environment variables):
+- FUZZY_CATALOG_WATCH: Seconds between checks of gifts.json for changes,
+  0 disables watching (default: 0)
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogReloader:
+    """
+    Runs catalog reloads one at a time, on demand or when the file changes.
+
+    Reloads never run on a scoring thread, so they don't take capacity away
+    from requests.
+    """
+
+    def __init__(self, system, gifts_path: str, interval: float):
+        """
+        Args:
+            system: GiftRecommendationFuzzySystem to reload
+            gifts_path: JSON catalog to load
+            interval: Seconds between file checks, 0 to only reload on demand
+        """
+        self.system = system
+        self.gifts_path = gifts_path
+        self.interval = interval
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._signature = self._file_signature()
+
+    def _file_signature(self) -> Optional[Tuple[float, int]]:
+        """Modification time and size of the catalog file, None if missing."""
+        try:
+            stat = os.stat(self.gifts_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def reload(self) -> Dict[str, Any]:
+        """
+        Load the catalog file and swap it in; blocks until it is in use.
+
+        Raises:
+            Exception: Whatever loading the catalog raised; the current
+                catalog stays in place
+        """
+        with self._lock:
+            signature = self._file_signature()
+            try:
+                snapshot = self.system.reload_catalog(self.gifts_path)
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            self._signature = signature
+            self.reloads += 1
+            self.last_error = None
+        logger.info(f"Catalog reloaded: version {snapshot.version}, {len(snapshot.catalog)} gifts")
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        """Return the catalog in use and the reload counters."""
+        snapshot = self.system.snapshot
+        return {
+            'version': snapshot.version,
+            'count': len(snapshot.catalog),
+            'reloads': self.reloads,
+            'watching': self._thread is not None,
+            'last_error': self.last_error,
+        }
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            if self._file_signature() == self._signature:
+                continue
+            try:
+                self.reload()
+            except Exception as e:
+                # Retried on the next change of the file
+                logger.error(f"Error reloading catalog: {str(e)}")
+                self._signature = self._file_signature()
+
+    def start(self):
+        """Start watching the catalog file, if an interval is configured."""
+        if self.interval > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name='catalog-watch', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop watching the catalog file."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    @classmethod
+    def from_env(cls, system, gifts_path: str) -> 'CatalogReloader':
+        """Create a reloader configured by the FUZZY_CATALOG_WATCH environment variable."""
+        return cls(system, gifts_path, interval=float(os.environ.get('FUZZY_CATALOG_WATCH', 0)))
@@ -0,0 +1,213 @@
+"""
+Pre-rendered Responses
+======================
+Serializes the static part of every gift's API responses once per catalog,
+so the hot endpoints assemble their JSON from bytes instead of building,
+validating and encoding a Pydantic model per gift on every request.
+
+GiftFragments keeps, for each gift of a catalog:
+- Its ImageInfo object (generate-image-pairs)
+- Its FinalImageInfo object (generate-final-images), split around the
+  fuzzy_score, which is written per request
+- Its full dictionary (/api/gifts)
+
+The fragments are validated by the response models when they are rendered,
+so the responses are the same as the models would produce. A gift that
+cannot be rendered (the models reject it, or orjson cannot encode it) has
+no fragment and is serialized the regular way by the requests returning
+it, failing them only where that fails too.
+
+JSON is encoded with orjson.
+"""
+
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+from models import FinalImageInfo, ImageInfo
+
+# Errors of a gift that cannot be pre-rendered; it is serialized per request
+_RENDER_ERRORS = (KeyError, TypeError, ValidationError, orjson.JSONEncodeError)
+
+# Fields of FinalImageInfo before and after its fuzzy_score
+_FINAL_FIELDS = list(FinalImageInfo.model_fields)
+_SCORE_POSITION = _FINAL_FIELDS.index('fuzzy_score')
+
+
+def image_info(gift: Dict) -> ImageInfo:
+    """Return the ImageInfo of a gift."""
+    return ImageInfo(
+        path=gift.get('image_url', 'placeholder.jpg'),
+        value=gift['id'],
+        name=gift['name'],
+        description=gift['description'],
+        amazon_link=gift.get('amazon_link', '')
+    )
+
+
+def final_image_info(gift: Dict) -> FinalImageInfo:
+    """Return the FinalImageInfo of a scored gift, its score rounded to 2 digits."""
+    return FinalImageInfo(
+        path=gift.get('image_url', 'placeholder.jpg'),
+        value=gift['id'],
+        name=gift['name'],
+        description=gift['description'],
+        category=gift['category'],
+        fuzzy_score=round(gift['fuzzy_score'], 2),
+        amazon_link=gift.get('amazon_link', '')
+    )
+
+
+def _render_final(gift: Dict) -> Tuple[bytes, bytes]:
+    """Return the FinalImageInfo JSON of a gift before and after its score."""
+    fields = final_image_info(dict(gift, fuzzy_score=0.0)).model_dump()
+    before = {key: fields[key] for key in _FINAL_FIELDS[:_SCORE_POSITION]}
+    after = {key: fields[key] for key in _FINAL_FIELDS[_SCORE_POSITION + 1:]}
+    head = orjson.dumps(before)[:-1] + b',"fuzzy_score":'
+    tail = b',' + orjson.dumps(after)[1:] if after else b'}'
+    return head, tail
+
+
+class GiftFragments:
+    """
+    Pre-rendered JSON fragments of every gift of a catalog.
+
+    Fragments are never modified once built; updating a catalog builds new
+    lists sharing the bytes of the unchanged gifts.
+
+    Attributes:
+        images: ImageInfo JSON of each gift, None if the model rejects it
+        finals: FinalImageInfo JSON of each gift before and after its
+            fuzzy_score, None likewise
+        gifts: JSON of each gift dictionary, None if orjson cannot encode it
+    """
+
+    __slots__ = ('images', 'finals', 'gifts')
+
+    def __init__(
+        self,
+        images: List[Optional[bytes]],
+        finals: List[Optional[Tuple[bytes, bytes]]],
+        gifts: List[Optional[bytes]]
+    ):
+        self.images = images
+        self.finals = finals
+        self.gifts = gifts
+
+    @classmethod
+    def of(cls, gifts: Sequence[Dict]) -> 'GiftFragments':
+        """Render the fragments of every gift of a catalog."""
+        fragments = cls([], [], [])
+        for i in range(len(gifts)):
+            fragments._append(gifts[i])
+        return fragments
+
+    def updated(self, gifts: Sequence[Dict], changed) -> 'GiftFragments':
+        """
+        Return the fragments of an updated catalog, rendering only its changed gifts.
+
+        Args:
+            gifts: Gift dictionaries of the updated catalog
+            changed: Indices of the rows whose gift changed, see
+                GiftCatalog.updated
+        """
+        length = len(gifts)
+        fragments = GiftFragments(self.images[:length], self.finals[:length], self.gifts[:length])
+        for i in sorted(int(i) for i in changed):
+            gift = gifts[i]
+            if i < len(fragments.gifts):
+                fragments.images[i], fragments.finals[i], fragments.gifts[i] = self._render(gift)
+            else:
+                fragments._append(gift)
+        return fragments
+
+    def _append(self, gift: Dict):
+        image, final, data = self._render(gift)
+        self.images.append(image)
+        self.finals.append(final)
+        self.gifts.append(data)
+
+    @staticmethod
+    def _render(gift: Dict) -> Tuple[Optional[bytes], Optional[Tuple[bytes, bytes]], Optional[bytes]]:
+        try:
+            image = orjson.dumps(image_info(gift).model_dump())
+        except _RENDER_ERRORS:
+            image = None
+        try:
+            final = _render_final(gift)
+        except _RENDER_ERRORS:
+            final = None
+        try:
+            data = orjson.dumps(gift)
+        except _RENDER_ERRORS:
+            data = None
+        return image, final, data
+
+    def __len__(self):
+        return len(self.gifts)
+
+
+def image_pairs_json(pairs: Sequence, session_id: Optional[str]) -> bytes:
+    """
+    Encode a GenerateImagePairsResponse.
+
+    Args:
+        pairs: Pairs of ranked gifts, see GiftRecommendationFuzzySystem.start_session
+        session_id: Session ID, or None
+    """
+    rendered = []
+    for pair in pairs:
+        images = pair.fragments.images if pair.fragments is not None else None
+        rendered.append(b'[' + b','.join(
+            images[index] if images is not None and images[index] is not None
+            else orjson.dumps(image_info(gift).model_dump())
+            for index, gift in zip(pair.indices.tolist(), pair)
+        ) + b']')
+    return (b'{"imagePairs":[' + b','.join(rendered) + b'],"sessionId":'
+            + orjson.dumps(session_id) + b'}')
+
+
+def final_images_json(ranked) -> bytes:
+    """
+    Encode a GenerateFinalImagesResponse.
+
+    Args:
+        ranked: Ranked gifts with their fuzzy_score, see
+            GiftRecommendationFuzzySystem.refine_recommendations
+    """
+    finals = ranked.fragments.finals if ranked.fragments is not None else None
+    rendered = []
+    for i, (index, score) in enumerate(zip(ranked.indices.tolist(), ranked.scores.tolist())):
+        final = finals[index] if finals is not None else None
+        if final is None:
+            rendered.append(orjson.dumps(final_image_info(ranked[i]).model_dump()))
+        else:
+            rendered.append(final[0] + orjson.dumps(round(score, 2)) + final[1])
+    return b'{"finalImages":[' + b','.join(rendered) + b']}'
+
+
+def gift_json(fragments: GiftFragments, gifts: Sequence[Dict], index: int) -> bytes:
+    """
+    Encode one gift of a catalog, as /api/gifts/{gift_id} returns it.
+
+    Args:
+        fragments: Pre-rendered fragments of the catalog
+        gifts: Gift dictionaries of the catalog, encoded the regular way
+            when a gift has no fragment
+        index: Catalog index of the gift
+    """
+    data = fragments.gifts[index]
+    if data is None:
+        data = json.dumps(
+            jsonable_encoder(gifts[index]), ensure_ascii=False, allow_nan=False, separators=(',', ':')
+        ).encode('utf-8')
+    return data
+
+
+def gifts_json(fragments: GiftFragments, gifts: Sequence[Dict], indices: Sequence[int]) -> bytes:
+    """Encode the /api/gifts listing of some gifts of a catalog, see gift_json."""
+    return (b'{"gifts":[' + b','.join(gift_json(fragments, gifts, i) for i in indices)
+            + b'],"count":' + str(len(indices)).encode() + b'}')
@@ -0,0 +1,505 @@
+"""
+Declarative Rule Base
+=====================
+Loads the fuzzy controller's variables, membership functions and rules from
+a JSON file (data/rules.json), validates them and compiles them into a
+CompiledFuzzyEngine, so tuning the controller needs no code change.
+
+File layout::
+
+    {
+      "inputs": {"<variable>": {"universe": [min, max, step],
+                                "terms": {"<term>": ["trapmf", [a, b, c, d]], ...}}, ...},
+      "output": {"<variable>": {...same as an input...}},
+      "rules": [{"if": [["<variable>", "<term>"], ...], "then": "<output term>",
+                 "weight": 1.0, "group": "<optional label>"}, ...],
+      "controllers": {"<name>": {"categories": ["<gift category>", ...],
+                                 "groups": ["<rule group>", ...],
+                                 "rules": [...]}, ...}
+    }
+
+Membership functions are scikit-fuzzy's trimf [a, b, c] and trapmf
+[a, b, c, d], computed identically. Antecedents of a rule are AND-ed.
+
+The top-level rules form the default controller. The optional controllers
+score the gifts of their categories instead: a controller's rules are the
+top-level rules of the listed groups, followed by its own rules. Every
+controller shares the variables, so all of them are evaluated in a single
+pass (see inference.py).
+
+Before compiling, rules that can never change the output are dropped:
+duplicates of an earlier rule (same antecedents and output term, the kept
+rule gets the larger weight) are merged, and dead rules (zero weight, an
+antecedent that is never active, contradicting antecedents, or rules whose
+antecedents include every antecedent of a rule with the same output term
+and at least the same weight) are reported and removed. Neither changes
+the result of max accumulation. Controllers are analyzed separately; the
+positions reported for a controller count its group rules first.
+
+Configuration (environment variables):
+- FUZZY_RULES_PATH: Rule base file (default: data/rules.json)
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from inference import DEFAULT_CONTROLLER, CompiledFuzzyEngine
+
+RULES_PATH = os.environ.get(
+    'FUZZY_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'rules.json')
+)
+
+
+def trimf(x: np.ndarray, abc) -> np.ndarray:
+    """Triangular membership function, as skfuzzy.trimf."""
+    a, b, c = abc
+    y = np.zeros(len(x))
+    if a != b:
+        idx = np.nonzero(np.logical_and(a < x, x < b))[0]
+        y[idx] = (x[idx] - a) / float(b - a)
+    if b != c:
+        idx = np.nonzero(np.logical_and(b < x, x < c))[0]
+        y[idx] = (c - x[idx]) / float(c - b)
+    y[np.nonzero(x == b)] = 1
+    return y
+
+
+def trapmf(x: np.ndarray, abcd) -> np.ndarray:
+    """Trapezoidal membership function, as skfuzzy.trapmf."""
+    a, b, c, d = abcd
+    y = np.ones(len(x))
+    idx = np.nonzero(x <= b)[0]
+    y[idx] = trimf(x[idx], (a, b, b))
+    idx = np.nonzero(x >= c)[0]
+    y[idx] = trimf(x[idx], (c, c, d))
+    y[np.nonzero(x < a)[0]] = 0
+    y[np.nonzero(x > d)[0]] = 0
+    return y
+
+
+# Membership function name -> (number of parameters, function)
+MEMBERSHIP_FUNCTIONS = {
+    'trimf': (3, trimf),
+    'trapmf': (4, trapmf),
+}
+
+
+@dataclass(frozen=True)
+class FuzzyVariable:
+    """A variable with its universe and named membership functions."""
+    name: str
+    universe: np.ndarray
+    terms: Dict[str, Tuple[str, Tuple[float, ...]]]
+
+    def tables(self) -> Dict[str, np.ndarray]:
+        """Membership table of every term over the universe."""
+        return {
+            term: MEMBERSHIP_FUNCTIONS[kind][1](self.universe, params)
+            for term, (kind, params) in self.terms.items()
+        }
+
+
+@dataclass(frozen=True)
+class Rule:
+    """Antecedents (variable, term) AND-ed together, activating an output term."""
+    antecedents: Tuple[Tuple[str, str], ...]
+    consequent: str
+    weight: float = 1.0
+    group: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Controller:
+    """Rules scoring the gifts of some categories instead of the default rules."""
+    name: str
+    categories: Tuple[str, ...]
+    rules: List[Rule]
+
+
+@dataclass
+class RuleReport:
+    """
+    Outcome of the rule analysis.
+
+    Attributes:
+        rules: Rules left to compile, in file order
+        merged: (rule, earlier rule it was merged into) file positions
+        dead: (rule, reason) for the rules dropped as dead
+        controllers: Analysis of each category controller, by name
+    """
+    rules: List[Rule]
+    merged: List[Tuple[int, int]] = field(default_factory=list)
+    dead: List[Tuple[int, str]] = field(default_factory=list)
+    controllers: Dict[str, 'RuleReport'] = field(default_factory=dict)
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-friendly counts and details, rule positions starting at 1."""
+        summary = {
+            'rules': len(self.rules),
+            'merged': [{'rule': rule + 1, 'into': into + 1} for rule, into in self.merged],
+            'dead': [{'rule': rule + 1, 'reason': reason} for rule, reason in self.dead],
+        }
+        if self.controllers:
+            summary['controllers'] = {
+                name: report.summary() for name, report in self.controllers.items()
+            }
+        return summary
+
+    def notices(self) -> List[str]:
+        """One line per merged or dead rule, of the default rules and each controller."""
+        lines = []
+        for owner, report in [('default rules', self)] + [
+            (f"controller {name!r}", report) for name, report in self.controllers.items()
+        ]:
+            lines.extend(f"{owner}: merged duplicate rule {rule + 1} into rule {into + 1}"
+                         for rule, into in report.merged)
+            lines.extend(f"{owner}: dropped dead rule {rule + 1} ({reason})" for rule, reason in report.dead)
+        return lines
+
+
+class RuleBase:
+    """Validated fuzzy variables, default rules and category controllers."""
+
+    def __init__(
+        self,
+        inputs: Dict[str, FuzzyVariable],
+        output: FuzzyVariable,
+        rules: List[Rule],
+        controllers: Optional[Dict[str, Controller]] = None
+    ):
+        self.inputs = inputs
+        self.output = output
+        self.rules = rules
+        self.controllers = controllers or {}
+
+    @property
+    def variables(self) -> Dict[str, FuzzyVariable]:
+        """Every input variable and the output variable, by name."""
+        return dict(self.inputs, **{self.output.name: self.output})
+
+    @classmethod
+    def load(cls, path: str = RULES_PATH) -> 'RuleBase':
+        """
+        Load and validate a rule base file.
+
+        Raises:
+            ValueError: If the file is not valid JSON or not a valid rule base
+        """
+        with open(path, 'r') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid rule base {path}: {e}")
+        return cls.from_dict(data, source=path)
+
+    @classmethod
+    def from_dict(cls, data: Dict, source: str = 'rule base') -> 'RuleBase':
+        """
+        Validate a parsed rule base; every problem is reported at once.
+
+        Raises:
+            ValueError: Listing the problems, if any
+        """
+        errors: List[str] = []
+        if not isinstance(data, dict):
+            raise ValueError(f"Invalid rule base {source}: expected a JSON object")
+
+        inputs = {}
+        for name, spec in _mapping(data.get('inputs'), 'inputs', errors).items():
+            variable = _variable(name, spec, errors)
+            if variable is not None:
+                inputs[name] = variable
+        outputs = _mapping(data.get('output'), 'output', errors)
+        if len(outputs) != 1:
+            errors.append("output: exactly one output variable is required")
+        output = None
+        for name, spec in outputs.items():
+            if name in inputs:
+                errors.append(f"output {name!r}: also defined as an input")
+            output = _variable(name, spec, errors)
+
+        rules = []
+        specs = data.get('rules')
+        if not isinstance(specs, list) or not specs:
+            errors.append("rules: a non-empty list of rules is required")
+            specs = []
+        for position, spec in enumerate(specs, start=1):
+            rule = _rule(f"rule {position}", spec, inputs, output, errors)
+            if rule is not None:
+                rules.append(rule)
+
+        controllers = {}
+        specs = data.get('controllers', {})
+        if not isinstance(specs, dict):
+            errors.append("controllers: expected an object of controllers by name")
+            specs = {}
+        owners: Dict[str, str] = {}
+        for name, spec in specs.items():
+            controller = _controller(name, spec, inputs, output, rules, owners, errors)
+            if controller is not None:
+                controllers[name] = controller
+
+        if errors:
+            raise ValueError(f"Invalid rule base {source}:\n- " + "\n- ".join(errors))
+        return cls(inputs, output, rules, controllers)
+
+    def analyze(self) -> RuleReport:
+        """Merge duplicate rules and drop dead ones, see the module docstring."""
+        tables = {name: variable.tables() for name, variable in self.inputs.items()}
+        report = self._analyze(self.rules, tables, "the rule base")
+        report.controllers = {
+            name: self._analyze(controller.rules, tables, f"controller {name!r}")
+            for name, controller in self.controllers.items()
+        }
+        return report
+
+    @classmethod
+    def _analyze(cls, rules: List[Rule], tables: Dict[str, Dict[str, np.ndarray]],
+                 owner: str) -> RuleReport:
+        """Analyze the rules of one controller."""
+        report = RuleReport(rules=[])
+        kept: List[Tuple[int, Rule]] = []
+
+        for position, rule in enumerate(rules):
+            reason = cls._dead_reason(rule, tables)
+            if reason is not None:
+                report.dead.append((position, reason))
+                continue
+            duplicate = next(
+                (i for i, (_, other) in enumerate(kept)
+                 if other.consequent == rule.consequent
+                 and set(other.antecedents) == set(rule.antecedents)),
+                None
+            )
+            if duplicate is None:
+                kept.append((position, rule))
+            else:
+                first, other = kept[duplicate]
+                kept[duplicate] = (first, Rule(other.antecedents, other.consequent,
+                                               max(other.weight, rule.weight), other.group))
+                report.merged.append((position, first))
+
+        # A rule is subsumed by a rule with fewer antecedents, the same
+        # output term and at least its weight: its strength never exceeds
+        # that rule's, so it never changes the max
+        subsumed = set()
+        for position, rule in kept:
+            for other_position, other in kept:
+                if (other_position != position and other_position not in subsumed
+                        and other.consequent == rule.consequent
+                        and set(other.antecedents) < set(rule.antecedents)
+                        and other.weight >= rule.weight):
+                    subsumed.add(position)
+                    report.dead.append((position, f"subsumed by rule {other_position + 1}"))
+                    break
+        report.dead.sort()
+        report.rules = [rule for position, rule in kept if position not in subsumed]
+        if not report.rules:
+            raise ValueError(f"Every rule of {owner} is dead")
+        return report
+
+    @staticmethod
+    def _dead_reason(rule: Rule, tables: Dict[str, Dict[str, np.ndarray]]) -> Optional[str]:
+        """Why a rule can never fire, or None if it can."""
+        if rule.weight <= 0:
+            return "zero weight"
+        for name, term in rule.antecedents:
+            if not tables[name][term].any():
+                return f"{name} {term} is never active"
+        for i, (name, term) in enumerate(rule.antecedents):
+            for other_name, other_term in rule.antecedents[i + 1:]:
+                if name == other_name and not np.minimum(tables[name][term], tables[name][other_term]).any():
+                    return f"{name} cannot be both {term} and {other_term}"
+        return None
+
+    def compile(self, report: Optional[RuleReport] = None) -> CompiledFuzzyEngine:
+        """
+        Compile the live rules of every controller into one inference engine.
+
+        Only input variables used by a live rule become engine inputs.
+
+        Args:
+            report: Analysis to compile (default: run analyze())
+        """
+        report = report or self.analyze()
+        reports = [report] + list(report.controllers.values())
+        used = {name for each in reports for rule in each.rules for name, _ in rule.antecedents}
+        inputs = {
+            name: (variable.universe, variable.tables())
+            for name, variable in self.inputs.items() if name in used
+        }
+        output = (self.output.name, self.output.universe, self.output.tables())
+
+        def compiled(rules: List[Rule]) -> List:
+            return [(list(rule.antecedents), rule.consequent, rule.weight) for rule in rules]
+
+        controllers = {name: compiled(each.rules) for name, each in report.controllers.items()}
+        return CompiledFuzzyEngine(inputs, output, compiled(report.rules), controllers)
+
+    def controller_of(self, category: str) -> int:
+        """
+        Engine controller index of a gift category: 0 (the default
+        controller) unless a controller lists the category.
+        """
+        for position, controller in enumerate(self.controllers.values(), start=1):
+            if category in controller.categories:
+                return position
+        return 0
+
+    def category_controllers(self, categories: Sequence[str]) -> np.ndarray:
+        """
+        Engine controller index of each category, see controller_of.
+
+        Args:
+            categories: Gift categories, e.g. a catalog vocabulary
+        """
+        return np.array([self.controller_of(category) for category in categories], dtype=np.intp)
+
+
+def _mapping(value, where: str, errors: List[str]) -> Dict:
+    if not isinstance(value, dict) or not value:
+        errors.append(f"{where}: a non-empty object is required")
+        return {}
+    return value
+
+
+def _variable(name: str, spec, errors: List[str]) -> Optional[FuzzyVariable]:
+    """Validate one variable, appending its problems to errors."""
+    where = f"variable {name!r}"
+    if not isinstance(spec, dict):
+        errors.append(f"{where}: expected an object with 'universe' and 'terms'")
+        return None
+
+    universe = spec.get('universe')
+    if (not isinstance(universe, list) or len(universe) != 3
+            or not all(_is_number(value) for value in universe)
+            or universe[2] <= 0 or universe[1] <= universe[0]):
+        errors.append(f"{where}: 'universe' must be [min, max, step] with min < max and step > 0")
+        return None
+    low, high, step = universe
+    values = np.arange(low, high + step / 2, step)
+
+    terms = {}
+    for term, definition in _mapping(spec.get('terms'), f"{where} terms", errors).items():
+        if (not isinstance(definition, list) or len(definition) != 2
+                or definition[0] not in MEMBERSHIP_FUNCTIONS):
+            errors.append(f"{where} term {term!r}: expected [function, parameters] with a "
+                          f"function among {sorted(MEMBERSHIP_FUNCTIONS)}")
+            continue
+        kind, params = definition
+        count = MEMBERSHIP_FUNCTIONS[kind][0]
+        if (not isinstance(params, list) or len(params) != count
+                or not all(_is_number(value) for value in params)
+                or any(a > b for a, b in zip(params, params[1:]))):
+            errors.append(f"{where} term {term!r}: {kind} takes {count} non-decreasing numbers")
+            continue
+        terms[term] = (kind, tuple(params))
+    return FuzzyVariable(name, values, terms)
+
+
+def _rule(where: str, spec, inputs: Dict[str, FuzzyVariable], output: Optional[FuzzyVariable],
+          errors: List[str]) -> Optional[Rule]:
+    """Validate one rule, appending its problems to errors."""
+    if not isinstance(spec, dict) or not set(spec) <= {'if', 'then', 'weight', 'group'}:
+        errors.append(f"{where}: expected an object with 'if', 'then' and optional 'weight' and 'group'")
+        return None
+
+    antecedents = spec.get('if')
+    if not isinstance(antecedents, list) or not antecedents:
+        errors.append(f"{where}: 'if' must be a non-empty list of [variable, term] pairs")
+        return None
+    valid = True
+    for antecedent in antecedents:
+        if not isinstance(antecedent, list) or len(antecedent) != 2:
+            errors.append(f"{where}: antecedent {antecedent!r} is not a [variable, term] pair")
+            valid = False
+        elif antecedent[0] not in inputs:
+            errors.append(f"{where}: unknown input variable {antecedent[0]!r}")
+            valid = False
+        elif antecedent[1] not in inputs[antecedent[0]].terms:
+            errors.append(f"{where}: unknown term {antecedent[1]!r} of {antecedent[0]!r}")
+            valid = False
+
+    consequent = spec.get('then')
+    if output is not None and consequent not in output.terms:
+        errors.append(f"{where}: unknown output term {consequent!r}")
+        valid = False
+    weight = spec.get('weight', 1.0)
+    if not _is_number(weight) or not 0 <= weight <= 1:
+        errors.append(f"{where}: 'weight' must be a number from 0 to 1")
+        valid = False
+
+    if not valid:
+        return None
+    return Rule(tuple((name, term) for name, term in antecedents), consequent,
+                float(weight), spec.get('group'))
+
+
+def _controller(name: str, spec, inputs: Dict[str, FuzzyVariable], output: Optional[FuzzyVariable],
+                rules: List[Rule], owners: Dict[str, str], errors: List[str]) -> Optional[Controller]:
+    """
+    Validate one category controller, appending its problems to errors.
+
+    Args:
+        rules: Valid top-level rules, whose groups the controller can list
+        owners: Category -> controller already listing it, updated
+    """
+    where = f"controller {name!r}"
+    if name == DEFAULT_CONTROLLER:
+        errors.append(f"{where}: the name is reserved for the top-level rules")
+        return None
+    if not isinstance(spec, dict) or not set(spec) <= {'categories', 'groups', 'rules'}:
+        errors.append(f"{where}: expected an object with 'categories' and 'groups' or 'rules'")
+        return None
+
+    valid = True
+    categories = spec.get('categories')
+    if (not isinstance(categories, list) or not categories
+            or not all(isinstance(category, str) for category in categories)):
+        errors.append(f"{where}: 'categories' must be a non-empty list of gift categories")
+        categories = []
+        valid = False
+    for category in categories:
+        if category in owners:
+            errors.append(f"{where}: category {category!r} is already scored by "
+                          f"controller {owners[category]!r}")
+            valid = False
+        owners.setdefault(category, name)
+
+    groups = spec.get('groups', [])
+    known = {rule.group for rule in rules if rule.group is not None}
+    if not isinstance(groups, list):
+        errors.append(f"{where}: 'groups' must be a list of rule groups")
+        groups = []
+        valid = False
+    for group in groups:
+        if group not in known:
+            errors.append(f"{where}: unknown rule group {group!r}")
+            valid = False
+    controller_rules = [rule for rule in rules if rule.group in groups]
+
+    specs = spec.get('rules', [])
+    if not isinstance(specs, list):
+        errors.append(f"{where}: 'rules' must be a list of rules")
+        specs = []
+        valid = False
+    for position, rule_spec in enumerate(specs, start=1):
+        rule = _rule(f"{where} rule {position}", rule_spec, inputs, output, errors)
+        if rule is None:
+            valid = False
+        else:
+            controller_rules.append(rule)
+
+    if valid and not controller_rules:
+        errors.append(f"{where}: at least one rule or rule group is required")
+        valid = False
+    return Controller(name, tuple(categories), controller_rules) if valid else None
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
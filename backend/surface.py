@@ -0,0 +1,415 @@
+"""
+Precomputed Score Surface
+=========================
+A lookup surface for the fuzzy base score, used instead of running the
+defuzzification for every request.
+
+The controller's eight inputs only reach the output through the
+activations of its output terms: each rule is a min over two memberships
+and each output term the max over its rules. That rule layer is evaluated
+exactly, it is a handful of piecewise linear lookups. The expensive part,
+the centroid of the clipped and accumulated output terms, only depends on
+the few term activations (three for the gift controller), so it is
+tabulated once over a grid of activations and interpolated multilinearly.
+The centroid does not depend on the rules, so the one surface serves every
+controller of an engine.
+
+The centroid is not continuous where every activation goes to zero, so
+activations are tabulated as (strongest activation m, every other
+activation divided by m), one table per strongest term. The centroid is
+smooth in those coordinates down to m -> 0, which keeps the error bounded
+everywhere. Run ``python surface.py`` to report the approximation error
+against skfuzzy's ControlSystemSimulation over a validation grid.
+
+Configuration (environment variables):
+- FUZZY_SCORE_SURFACE: Grid points per axis of the surface, e.g. 41; 0
+  runs the exact inference for every request. The surface is opt-in, as
+  its scores differ from the exact centroid by up to about 0.1, which can
+  reorder gifts whose scores are nearly tied (default: 0)
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from inference import CompiledFuzzyEngine, fill_controllers
+
+# Grid points per axis, 0 to disable the surface
+SURFACE_RESOLUTION = int(os.environ.get('FUZZY_SCORE_SURFACE', 0))
+
+# Strongest activation standing in for the m -> 0 limit at the first grid point
+LIMIT_ACTIVATION = 1e-6
+
+# Grid rows defuzzified at once while building a surface
+BUILD_CHUNK_ROWS = 8192
+
+# Offset of the validation grid values into their slice of the universe
+GRID_OFFSET = (3 - 5 ** 0.5) / 2
+
+
+class ScoreSurface:
+    """
+    Interpolated base score of a compiled engine, with the same compute,
+    compute_batch, compute_controllers and compute_controllers_batch
+    interface.
+
+    Stateless once built, so a single instance can be shared by any number
+    of threads.
+    """
+
+    def __init__(self, engine: CompiledFuzzyEngine, tables: np.ndarray):
+        """
+        Args:
+            engine: Engine whose rule layer computes the activations
+            tables: (output terms, resolution, ..., resolution) centroids, see build()
+        """
+        self.engine = engine
+        self.tables = np.ascontiguousarray(tables, dtype=np.float64)
+        self.terms = len(engine.output_terms)
+        self.resolution = self.tables.shape[1]
+        if self.tables.shape != (self.terms,) + (self.resolution,) * self.terms:
+            raise ValueError(f"Surface tables of shape {self.tables.shape} don't match the engine")
+
+        # Activations divided by the strongest one, in table axis order
+        self._others = [[j for j in range(self.terms) if j != k] for k in range(self.terms)]
+        self._corners = list(itertools.product((0, 1), repeat=self.terms))
+        self._strides = [self.resolution ** (self.terms - 1 - axis) for axis in range(self.terms)]
+        # Flat offset of every corner from the cell's first corner
+        self._corner_offsets = [int(np.dot(corner, self._strides)) for corner in self._corners]
+        self._flat = self.tables.reshape(-1)
+        self._compile_scalar()
+
+    def _compile_scalar(self):
+        """Plain Python copies of the rule layer of every controller, for single requests."""
+        engine = self.engine
+        # Terms no rule uses are not evaluated
+        used = set(engine.rule_antecedents.reshape(-1).tolist())
+        self._scalar_inputs = []
+        for universe, _, variables, columns, term_variables, values, _ in engine.input_groups:
+            universe = universe.tolist()
+            for position, variable in enumerate(variables.tolist()):
+                tables = [
+                    (column, values[row].tolist())
+                    for row, (column, owner) in enumerate(zip(columns.tolist(), term_variables.tolist()))
+                    if owner == position and column in used
+                ]
+                if tables:
+                    self._scalar_inputs.append((engine.input_names[variable], universe, tables))
+
+        # Distinct antecedent combinations, fired once for every controller
+        self._scalar_antecedents = [tuple(row) for row in engine.antecedent_sets.tolist()]
+        # Rules as (antecedent combination, activation slot, weight); the
+        # slot of a term of controller c is c * terms + term. Zero-weight
+        # rules never raise an activation and are left out.
+        segments = engine.rule_segments.tolist() + [len(engine.rule_weights)]
+        self._scalar_rules = [
+            (int(engine.rule_antecedent_sets[rule]), slot, float(engine.rule_weights[rule]))
+            for slot in range(len(segments) - 1)
+            for rule in range(segments[slot], segments[slot + 1])
+            if engine.rule_weights[rule] > 0
+        ]
+        self._controllers = len(engine.controller_names)
+        # Rules of the default controller, which come first
+        self._default_rules = sum(1 for _, slot, _ in self._scalar_rules if slot < self.terms)
+
+    @classmethod
+    def build(cls, engine: CompiledFuzzyEngine, resolution: int = SURFACE_RESOLUTION) -> 'ScoreSurface':
+        """
+        Tabulate the centroid of an engine's output terms.
+
+        tables[k] holds the centroid where term k is the strongest: axis 0
+        is its activation m, the other axes the remaining activations
+        divided by m, each on an even grid over [0, 1].
+
+        Args:
+            engine: Engine to tabulate
+            resolution: Grid points per axis, at least 2
+        """
+        if resolution < 2:
+            raise ValueError("A surface needs at least 2 grid points per axis")
+        terms = len(engine.output_terms)
+        grid = np.linspace(0.0, 1.0, resolution)
+        strongest = grid.copy()
+        strongest[0] = LIMIT_ACTIVATION
+
+        axes = np.meshgrid(*[grid] * (terms - 1), indexing='ij')
+        ratios = np.stack(axes, axis=-1).reshape(-1, terms - 1) if axes else np.zeros((1, 0))
+        tables = np.empty((terms, resolution, len(ratios)), dtype=np.float64)
+        for k in range(terms):
+            others = [j for j in range(terms) if j != k]
+            for i, m in enumerate(strongest):
+                for start in range(0, len(ratios), BUILD_CHUNK_ROWS):
+                    chunk = ratios[start:start + BUILD_CHUNK_ROWS]
+                    activations = np.empty((len(chunk), terms), dtype=np.float64)
+                    activations[:, k] = m
+                    activations[:, others] = m * chunk
+                    tables[k, i, start:start + len(chunk)] = engine.defuzzify(activations)
+        return cls(engine, tables.reshape((terms,) + (resolution,) * terms))
+
+    def lookup(self, activations: np.ndarray) -> np.ndarray:
+        """
+        Interpolate the centroid for rows of output term activations.
+
+        Args:
+            activations: (..., output terms) activation levels
+
+        Returns:
+            Crisp output per row; NaN where no output term is active
+        """
+        activations = np.clip(np.asarray(activations, dtype=np.float64), 0.0, 1.0)
+        shape = activations.shape[:-1]
+        activations = activations.reshape(-1, self.terms)
+        rows = np.arange(len(activations))
+        strongest = activations.argmax(axis=1)
+        m = activations[rows, strongest]
+        others = np.array(self._others, dtype=np.intp)[strongest]
+        coordinates = np.empty_like(activations)
+        coordinates[:, 0] = m
+        coordinates[:, 1:] = activations[rows[:, np.newaxis], others] / np.fmax(m, np.finfo(float).tiny)[:, np.newaxis]
+
+        position = coordinates * (self.resolution - 1)
+        index = np.minimum(position.astype(np.intp), self.resolution - 2)
+        fraction = position - index
+        base = strongest * self.resolution ** self.terms + index @ np.array(self._strides)
+
+        crisp = np.zeros(len(activations), dtype=np.float64)
+        for corner in self._corners:
+            weight = np.prod(np.where(corner, fraction, 1.0 - fraction), axis=1)
+            crisp += weight * self._flat[base + np.dot(corner, self._strides)]
+        crisp[m <= 0] = np.nan
+        return crisp.reshape(shape)
+
+    def compute_controllers_batch(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate the base score of every controller for many input rows in one pass.
+
+        Args:
+            inputs: Variable name -> 1D array of crisp values
+
+        Returns:
+            (rows, controllers) crisp outputs, as
+            CompiledFuzzyEngine.compute_controllers_batch
+        """
+        activations = self.engine.controller_activations(self.engine.input_matrix(inputs))
+        return fill_controllers(self.lookup(activations))
+
+    def compute_batch(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate the default controller's base score for many input rows at once.
+
+        Args:
+            inputs: Variable name -> 1D array of crisp values
+
+        Returns:
+            Crisp output per row; NaN where no rule fired
+        """
+        return self.lookup(self.engine.activations(self.engine.input_matrix(inputs)))
+
+    def compute(self, inputs: Dict[str, float]) -> float:
+        """
+        Evaluate the default controller's base score for a single set of crisp inputs.
+
+        Runs in plain Python: for one row, NumPy's per-call overhead would
+        cost more than the arithmetic.
+
+        Raises:
+            ValueError: If no rule fires, so no output can be calculated
+        """
+        activations = self._scalar_activations(inputs, self._scalar_rules[:self._default_rules])
+        crisp = self._interpolate(activations[:self.terms])
+        if crisp is None:
+            raise ValueError("Crisp output cannot be calculated: no rule fired "
+                             "for these input values")
+        return crisp
+
+    def compute_controllers(self, inputs: Dict[str, float]) -> np.ndarray:
+        """
+        Evaluate the base score of every controller for a single set of crisp inputs.
+
+        Returns:
+            Crisp output per controller, as CompiledFuzzyEngine.compute_controllers
+
+        Raises:
+            ValueError: If no rule of the default controller fires
+        """
+        activations = self._scalar_activations(inputs, self._scalar_rules)
+        # Controllers often end up with the same activations (e.g. when
+        # only shared rules fire); each distinct set is interpolated once
+        centroids = {}
+        outputs = []
+        for start in range(0, len(activations), self.terms):
+            key = tuple(activations[start:start + self.terms])
+            if key not in centroids:
+                centroids[key] = self._interpolate(key)
+            outputs.append(centroids[key])
+        if outputs[0] is None:
+            raise ValueError("Crisp output cannot be calculated: no rule fired "
+                             "for these input values")
+        return np.array([outputs[0] if output is None else output for output in outputs])
+
+    def _scalar_activations(self, inputs: Dict[str, float], rules: List) -> List[float]:
+        """Activation slots of a single set of crisp inputs, for some of the scalar rules."""
+        memberships = [0.0] * self.engine.term_count
+        for name, universe, tables in self._scalar_inputs:
+            # Out-of-range inputs are clipped to the universe bounds, like skfuzzy
+            value = float(inputs[name])
+            if value <= universe[0]:
+                i, fraction = 0, 0.0
+            elif value >= universe[-1]:
+                i, fraction = len(universe) - 2, 1.0
+            else:
+                i = bisect_right(universe, value) - 1
+                fraction = (value - universe[i]) / (universe[i + 1] - universe[i])
+            for column, table in tables:
+                low = table[i]
+                memberships[column] = low + (table[i + 1] - low) * fraction
+
+        membership = memberships.__getitem__
+        fired = [min(map(membership, antecedents)) for antecedents in self._scalar_antecedents]
+        activations = [0.0] * (self._controllers * self.terms)
+        for combination, slot, weight in rules:
+            strength = fired[combination] * weight
+            if strength > activations[slot]:
+                activations[slot] = strength
+        return activations
+
+    def _interpolate(self, activations: Sequence[float]) -> Optional[float]:
+        """Interpolated centroid of one controller's activations, None if none is active."""
+        strongest = max(range(self.terms), key=activations.__getitem__)
+        m = min(activations[strongest], 1.0)
+        if m <= 0:
+            return None
+        coordinates = [m] + [min(activations[j] / m, 1.0) for j in self._others[strongest]]
+
+        scale = self.resolution - 1
+        base = strongest * self.resolution ** self.terms
+        # Corner weights in _corners order: the last axis varies fastest
+        weights = [1.0]
+        for axis, coordinate in enumerate(coordinates):
+            index = min(int(coordinate * scale), scale - 1)
+            base += index * self._strides[axis]
+            upper = coordinate * scale - index
+            lower = 1.0 - upper
+            weights = [weight * side for weight in weights for side in (lower, upper)]
+
+        flat = self._flat
+        crisp = 0.0
+        for weight, offset in zip(weights, self._corner_offsets):
+            if weight:
+                crisp += weight * float(flat[base + offset])
+        return crisp
+
+
+def validation_grid(engine: CompiledFuzzyEngine, steps: int) -> Dict[str, np.ndarray]:
+    """
+    Every combination of steps values per input, one in each of steps equal
+    slices of its universe at an irrational offset into the slice, so the
+    values don't fall on the round breakpoints of the membership functions.
+    """
+    axes = []
+    for name in engine.input_names:
+        universe = engine.definition[0][name][0]
+        edges = np.linspace(universe[0], universe[-1], steps + 1)
+        axes.append(edges[:-1] + GRID_OFFSET * np.diff(edges))
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+    return {name: grid[:, column] for column, name in enumerate(engine.input_names)}
+
+
+def error_report(surface: ScoreSurface, simulator, steps: int = 3, samples: int = 100_000,
+                 seed: int = 0) -> Dict[str, Dict]:
+    """
+    Measure the surface against skfuzzy and the compiled engine.
+
+    Args:
+        surface: Surface to check
+        simulator: skfuzzy ControlSystemSimulation of the same controller
+        steps: Values per input of the validation grid run through the
+            simulator (steps ** inputs points)
+        samples: Random inputs checked against the compiled engine, which
+            matches the simulator exactly
+        seed: Seed of the random inputs
+
+    Returns:
+        'simulator' and 'engine' entries with the number of points and the
+        max, p99 and mean absolute error of the rows where a rule fired
+    """
+    engine = surface.engine
+    grid = validation_grid(engine, steps)
+    reference = np.full(len(grid[engine.input_names[0]]), np.nan)
+    for row in range(len(reference)):
+        for name in engine.input_names:
+            simulator.input[name] = grid[name][row]
+        try:
+            simulator.compute()
+        except ValueError:
+            continue
+        # No output when no rule fired
+        reference[row] = simulator.output.get(engine.output_name, np.nan)
+
+    rng = np.random.default_rng(seed)
+    sample = {}
+    for name in engine.input_names:
+        universe = engine.definition[0][name][0]
+        sample[name] = rng.uniform(universe[0], universe[-1], samples)
+
+    return {
+        'simulator': _errors(surface.compute_batch(grid), reference, grid),
+        'engine': _errors(surface.compute_batch(sample), engine.compute_batch(sample), sample),
+    }
+
+
+def _errors(actual: np.ndarray, expected: np.ndarray, inputs: Dict[str, np.ndarray]) -> Dict:
+    fired = ~np.isnan(expected)
+    if np.any(np.isnan(actual) != ~fired):
+        raise AssertionError("surface and reference disagree on where rules fire")
+    error = np.abs(actual[fired] - expected[fired])
+    if not len(error):
+        return {'points': len(actual), 'fired': 0}
+    worst = int(np.flatnonzero(fired)[error.argmax()])
+    return {
+        'points': len(actual),
+        'fired': int(fired.sum()),
+        'max': float(error.max()),
+        'p99': float(np.percentile(error, 99)),
+        'mean': float(error.mean()),
+        'worst_inputs': {name: float(values[worst]) for name, values in inputs.items()},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Report the error of the base score surface.")
+    parser.add_argument('--resolution', type=int, default=SURFACE_RESOLUTION or 41,
+                        help="grid points per axis of the surface")
+    parser.add_argument('--steps', type=int, default=3,
+                        help="values per input of the ControlSystemSimulation validation grid")
+    parser.add_argument('--samples', type=int, default=100_000,
+                        help="random inputs compared with the compiled engine")
+    args = parser.parse_args(argv)
+
+    from fuzzy_logic import GiftRecommendationFuzzySystem
+
+    system = GiftRecommendationFuzzySystem()
+    start = time.perf_counter()
+    surface = ScoreSurface.build(system.engine, args.resolution)
+    print(f"Built a {args.resolution}-point surface ({surface.tables.nbytes / 2**20:.1f} MiB) "
+          f"in {time.perf_counter() - start:.2f} s")
+
+    report = error_report(surface, system.simulator, args.steps, args.samples)
+    for reference, errors in report.items():
+        print(f"vs {reference}: {errors['fired']} of {errors['points']} points fired", end='')
+        if errors['fired']:
+            print(f", max error {errors['max']:.4f}, p99 {errors['p99']:.4f}, mean {errors['mean']:.5f}")
+            print(f"   worst at {errors['worst_inputs']}")
+        else:
+            print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
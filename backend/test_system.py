@@ -143,6 +143,936 @@ except Exception as e:
     traceback.print_exc()
     sys.exit(1)
 
+# Test 7: Vectorized scoring matches the per-gift scoring path
+print("\n7️⃣ Testing vectorized catalog scoring...")
+try:
+    context = fuzzy_system.build_scoring_context(user_data, recipient_data)
+    vector_scores = fuzzy_system.score_catalog(context)
+    scalar_scores = [fuzzy_system.score_gift(gift, context) for gift in fuzzy_system.gifts]
+    
+    mismatches = sum(1 for a, b in zip(vector_scores, scalar_scores) if a != b)
+    if mismatches:
+        raise AssertionError(f"{mismatches} gifts scored differently")
+    
+    print(f"   ✅ Vectorized scores match scalar scores for {len(scalar_scores)} gifts")
+    
+except Exception as e:
+    print(f"   ❌ Error in vectorized scoring: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 8: Compiled inference engine matches scikit-fuzzy
+print("\n8️⃣ Testing compiled fuzzy inference engine...")
+try:
+    inputs = {
+        'user_age': 25, 'user_budget': 60, 'relationship': 75, 'personality': 65,
+        'technical': 40, 'creative': 85, 'managerial': 50, 'academic': 60
+    }
+    for label, value in inputs.items():
+        fuzzy_system.simulator.input[label] = value
+    fuzzy_system.simulator.compute()
+    expected = fuzzy_system.simulator.output['gift_score']
+    actual = fuzzy_system.engine.compute(inputs)
+    
+    if abs(expected - actual) > 1e-9:
+        raise AssertionError(f"engine returned {actual}, skfuzzy returned {expected}")
+    
+    print(f"   ✅ Compiled engine matches skfuzzy (gift_score={actual:.4f})")
+    
+except Exception as e:
+    print(f"   ❌ Error in compiled inference engine: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 9: Worker processes return the same rankings as in-process scoring
+print("\n9️⃣ Testing process-pool scoring workers...")
+try:
+    expected_top = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+    expected_final = fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids, top_n=3)
+    
+    fuzzy_system.enable_process_pool(2)
+    try:
+        actual_top = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+        actual_final = fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids, top_n=3)
+        
+        # Gift updates bind the new catalog to the running workers
+        pool = fuzzy_system.process_pool.pool
+        original = fuzzy_system.catalog
+        fuzzy_system.update_gifts(deletes=[fuzzy_system.gifts[0]['id']])
+        if fuzzy_system.process_pool.pool is not pool:
+            raise AssertionError("a gift update started new worker processes")
+        updated_top = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+        
+        # A worker that dies does not unlink the shared catalog
+        import logging
+        import os
+        import signal
+        import time
+        from multiprocessing import shared_memory
+        
+        def kill_worker(workers):
+            pid, process = next(iter(workers.executor._processes.items()))
+            os.kill(pid, signal.SIGKILL)
+            process.join(5)
+            time.sleep(0.5)
+        
+        logging.getLogger('fuzzy_logic').setLevel(logging.ERROR)
+        blocks = [block.name for block in fuzzy_system.process_pool.shared.blocks]
+        if not blocks:
+            raise AssertionError("the updated catalog was not shared with the workers")
+        kill_worker(pool)
+        for name in blocks:
+            try:
+                shared_memory.SharedMemory(name=name).close()
+            except FileNotFoundError:
+                raise AssertionError("the shared catalog was unlinked when a worker died")
+        
+        # Requests after a worker died restart the workers instead of failing
+        for _ in range(2):
+            if fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10) != updated_top:
+                raise AssertionError("requests after a worker died ranked differently")
+        restarted = fuzzy_system.process_pool.pool
+        if restarted is pool:
+            raise AssertionError("the workers were not restarted after one died")
+        
+        refined = fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids, top_n=3)
+        kill_worker(restarted)
+        if fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids, top_n=3) != refined:
+            raise AssertionError("refinement after a worker died ranked differently")
+        
+        # So does publishing a catalog to them
+        kill_worker(fuzzy_system.process_pool.pool)
+        fuzzy_system.set_catalog(fuzzy_system.catalog)
+        if fuzzy_system.process_pool is None or \
+                fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10) != updated_top:
+            raise AssertionError("a catalog published after a worker died was not scored by new workers")
+    finally:
+        fuzzy_system.disable_process_pool()
+        logging.getLogger('fuzzy_logic').setLevel(logging.NOTSET)
+    
+    for name in blocks:
+        try:
+            shared_memory.SharedMemory(name=name).close()
+        except FileNotFoundError:
+            continue
+        raise AssertionError("the shared catalog was not unlinked when the workers stopped")
+    
+    if actual_top != expected_top or actual_final != expected_final:
+        raise AssertionError("worker processes ranked gifts differently")
+    if pool.start_method not in ('fork', 'spawn'):
+        raise AssertionError(f"workers started with {pool.start_method} from a single thread")
+    
+    # Workers are never forked while other threads are running
+    import threading
+    from workers import worker_start_method
+    release = threading.Event()
+    thread = threading.Thread(target=release.wait)
+    thread.start()
+    try:
+        if worker_start_method() == 'fork':
+            raise AssertionError("workers would be forked from a multithreaded process")
+    finally:
+        release.set()
+        thread.join()
+    if updated_top != fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10):
+        raise AssertionError("worker processes ranked the updated catalog differently")
+    fuzzy_system.set_catalog(original)
+    
+    print("   ✅ Worker processes match in-process scoring")
+
+except Exception as e:
+    print(f"   ❌ Error in process-pool scoring: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 10: Repeated profiles are served from the result cache
+print("\n🔟 Testing scoring result cache...")
+try:
+    fuzzy_system.cache.clear()
+    hits = fuzzy_system.cache.hits
+    first = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+    second = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+    
+    if fuzzy_system.cache.hits != hits + 1 or first != second:
+        raise AssertionError("repeated profile was not served from the cache")
+    
+    fuzzy_system.set_catalog(fuzzy_system.catalog)
+    if fuzzy_system.cache.stats()['entries'] != 0:
+        raise AssertionError("cache was not invalidated on catalog change")
+    
+    print(f"   ✅ Cache stats: {fuzzy_system.cache.stats()}")
+
+except Exception as e:
+    print(f"   ❌ Error in result cache: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 11: Candidate prefilter returns exactly the full-scoring results
+print("\n1️⃣1️⃣ Testing candidate prefilter...")
+try:
+    from prefilter import CatalogPrefilter
+    
+    fuzzy_system.cache.clear()
+    expected_top = fuzzy_system.rank_gifts(user_data, recipient_data, top_n=10)
+    expected_final = fuzzy_system.rank_refined(user_data, recipient_data, [0, 1, 2], top_n=3)
+    
+    fuzzy_system.prefilter = CatalogPrefilter(fuzzy_system.catalog, block_size=4)
+    fuzzy_system.cache.clear()
+    try:
+        actual_top = fuzzy_system.rank_gifts(user_data, recipient_data, top_n=10)
+        actual_final = fuzzy_system.rank_refined(user_data, recipient_data, [0, 1, 2], top_n=3)
+    finally:
+        fuzzy_system.prefilter = None
+        fuzzy_system.cache.clear()
+    
+    for expected, actual in ((expected_top, actual_top), (expected_final, actual_final)):
+        if not all(np.array_equal(e, a) for e, a in zip(expected, actual)):
+            raise AssertionError("prefiltered ranking differs from full scoring")
+    
+    print("   ✅ Prefiltered rankings match full scoring")
+    
+except Exception as e:
+    print(f"   ❌ Error in candidate prefilter: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 12: Startup artifacts rebuild the same engine and catalog
+print("\n1️⃣2️⃣ Testing compiled startup artifacts...")
+try:
+    import tempfile
+    from artifact import load_catalog, load_engine, save_catalog, save_engine
+    
+    with tempfile.TemporaryDirectory() as directory:
+        save_engine(directory, 'test', fuzzy_system.engine)
+        save_catalog(directory, 'test', fuzzy_system.catalog)
+        engine = load_engine(directory, 'test')
+        catalog = load_catalog(directory, 'test', fuzzy_system.gifts)
+        
+        if engine.compute(inputs) != fuzzy_system.engine.compute(inputs):
+            raise AssertionError("loaded engine computes a different score")
+        for name, column in fuzzy_system.catalog.columns().items():
+            if not np.array_equal(catalog.columns()[name], column):
+                raise AssertionError(f"loaded catalog column {name} differs")
+        
+        # Publishing an artifact never deletes others, pruning keeps the
+        # most recently used ones
+        import os
+        from artifact import prune_artifacts
+        for key in ('older', 'newer'):
+            save_engine(directory, key, fuzzy_system.engine)
+        for key in ('test', 'older', 'newer'):
+            os.utime(os.path.join(directory, f'engine-{key}'), (0, 0))
+        load_engine(directory, 'newer')
+        if not os.path.isdir(os.path.join(directory, 'engine-test')):
+            raise AssertionError("publishing an artifact deleted an older one")
+        deleted = prune_artifacts(directory, keep=1, in_use=['engine-older'])
+        if deleted != ['engine-test'] or load_engine(directory, 'older') is None:
+            raise AssertionError(f"pruning deleted {deleted}")
+    
+    print("   ✅ Engine and catalog artifacts round-trip exactly")
+    
+except Exception as e:
+    print(f"   ❌ Error in startup artifacts: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 13: Memory-mapped gift records rebuild gifts.json exactly
+print("\n1️⃣3️⃣ Testing memory-mapped gift records...")
+try:
+    from catalog import GiftCatalog
+    from records import GiftRecords
+    
+    with tempfile.TemporaryDirectory() as directory:
+        save_catalog(directory, 'test', GiftCatalog(gifts))
+        catalog = load_catalog(directory, 'test')
+        
+        if not isinstance(catalog.gifts, GiftRecords):
+            raise AssertionError("catalog artifact has no gift records")
+        if json.dumps(list(catalog.gifts)) != json.dumps(gifts):
+            raise AssertionError("gift records differ from gifts.json")
+        if catalog.get(gifts[-1]['id']) != gifts[-1]:
+            raise AssertionError("gift lookup by id differs from gifts.json")
+    
+    print(f"   ✅ {len(gifts)} gift records round-trip exactly")
+    
+except Exception as e:
+    print(f"   ❌ Error in gift records: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 14: Hot reload swaps the catalog without disturbing pinned requests
+print("\n1️⃣4️⃣ Testing catalog hot reload...")
+try:
+    import copy
+    import os
+    
+    updated = copy.deepcopy(gifts)
+    updated[0]['name'] = 'Reloaded ' + updated[0]['name']
+    
+    with tempfile.TemporaryDirectory() as directory:
+        updated_path = os.path.join(directory, 'gifts.json')
+        with open(updated_path, 'w') as f:
+            json.dump({'gifts': updated}, f)
+        
+        with fuzzy_system.pin_snapshot() as pinned:
+            version = pinned.version
+            snapshot = fuzzy_system.reload_catalog(updated_path)
+            if pinned.gifts[0]['name'] != gifts[0]['name']:
+                raise AssertionError("pinned snapshot changed during reload")
+        
+        if snapshot.version != version + 1 or fuzzy_system.catalog.get(gifts[0]['id'])['name'] != updated[0]['name']:
+            raise AssertionError("reloaded catalog was not swapped in")
+        if fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10) is None:
+            raise AssertionError("reloaded catalog cannot be scored")
+    
+    fuzzy_system.reload_catalog()
+    print(f"   ✅ Catalog swapped to version {snapshot.version} while a request held version {version}")
+    
+except Exception as e:
+    print(f"   ❌ Error in catalog hot reload: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 15: Incremental gift updates match a catalog rebuilt from scratch
+print("\n1️⃣5️⃣ Testing incremental gift updates...")
+try:
+    changed_gift = copy.deepcopy(gifts[1])
+    changed_gift['price_range'] = 95
+    new_gift = copy.deepcopy(gifts[2])
+    new_gift['id'] = 'gift_incremental'
+    new_gift['attributes']['style'] = 'Quirky'
+    expected_gifts = [gifts[-1], changed_gift] + gifts[2:-1] + [new_gift]
+    
+    fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+    fuzzy_system.update_gifts(upserts=[changed_gift, new_gift], deletes=[gifts[0]['id']])
+    
+    if list(fuzzy_system.gifts) != expected_gifts:
+        raise AssertionError("updated gifts differ from the expected catalog")
+    rebuilt = GiftCatalog(expected_gifts)
+    for category, indices in rebuilt.category_index.items():
+        if not np.array_equal(fuzzy_system.catalog.category_index[category], indices):
+            raise AssertionError(f"category index of {category} was not updated")
+    if not np.array_equal(fuzzy_system.catalog.select(style='Quirky'), [len(expected_gifts) - 1]):
+        raise AssertionError("style index was not updated")
+    
+    # Cached scores are carried over to the updated catalog
+    carried = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+    fuzzy_system.cache.clear()
+    if carried != fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10):
+        raise AssertionError("carried-over cached scores differ from fresh scores")
+    
+    fuzzy_system.reload_catalog()
+    print(f"   ✅ Updated catalog matches a rebuilt one ({len(expected_gifts)} gifts)")
+    
+except Exception as e:
+    print(f"   ❌ Error in incremental gift updates: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 16: Sessions refine the pair scores without scoring the catalog again
+print("\n1️⃣6️⃣ Testing scoring sessions...")
+try:
+    pairs, session_id = fuzzy_system.start_session(user_data, recipient_data, num_pairs=5)
+    if pairs != fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=5):
+        raise AssertionError("session pairs differ from get_diverse_pairs")
+    if session_id is None:
+        raise AssertionError("no session was started")
+    
+    selected_ids = [pair[0]['id'] for pair in pairs]
+    expected = fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids, top_n=3)
+    fuzzy_system.cache.clear()
+    hits, misses = fuzzy_system.sessions.hits, fuzzy_system.cache.misses
+    refined = fuzzy_system.refine_recommendations(
+        user_data, recipient_data, selected_ids, top_n=3, session_id=session_id
+    )
+    if refined != expected or fuzzy_system.sessions.hits != hits + 1:
+        raise AssertionError("session refinement differs from a fresh refinement")
+    if fuzzy_system.cache.misses != misses:
+        raise AssertionError("session refinement scored the catalog again")
+    
+    # Unknown sessions and other profiles fall back to scoring
+    other_user = dict(user_data, budget=user_data['budget'] + 40)
+    for sid, user in (('unknown', user_data), (session_id, other_user)):
+        fresh = fuzzy_system.refine_recommendations(user, recipient_data, selected_ids, top_n=3)
+        if fuzzy_system.refine_recommendations(user, recipient_data, selected_ids, top_n=3, session_id=sid) != fresh:
+            raise AssertionError("invalid session was not ignored")
+    
+    print(f"   ✅ Refined {len(refined)} recommendations from session scores")
+    
+except Exception as e:
+    print(f"   ❌ Error in scoring sessions: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 17: Weighted selections re-rank towards the heavier choices
+print("\n1️⃣7️⃣ Testing weighted selections...")
+try:
+    catalog = fuzzy_system.catalog
+    selected_ids = [gift['id'] for gift in gifts[:3]]
+    
+    # Equal weights match unweighted selections; repeats add up
+    equal = fuzzy_system.refine_recommendations(
+        user_data, recipient_data, selected_ids, top_n=5, selection_weights=[2, 2, 2]
+    )
+    if equal != fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids, top_n=5):
+        raise AssertionError("equal weights differ from unweighted selections")
+    rounds = selected_ids + selected_ids[:1]
+    if catalog.weighted_indices(rounds, [1, 1, 1, 2]) != ([0, 1, 2], [3.0, 1.0, 1.0]):
+        raise AssertionError("weights of repeated selections were not summed")
+    
+    # All weight on one gift ranks like selecting only that gift
+    single = fuzzy_system.refine_recommendations(user_data, recipient_data, selected_ids[:1], top_n=5)
+    weighted = fuzzy_system.refine_recommendations(
+        user_data, recipient_data, selected_ids, top_n=5, selection_weights=[1, 0, 0]
+    )
+    if [g['id'] for g in weighted] != [g['id'] for g in single]:
+        raise AssertionError("weighted selection ignored the weights")
+    
+    try:
+        fuzzy_system.refine_recommendations(
+            user_data, recipient_data, selected_ids, selection_weights=[1, -1, 1]
+        )
+        raise AssertionError("negative weights were accepted")
+    except ValueError:
+        pass
+    
+    print(f"   ✅ Weighted selections re-ranked {len(weighted)} recommendations")
+    
+except Exception as e:
+    print(f"   ❌ Error in weighted selections: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 18: Pair selection differs in every dimension and honours the seed
+print("\n1️⃣8️⃣ Testing diverse pair selection...")
+try:
+    from pairs import PairSelector
+    
+    catalog = fuzzy_system.catalog
+    indices, _ = fuzzy_system.rank_gifts(user_data, recipient_data, top_n=len(catalog))
+    selector = PairSelector(dimensions=['category', 'style', 'price'])
+    pairs = selector.select(catalog, indices, num_pairs=20)
+    if len(pairs) != min(20, len(indices) // 2):
+        raise AssertionError(f"expected 20 pairs, got {len(pairs)}")
+    positions = [position for pair in pairs for position in pair]
+    if len(set(positions)) != len(positions):
+        raise AssertionError("a gift was used in several pairs")
+    if any(catalog.category_codes[indices[a]] == catalog.category_codes[indices[b]] for a, b in pairs[:3]):
+        raise AssertionError("top pairs share a category")
+    
+    seeded = fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=8, seed=7)
+    if seeded != fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=8, seed=7):
+        raise AssertionError("same seed gave different pairs")
+    unseeded = fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=8)
+    if sorted(sorted(g['id'] for g in pair) for pair in seeded) != sorted(sorted(g['id'] for g in pair) for pair in unseeded):
+        raise AssertionError("seed changed which gifts are paired")
+    
+    print(f"   ✅ Built {len(pairs)} pairs across 3 dimensions; seeded pairs are reproducible")
+    
+except Exception as e:
+    print(f"   ❌ Error in diverse pair selection: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 19: Benchmark workloads are reproducible and regressions are detected
+print("\n1️⃣9️⃣ Testing benchmark suite...")
+try:
+    import benchmark
+    
+    synthetic = benchmark.synthetic_gifts(200, seed=3)
+    if synthetic != benchmark.synthetic_gifts(200, seed=3):
+        raise AssertionError("synthetic catalog is not reproducible")
+    if not all(GiftCatalog(synthetic).valid):
+        raise AssertionError("synthetic catalog contains invalid gifts")
+    if benchmark.random_profiles(5, seed=3) != benchmark.random_profiles(5, seed=3):
+        raise AssertionError("profile workload is not reproducible")
+    
+    results = benchmark.run([200], ['micro'], profiles=5, min_time=0.01)
+    slower = copy.deepcopy(results)
+    slower['results']['200/micro/recommend_gifts']['p50_ms'] *= 2
+    if benchmark.compare(results, results, 0.25):
+        raise AssertionError("identical results reported as regressions")
+    if len(benchmark.compare(slower, results, 0.25)) != 1:
+        raise AssertionError("slowdown was not reported as a regression")
+    
+    print(f"   ✅ Ran {len(results['results'])} micro-benchmarks on a synthetic catalog")
+    
+except Exception as e:
+    print(f"   ❌ Error in benchmark suite: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 20: Stage latency histograms and the /metrics page
+print("\n2️⃣0️⃣ Testing latency metrics...")
+try:
+    from metrics import Metrics, metrics
+    
+    if metrics.enabled:
+        metrics.reset()
+        fuzzy_system.cache.clear()
+        fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=5)
+        for stage in ('fuzzy_inference', 'bonus_scoring', 'sorting', 'pair_selection'):
+            if metrics.stages.get(stage) is None or metrics.stages[stage].count == 0:
+                raise AssertionError(f"stage {stage} was not timed")
+    
+    registry = Metrics()
+    with registry.stage('example'):
+        pass
+    registry.observe_request('/api/example', 'total', 0.003)
+    page = registry.render([('example_gauge', 'gauge', 'An example', {'cache': 'scores'}, 2)])
+    for line in (
+        'fuzzy_stage_duration_seconds_count{stage="example"} 1',
+        'fuzzy_request_duration_seconds_bucket{endpoint="/api/example",phase="total",le="0.005"} 1',
+        'example_gauge{cache="scores"} 2.0',
+    ):
+        if line not in page.splitlines():
+            raise AssertionError(f"missing metrics line: {line}")
+    
+    disabled = Metrics(enabled=False)
+    untimed = lambda: None
+    if disabled.timed('example')(untimed) is not untimed or disabled.stages:
+        raise AssertionError("disabled metrics still time functions")
+    
+    print(f"   ✅ Recorded {len(metrics.stages)} scoring stages")
+    
+except Exception as e:
+    print(f"   ❌ Error in latency metrics: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+# Test 21: Profiled requests keep their hot functions in a bounded buffer
+print("\n2️⃣1️⃣ Testing request profiling...")
+try:
+    from profiling import RequestProfiler
+    
+    profiler = RequestProfiler(rate=0.0, capacity=2, top=5)
+    if profiler.should_profile() is not None or profiler.should_profile(requested=True) != 'header':
+        raise AssertionError("profiling triggered incorrectly")
+    if RequestProfiler(rate=1.0, capacity=2, top=5).should_profile() != 'sample':
+        raise AssertionError("sampled request was not profiled")
+    
+    profiled = profiler.wrap(fuzzy_system.get_diverse_pairs, '/api/generate-image-pairs', 'header')
+    for _ in range(3):
+        if profiled(user_data, recipient_data, num_pairs=5) != fuzzy_system.get_diverse_pairs(user_data, recipient_data, num_pairs=5):
+            raise AssertionError("profiled call returned a different result")
+    
+    profiles = profiler.recent()
+    if len(profiles) != 2 or [p['id'] for p in profiles] != [3, 2]:
+        raise AssertionError("ring buffer did not keep the newest profiles")
+    if not 0 < len(profiles[0]['hot_functions']) <= 5:
+        raise AssertionError("hot functions were not summarized")
+    
+    print(f"   ✅ Kept {len(profiles)} of 3 profiles, hottest: {profiles[0]['hot_functions'][0]['function']}")
+    
+except Exception as e:
+    print(f"   ❌ Error in request profiling: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣2️⃣ Testing compact gift views...")
+try:
+    from records import GiftRecords, GiftView
+    
+    catalog = fuzzy_system.catalog
+    records = GiftRecords.from_catalog(catalog, [catalog.gifts[i] for i in range(len(catalog))])
+    for i in range(len(catalog)):
+        view = GiftView(records, i)
+        if view != catalog.gifts[i] or view['attributes'] != catalog.gifts[i]['attributes']:
+            raise AssertionError(f"view of gift {i} differs from the gift")
+    
+    recommendations = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=5)
+    top = recommendations[0]
+    expected = dict(catalog.gifts[top.index], fuzzy_score=top['fuzzy_score'])
+    if top != expected or top.to_dict() != expected:
+        raise AssertionError("ranked view differs from the scored gift")
+    
+    top['attributes']['style'] = 'changed'
+    if catalog.gifts[top.index]['attributes'].get('style') == 'changed':
+        raise AssertionError("catalog was modified through a view")
+    if recommendations[:2] != [recommendations[0], recommendations[1]]:
+        raise AssertionError("sliced ranking differs")
+    
+    print(f"   ✅ {len(catalog)} gift views match their gifts; rankings are read-only")
+    
+except Exception as e:
+    print(f"   ❌ Error in compact gift views: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣3️⃣ Testing base score surface...")
+try:
+    import tempfile
+    from artifact import load_surface, save_surface
+    from surface import SURFACE_RESOLUTION, ScoreSurface
+    
+    # The surface is opt-in: by default base scores come from the exact engine
+    engine = fuzzy_system.engine
+    if SURFACE_RESOLUTION == 0 and fuzzy_system.base_scorer is not engine:
+        raise AssertionError("base scores come from the surface without FUZZY_SCORE_SURFACE")
+    
+    surface = ScoreSurface.build(engine, 21)
+    rng = np.random.default_rng(0)
+    inputs = {name: rng.uniform(0, 100, 5000) for name in engine.input_names}
+    expected = engine.compute_batch(inputs)
+    actual = surface.compute_batch(inputs)
+    if not np.array_equal(np.isnan(actual), np.isnan(expected)):
+        raise AssertionError("surface and engine disagree on where rules fire")
+    error = np.nanmax(np.abs(actual - expected))
+    if error > 0.5:
+        raise AssertionError(f"surface error {error:.4f} exceeds 0.5")
+    
+    for row in range(200):
+        values = {name: column[row] for name, column in inputs.items()}
+        if not np.isnan(actual[row]) and abs(surface.compute(values) - actual[row]) > 1e-9:
+            raise AssertionError("single and batch surface lookups differ")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        save_surface(directory, 'test', surface)
+        loaded = load_surface(directory, 'test', engine)
+        if loaded is None or not np.array_equal(loaded.compute_batch(inputs), actual, equal_nan=True):
+            raise AssertionError("loaded surface computes different scores")
+    
+    print(f"   ✅ Surface matches the engine within {error:.4f}")
+    
+except Exception as e:
+    print(f"   ❌ Error in base score surface: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣4️⃣ Testing data-driven rule base...")
+try:
+    import tempfile
+    from rulebase import RULES_PATH, RuleBase
+    
+    with open(RULES_PATH) as f:
+        definition = json.load(f)
+    
+    try:
+        RuleBase.from_dict(dict(definition, controllers={}, rules=[
+            {"if": [["technical", "huge"]], "then": "excellent"},
+            {"if": [["shoe_size", "high"]], "then": "stellar"},
+        ]))
+        raise AssertionError("invalid rules were accepted")
+    except ValueError as e:
+        if str(e).count("\n- ") != 3:
+            raise AssertionError(f"expected 3 reported problems, got: {e}")
+    
+    rule_base = RuleBase.from_dict(dict(definition, controllers={}, rules=[
+        {"if": [["technical", "high"], ["user_budget", "high"]], "then": "excellent"},
+        {"if": [["user_budget", "high"], ["technical", "high"]], "then": "excellent"},
+        {"if": [["technical", "high"], ["technical", "low"]], "then": "good"},
+        {"if": [["technical", "high"], ["user_budget", "high"], ["user_age", "young"]], "then": "excellent"},
+        {"if": [["creative", "high"]], "then": "good", "weight": 0},
+        {"if": [["creative", "high"]], "then": "good", "weight": 0.5},
+    ]))
+    report = rule_base.analyze()
+    if report.merged != [(1, 0)] or [rule for rule, _ in report.dead] != [2, 3, 4] or len(report.rules) != 2:
+        raise AssertionError(f"unexpected rule analysis: {report.summary()}")
+    notices = report.notices()
+    if len(notices) != 4 or notices[0] != "default rules: merged duplicate rule 2 into rule 1":
+        raise AssertionError(f"unexpected rule notices: {notices}")
+    
+    # Swapping rule bases bumps the version and reuses compiled rule bases
+    version = fuzzy_system.catalog_version
+    engine = fuzzy_system.engine
+    expected = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=5)
+    with tempfile.TemporaryDirectory() as directory:
+        swapped = os.path.join(directory, 'rules.json')
+        with open(swapped, 'w') as f:
+            json.dump(dict(definition, controllers={},
+                           rules=[dict(rule, then='poor') for rule in definition['rules']]), f)
+        # Keep the artifacts of the swapped rules out of the shared directory
+        artifacts = os.environ.get('FUZZY_ARTIFACT_DIR')
+        os.environ['FUZZY_ARTIFACT_DIR'] = directory
+        try:
+            # Compiling reports its notices through the rule report only
+            import contextlib, io
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                fuzzy_system.load_rules(swapped)
+            if output.getvalue():
+                raise AssertionError(f"compiling rules printed {output.getvalue()!r}")
+        finally:
+            if artifacts is None:
+                del os.environ['FUZZY_ARTIFACT_DIR']
+            else:
+                os.environ['FUZZY_ARTIFACT_DIR'] = artifacts
+        if fuzzy_system.catalog_version != version + 1:
+            raise AssertionError("loading rules did not bump the snapshot version")
+        if fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=5) == expected:
+            raise AssertionError("scores did not change with the rules")
+    fuzzy_system.load_rules(RULES_PATH)
+    if fuzzy_system.engine is not engine:
+        raise AssertionError("compiled rule base was not reused")
+    if fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=5) != expected:
+        raise AssertionError("scores differ after swapping the rules back")
+    
+    print(f"   ✅ Compiled {len(fuzzy_system.rule_report.rules)} live rules, "
+          f"merged {len(fuzzy_system.rule_report.merged)} duplicates")
+    
+except Exception as e:
+    print(f"   ❌ Error in data-driven rule base: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣5️⃣ Testing per-category fuzzy controllers...")
+try:
+    import tempfile
+    from artifact import load_engine, save_engine
+    from inference import CompiledFuzzyEngine
+    
+    # The shipped rule base has no controllers, so default rankings stay
+    # those of the single rule base; the example file adds some
+    if fuzzy_system.rule_base.controllers or len(fuzzy_system.engine.controller_names) != 1:
+        raise AssertionError("the default rule base enables category controllers")
+    default_top = fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10)
+    fuzzy_system.load_rules(os.path.join(os.path.dirname(RULES_PATH), 'rules-by-category.json'))
+    
+    engine = fuzzy_system.engine
+    rule_base = fuzzy_system.rule_base
+    report = fuzzy_system.rule_report
+    if engine.controller_names != ['default'] + list(rule_base.controllers):
+        raise AssertionError(f"unexpected controllers {engine.controller_names}")
+    
+    # The fused pass computes what every controller computes on its own
+    rng = np.random.default_rng(0)
+    inputs = {name: rng.uniform(0, 100, 2000) for name in engine.input_names}
+    fused = engine.compute_controllers_batch(inputs)
+    default = engine.compute_batch(inputs)
+    if not np.array_equal(fused[:, 0], default, equal_nan=True):
+        raise AssertionError("fused default controller differs from the engine")
+    variables = (
+        {name: (variable.universe, variable.tables()) for name, variable in rule_base.inputs.items()},
+        (rule_base.output.name, rule_base.output.universe, rule_base.output.tables())
+    )
+    for column, name in enumerate(engine.controller_names[1:], start=1):
+        rules = [(list(rule.antecedents), rule.consequent, rule.weight)
+                 for rule in report.controllers[name].rules]
+        alone = CompiledFuzzyEngine(*variables, rules).compute_batch(inputs)
+        alone = np.where(np.isnan(alone), default, alone)
+        if np.nanmax(np.abs(fused[:, column] - alone)) > 1e-9:
+            raise AssertionError(f"fused controller {name} differs from its own engine")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        save_engine(directory, 'test', engine)
+        loaded = load_engine(directory, 'test')
+        if not np.array_equal(loaded.compute_controllers_batch(inputs), fused, equal_nan=True):
+            raise AssertionError("loaded engine computes different controller scores")
+    
+    # Gifts get the base score of their category's controller
+    context = fuzzy_system.build_scoring_context(
+        {'age': 45, 'budget': 60, 'relationship': 55, 'occasion': 'Birthday'},
+        {'gender': 'Male', 'personality': 30, 'technical': 10, 'creative': 20,
+         'managerial': 40, 'academic': 90, 'style': 'Classic'}
+    )
+    by_category = {
+        gift['category']: context.controller_scores[rule_base.controller_of(gift['category'])]
+        for gift in fuzzy_system.gifts
+    }
+    if len(set(by_category.values())) < 2:
+        raise AssertionError("every category got the same base score")
+    if not by_category['Books'] > by_category['Electronics']:
+        raise AssertionError("an academic, non-technical recipient should favour books")
+    
+    # Batch scoring uses the same per-gift base scores
+    users = [{'age': 45, 'budget': 60, 'relationship': 55}, user_data]
+    recipients = [{'technical': 10, 'academic': 90, 'personality': 30}, recipient_data]
+    batched = list(fuzzy_system.recommend_batch(users, recipients, top_n=5))
+    for result, user, recipient in zip(batched, users, recipients):
+        single = fuzzy_system.recommend_gifts(user, recipient, top_n=5)
+        if result['gift_ids'] != [gift['id'] for gift in single]:
+            raise AssertionError("batch and single recommendations differ")
+    
+    fuzzy_system.load_rules(RULES_PATH)
+    if fuzzy_system.recommend_gifts(user_data, recipient_data, top_n=10) != default_top:
+        raise AssertionError("rankings differ after switching back to the default rules")
+    
+    print(f"   ✅ {len(engine.controller_names)} controllers evaluated in one pass; "
+          f"books {by_category['Books']:.1f} vs electronics {by_category['Electronics']:.1f}")
+    
+except Exception as e:
+    print(f"   ❌ Error in per-category controllers: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣6️⃣ Testing pre-rendered responses...")
+try:
+    from models import GenerateFinalImagesResponse, GenerateImagePairsResponse
+    from responses import (
+        GiftFragments, final_image_info, final_images_json, gift_json, gifts_json, image_info, image_pairs_json
+    )
+    
+    # Assembled responses match the response models built gift by gift
+    pairs, session_id = fuzzy_system.start_session(user_data, recipient_data, num_pairs=5, seed=7)
+    expected = GenerateImagePairsResponse(
+        imagePairs=[[image_info(gift) for gift in pair] for pair in pairs], sessionId=session_id
+    )
+    if json.loads(image_pairs_json(pairs, session_id)) != expected.model_dump():
+        raise AssertionError("pre-rendered image pairs differ from the response model")
+    
+    final_gifts = fuzzy_system.refine_recommendations(
+        user_data, recipient_data, [pair[0]['id'] for pair in pairs], top_n=3, session_id=session_id
+    )
+    expected = GenerateFinalImagesResponse(finalImages=[final_image_info(gift) for gift in final_gifts])
+    if json.loads(final_images_json(final_gifts)) != expected.model_dump():
+        raise AssertionError("pre-rendered final images differ from the response model")
+    
+    snapshot = fuzzy_system.snapshot
+    indices = snapshot.catalog.select(category='Books').tolist()
+    listing = json.loads(gifts_json(snapshot.fragments, snapshot.gifts, indices))
+    if listing != {"gifts": [snapshot.gifts[i] for i in indices], "count": len(indices)}:
+        raise AssertionError("pre-rendered gift listing differs from the catalog")
+    
+    # Updates only re-render the changed gifts
+    first, last = snapshot.gifts[0], snapshot.gifts[len(snapshot.gifts) - 1]
+    updated = fuzzy_system.update_gifts(
+        upserts=[dict(first, name="Renamed gift"), dict(last, id="prerendered-copy")],
+        deletes=[snapshot.gifts[1]['id']]
+    )
+    rebuilt = GiftFragments.of(updated.gifts)
+    if (updated.fragments.images, updated.fragments.finals, updated.fragments.gifts) != \
+            (rebuilt.images, rebuilt.finals, rebuilt.gifts):
+        raise AssertionError("updated fragments differ from re-rendered ones")
+    if fuzzy_system.snapshot.replace().fragments is not updated.fragments:
+        raise AssertionError("fragments were not carried over to a replaced snapshot")
+    
+    # Gifts orjson cannot encode are serialized the regular way
+    odd = dict(first, id="unencodable", stock=2 ** 70, notes={1: "non-string key"})
+    fragments = GiftFragments.of([odd])
+    if fragments.gifts != [None] or fragments.images[0] is None:
+        raise AssertionError("an unencodable gift was pre-rendered")
+    if json.loads(gift_json(fragments, [odd], 0)) != json.loads(json.dumps(odd)):
+        raise AssertionError("an unencodable gift was not serialized the regular way")
+    fuzzy_system.set_catalog(snapshot.catalog)
+    
+    print(f"   ✅ {len(rebuilt)} gifts pre-rendered; responses match their models")
+    
+except Exception as e:
+    print(f"   ❌ Error in pre-rendered responses: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣7️⃣ Testing admin authentication...")
+try:
+    import logging
+    from fastapi.testclient import TestClient
+    import main
+    
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    client = TestClient(main.app)
+    token = main.ADMIN_TOKEN
+    try:
+        # Admin endpoints are disabled without a configured token
+        main.ADMIN_TOKEN = ''
+        for headers in ({}, {"X-Admin-Token": ""}, {"X-Admin-Token": "guess"}):
+            if client.get("/api/admin/catalog", headers=headers).status_code != 403:
+                raise AssertionError(f"admin route answered without a configured token ({headers})")
+        
+        if main.profile_trigger(x_profile='1', x_admin_token='') is not None:
+            raise AssertionError("X-Profile was honoured without a configured token")
+        
+        main.ADMIN_TOKEN = 'test-token'
+        triggers = [main.profile_trigger(x_profile='1', x_admin_token=sent)
+                    for sent in (None, 'wrong-token', 'test-token')]
+        if triggers != [None, None, 'header']:
+            raise AssertionError(f"X-Profile triggered {triggers} without, with a wrong and with the token")
+        for headers in ({}, {"X-Admin-Token": "wrong-token"}):
+            if client.get("/api/admin/catalog", headers=headers).status_code != 403:
+                raise AssertionError(f"admin route answered with {headers or 'no token'}")
+        if client.get("/api/admin/catalog", headers={"X-Admin-Token": "test-token"}).status_code != 200:
+            raise AssertionError("admin route rejected the configured token")
+        
+        # Anonymous clients cannot change the catalog
+        gift = fuzzy_system.gifts[0]
+        count = len(fuzzy_system.catalog)
+        for headers in ({}, {"X-Admin-Token": "wrong-token"}):
+            responses = [
+                client.post("/api/admin/gifts", json={"delete": [gift['id']]}, headers=headers),
+                client.put(f"/api/admin/gifts/{gift['id']}", json=dict(gift, amazon_link="https://example.com"), headers=headers),
+                client.delete(f"/api/admin/gifts/{gift['id']}", headers=headers),
+            ]
+            if any(response.status_code != 403 for response in responses):
+                raise AssertionError(f"gift update accepted with {headers or 'no token'}")
+        if len(fuzzy_system.catalog) != count or fuzzy_system.gifts[0] != gift:
+            raise AssertionError("rejected gift updates changed the catalog")
+    finally:
+        main.ADMIN_TOKEN = token
+    
+    print("   ✅ Admin routes reject missing, wrong and unconfigured tokens")
+    
+except Exception as e:
+    print(f"   ❌ Error in admin authentication: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
+print("\n2️⃣8️⃣ Testing sessions with fewer than five pairs...")
+try:
+    from pydantic import ValidationError
+    from models import SelectedImages
+
+    logging.getLogger('main').setLevel(logging.WARNING)
+
+    if SelectedImages(image0='a', image1='b', image2='c').gift_ids() != ['a', 'b', 'c']:
+        raise AssertionError("three selections were not accepted")
+    if SelectedImages(**{f'image{i}': str(i) for i in range(7)}).gift_ids() != [str(i) for i in range(7)]:
+        raise AssertionError("selections after the fifth round were not kept in order")
+    for gap in ({'image0': 'a', 'image2': 'c'}, {'image0': 'a', 'image1': 'b', 'image6': 'g'}):
+        try:
+            SelectedImages(**gap)
+        except ValidationError:
+            pass
+        else:
+            raise AssertionError(f"selections with a missing round were accepted: {sorted(gap)}")
+
+    profile = {'user': dict(user_data), 'other': dict(recipient_data)}
+    response = client.post("/api/generate-image-pairs", json=dict(profile, numPairs=3, seed=7))
+    if response.status_code != 200 or len(response.json()['imagePairs']) != 3:
+        raise AssertionError(f"numPairs=3 returned {response.status_code}: {response.text[:200]}")
+    body = response.json()
+    selected = {f'image{i}': pair[0]['value'] for i, pair in enumerate(body['imagePairs'])}
+
+    response = client.post("/api/generate-final-images", json=dict(
+        profile, selectedImages=selected, sessionId=body['sessionId']
+    ))
+    if response.status_code != 200 or not response.json()['finalImages']:
+        raise AssertionError(f"answers to 3 pairs returned {response.status_code}: {response.text[:200]}")
+
+    # Answers that don't match the pairs of the session are rejected
+    response = client.post("/api/generate-final-images", json=dict(
+        profile, selectedImages=dict(selected, image3=selected['image0']), sessionId=body['sessionId']
+    ))
+    if response.status_code != 400:
+        raise AssertionError(f"4 answers to 3 pairs returned {response.status_code}")
+
+    print("   ✅ Sessions of 3 pairs take exactly 3 selections")
+
+except Exception as e:
+    print(f"   ❌ Error in short sessions: {e}")
+    import traceback
+    traceback.print_exc()
+    sys.exit(1)
+
 # All tests passed
 print("\n" + "=" * 60)
 print("✅ All tests passed! The fuzzy logic system is ready.")
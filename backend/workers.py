@@ -0,0 +1,307 @@
+"""
+Process-Pool Scoring Workers
+============================
+Scores requests on a pool of worker processes, so a multi-core machine is
+not limited to one core by the GIL.
+
+The worker processes are started once. For every catalog (and rule base)
+they score, the parent publishes the catalog's column arrays in shared
+memory, or, when the catalog is memory-mapped from an artifact, just its
+path; each worker attaches to them and builds its own compiled fuzzy engine
+the first time a task names that catalog. Reloads and gift updates thus
+publish a new catalog to the running workers instead of starting new ones.
+Tasks only carry the request data and the catalog's small binding, and
+results only carry the top-N catalog indices and scores; the parent
+process turns them into gift dictionaries.
+"""
+
+import itertools
+import multiprocessing
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from artifact import open_catalog_path
+from catalog import GiftCatalog
+
+
+class SharedCatalog:
+    """
+    The column arrays of a GiftCatalog, copied into shared memory.
+
+    ``handle`` is a small picklable description of the blocks that worker
+    processes use to attach to them. The owner must call close() to free
+    the blocks.
+
+    A catalog memory-mapped from an artifact is already shared through the
+    page cache, so only its path is handed out and nothing is copied.
+    """
+
+    def __init__(self, catalog: GiftCatalog):
+        """Copy every catalog column into its own shared memory block."""
+        self.blocks: List[shared_memory.SharedMemory] = []
+        if catalog.source is not None:
+            self.handle = {'artifact': catalog.source}
+            return
+
+        columns = {}
+        for name, array in catalog.columns().items():
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            columns[name] = (block.name, array.shape, array.dtype.str)
+        self.handle = {'columns': columns, 'vocabularies': catalog.vocabularies()}
+
+    def close(self):
+        """Release and unlink the shared memory blocks."""
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a shared memory block without taking ownership of it.
+
+    Only SharedCatalog.close unlinks the blocks. Before Python 3.13
+    attaching registers the block with the resource tracker the worker
+    shares with the parent (see WorkerPool), where the parent registered it
+    already; unregistering it here would drop the parent's registration.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def attach_catalog(handle: Dict) -> Tuple[GiftCatalog, List[shared_memory.SharedMemory]]:
+    """
+    Build a GiftCatalog over the shared memory blocks described by handle.
+
+    Returns:
+        Tuple of (catalog, blocks); the blocks must stay referenced for as
+        long as the catalog is used
+    """
+    if 'artifact' in handle:
+        # Workers only rank by index, so the gift records are not opened
+        return open_catalog_path(handle['artifact'], records=False), []
+
+    blocks = []
+    columns = {}
+    for name, (block_name, shape, dtype) in handle['columns'].items():
+        block = _attach_block(block_name)
+        blocks.append(block)
+        columns[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return GiftCatalog.from_columns(columns, handle['vocabularies']), blocks
+
+
+# Catalogs (with their fuzzy systems) each worker process keeps attached
+WORKER_BINDINGS = 2
+
+# State of the current worker process: binding key -> (fuzzy system,
+# shared memory blocks of its catalog), least recently used first
+_worker_systems: 'OrderedDict[int, Tuple[object, List[shared_memory.SharedMemory]]]' = OrderedDict()
+
+# Keys of the catalogs bound to worker pools
+_binding_keys = itertools.count(1)
+
+
+def _worker_system(binding: Tuple[int, Dict, Optional[str]]):
+    """Return this worker's fuzzy system for a binding, attaching to its catalog on first use."""
+    key, handle, rules_path = binding
+    entry = _worker_systems.get(key)
+    if entry is not None:
+        _worker_systems.move_to_end(key)
+        return entry[0]
+
+    from fuzzy_logic import GiftRecommendationFuzzySystem
+
+    catalog, blocks = attach_catalog(handle)
+    system = GiftRecommendationFuzzySystem(catalog=catalog, rules_path=rules_path, prerender=False)
+    _worker_systems[key] = (system, blocks)
+    # Catalogs of retired snapshots are detached once they are no longer
+    # among the most recently used
+    while len(_worker_systems) > WORKER_BINDINGS:
+        _worker_systems.popitem(last=False)
+    return system
+
+
+def _ready() -> bool:
+    return True
+
+
+def _bind(binding: Tuple[int, Dict, Optional[str]]) -> bool:
+    _worker_system(binding)
+    return True
+
+
+def _rank_gifts(binding: Tuple[int, Dict, Optional[str]], user_data: Dict, recipient_data: Dict, top_n: int):
+    return _worker_system(binding).rank_gifts(user_data, recipient_data, top_n)
+
+
+def _rank_refined(
+    binding: Tuple[int, Dict, Optional[str]],
+    user_data: Dict,
+    recipient_data: Dict,
+    selected_indices: List[int],
+    top_n: int,
+    weights: Optional[List[float]]
+):
+    return _worker_system(binding).rank_refined(
+        user_data, recipient_data, selected_indices, top_n, weights=weights
+    )
+
+
+def worker_start_method() -> str:
+    """
+    Return the multiprocessing start method for new worker processes.
+
+    Forked workers inherit the already imported modules instead of
+    re-importing them, but forking a process while other threads run
+    (request threads, the catalog watcher) can deadlock the children on
+    locks those threads held, e.g. in logging or BLAS. So workers are only
+    forked while the calling thread is the only one, which holds when the
+    server starts them; otherwise they are started by a forkserver, or
+    spawned where that is unavailable.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return 'fork'
+    return 'forkserver' if 'forkserver' in methods else 'spawn'
+
+
+class WorkerPool:
+    """
+    The scoring worker processes, started once and shared by every catalog.
+
+    A reload, rule swap or gift update binds the new catalog to the running
+    workers (see bind) instead of starting new ones; the processes stop
+    when the last ranker bound to them is closed.
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        Start the worker processes.
+
+        Args:
+            max_workers: Number of worker processes
+        """
+        self.max_workers = max_workers
+        self._rankers = set()
+        self._lock = threading.Lock()
+
+        self.start_method = worker_start_method()
+        # Workers share the parent's resource tracker when it runs before
+        # they start; a tracker a worker started itself would unlink the
+        # catalog blocks when that worker exits
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context(self.start_method)
+        )
+        # Forked workers are all started by the first task: start them now,
+        # while forking is safe, rather than on a later request
+        try:
+            futures = [self.executor.submit(_ready) for _ in range(max_workers)]
+            for future in futures:
+                future.result()
+        except Exception:
+            self.executor.shutdown(wait=True)
+            raise
+
+    def bind(self, catalog: GiftCatalog, rules_path: Optional[str] = None) -> 'ProcessPoolRanker':
+        """
+        Publish a catalog to the workers and return a ranker scoring it.
+
+        Args:
+            catalog: Catalog to share with the workers
+            rules_path: Rule base file the workers score it with (default:
+                FUZZY_RULES_PATH)
+        """
+        try:
+            ranker = ProcessPoolRanker(self, catalog, rules_path)
+        except Exception:
+            with self._lock:
+                stop = not self._rankers
+            if stop:
+                self.executor.shutdown(wait=True)
+            raise
+        with self._lock:
+            self._rankers.add(ranker)
+        try:
+            ranker.warm()
+        except Exception:
+            ranker.close()
+            raise
+        return ranker
+
+    def _unbind(self, ranker: 'ProcessPoolRanker'):
+        with self._lock:
+            self._rankers.discard(ranker)
+            stop = not self._rankers
+        if stop:
+            self.executor.shutdown(wait=True)
+
+
+class ProcessPoolRanker:
+    """
+    Dispatches ranking calls for one catalog to the scoring worker processes.
+
+    Each task carries a small binding (a key, the shared catalog handle and
+    the rule base path); a worker attaches to the catalog the first time it
+    sees the binding and keeps it for the following tasks.
+
+    Calls block the calling thread until a worker returns, so they are meant
+    to be made from the scoring thread pool (see executor.py).
+    """
+
+    def __init__(self, pool: WorkerPool, catalog: GiftCatalog, rules_path: Optional[str] = None):
+        """
+        Publish the catalog; use WorkerPool.bind to create rankers.
+
+        Args:
+            pool: Worker processes to rank on
+            catalog: Catalog to share with the workers
+            rules_path: Rule base file the workers score with (default:
+                FUZZY_RULES_PATH)
+        """
+        self.pool = pool
+        self.shared = SharedCatalog(catalog)
+        self.binding = (next(_binding_keys), self.shared.handle, rules_path)
+
+    @property
+    def max_workers(self) -> int:
+        return self.pool.max_workers
+
+    def warm(self):
+        """Have the workers attach to the catalog before the first request needs it."""
+        futures = [self.pool.executor.submit(_bind, self.binding) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+    def rank_gifts(self, user_data: Dict, recipient_data: Dict, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Run GiftRecommendationFuzzySystem.rank_gifts on a worker."""
+        return self.pool.executor.submit(_rank_gifts, self.binding, user_data, recipient_data, top_n).result()
+
+    def rank_refined(
+        self,
+        user_data: Dict,
+        recipient_data: Dict,
+        selected_indices: List[int],
+        top_n: int,
+        weights: Optional[List[float]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Run GiftRecommendationFuzzySystem.rank_refined on a worker."""
+        return self.pool.executor.submit(
+            _rank_refined, self.binding, user_data, recipient_data, selected_indices, top_n, weights
+        ).result()
+
+    def close(self):
+        """Free the shared catalog, and stop the workers if no other catalog is bound to them."""
+        self.shared.close()
+        self.pool._unbind(self)
@@ -12,6 +12,7 @@ class DataService {
     this.userData = null; // { age, budget, relationship, occasion }
     this.otherPersonData = null; // { gender, personality, technical, creative, managerial, academic, style }
     this.imagePairs = null; // array of pairs, e.g., [[url1,url2], ...]
+    this.sessionId = null; // lets the backend reuse the scores of the pairs
     this.selecteImagePairs = null;
     this.finalImages = null;
   }
@@ -43,6 +44,7 @@ class DataService {
     this.userData = null;
     this.otherPersonData = null;
     this.imagePairs = null;
+    this.sessionId = null;
     this.selecteImagePairs = null;
   }
 
@@ -76,6 +78,7 @@ class DataService {
       const data = await res.json();
       // Expecting { imagePairs: [[imgA, imgB], ...] }
       this.imagePairs = data?.imagePairs || null;
+      this.sessionId = data?.sessionId || null;
       return this.imagePairs;
     } catch (error) {
       console.error("Error fetching image pairs:", error);
@@ -116,6 +119,7 @@ class DataService {
       user: this.userData,
       other: this.otherPersonData,
       selectedImages: this.selecteImagePairs,
+      sessionId: this.sessionId,
     };
 
     const url = `${API_BASE_URL}/api/generate-final-images`;